@@ -13,6 +13,7 @@ import random
 import string
 import httpx
 import asyncio
+import copy
 from itertools import chain
 from typing import Dict, List, Optional
 import sys
@@ -37,8 +38,13 @@ CLASH_API_HOST = "127.0.0.1"
 CLASH_API_SECRET = ""
 TIMEOUT = 1
 MAX_CONCURRENT_TESTS = 100
+TEST_MODE = "group" # group: 节点分成测速组，调用mihomo /group/{name}/delay 批量测速；proxy: 逐个节点测速
+GROUP_TEST_SIZE = 100 # 每个测速组的节点数
+MAX_CONCURRENT_GROUPS = 2 # 同时测速的组数
+TEST_GROUP_PREFIX = "测速组-"
 LIMIT = 10000 # 最多保留LIMIT个节点
 CONFIG_FILE = 'clash_config.yaml'
+REQUEST_TIMEOUT = 30 # 拉取订阅源的超时时间(秒)
 INPUT = "input" # 从文件中加载代理节点，支持yaml/yml、txt(每条代理链接占一行)
 BAN = ["中国", "China", "CN", "电信", "移动", "联通"]
 headers = {
@@ -1221,6 +1227,155 @@ clash_config_template = {
     ]
 }
 
+# 节点基类，使用 __slots__ 代替 dict 保存节点，大批量节点时显著减少内存占用
+# 支持 node["name"]、node.get("password") 等 dict 式访问，生成配置时再通过 to_clash() 转换为 Clash 节点字典
+class ProxyNode:
+    __slots__ = ('name', 'server', 'port')
+    type = ''
+    # Clash 字段名 -> 属性名
+    _keys = {"skip-cert-verify": "skip_cert_verify", "alterId": "alter_id"}
+    # 不单独存储、由 to_clash() 推导出的字段
+    _derived = ()
+
+    _fields = __slots__
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._fields = ProxyNode.__slots__ + cls.__slots__
+
+    def __init__(self, **kwargs):
+        for attr, value in kwargs.items():
+            setattr(self, attr, value)
+
+    def get(self, key, default=None):
+        if key == 'type':
+            return self.type
+        attr = self._keys.get(key, key)
+        if attr in self._fields:
+            return getattr(self, attr)
+        if key in self._derived:
+            return self.to_clash().get(key, default)
+        return default
+
+    def __getitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        return self.get(key)
+
+    def __setitem__(self, key, value):
+        setattr(self, self._keys.get(key, key), value)
+
+    def __contains__(self, key):
+        return key == 'type' or self._keys.get(key, key) in self._fields or (key in self._derived and key in self.to_clash())
+
+    def copy(self):
+        return type(self)(**{attr: getattr(self, attr) for attr in self._fields})
+
+    def to_clash(self) -> dict:
+        raise NotImplementedError
+
+    @staticmethod
+    def _ws_opts(network, path, host):
+        return {"ws-opts": {"path": path, "headers": {"Host": host}}} if network == "ws" else {}
+
+
+class Hysteria2Node(ProxyNode):
+    __slots__ = ('password', 'sni', 'skip_cert_verify')
+    type = 'hysteria2'
+    _derived = ('auth', 'client-fingerprint')
+
+    def to_clash(self):
+        return {
+            "name": f"{self.name}",
+            "server": self.server,
+            "port": self.port,
+            "type": self.type,
+            "password": self.password,
+            "auth": self.password,
+            "sni": self.sni,
+            "skip-cert-verify": self.skip_cert_verify,
+            "client-fingerprint": "chrome"
+        }
+
+
+class SSNode(ProxyNode):
+    __slots__ = ('cipher', 'password')
+    type = 'ss'
+    _derived = ('udp',)
+
+    def to_clash(self):
+        return {
+            "name": self.name,
+            "type": self.type,
+            "server": self.server,
+            "port": self.port,
+            "cipher": self.cipher,
+            "password": self.password,
+            "udp": True
+        }
+
+
+class TrojanNode(ProxyNode):
+    __slots__ = ('password', 'sni', 'skip_cert_verify')
+    type = 'trojan'
+
+    def to_clash(self):
+        return {
+            "name": self.name,
+            "type": self.type,
+            "server": self.server,
+            "port": self.port,
+            "password": self.password,
+            "sni": self.sni,
+            "skip-cert-verify": self.skip_cert_verify
+        }
+
+
+class VlessNode(ProxyNode):
+    __slots__ = ('uuid', 'security', 'sni', 'skip_cert_verify', 'network', 'ws_path', 'ws_host')
+    type = 'vless'
+    _derived = ('tls', 'ws-opts')
+
+    def to_clash(self):
+        return {
+            "name": self.name,
+            "type": self.type,
+            "server": self.server,
+            "port": self.port,
+            "uuid": self.uuid,
+            "security": self.security,
+            "tls": self.security == "tls",
+            "sni": self.sni,
+            "skip-cert-verify": self.skip_cert_verify,
+            "network": self.network,
+            **self._ws_opts(self.network, self.ws_path, self.ws_host)
+        }
+
+
+class VmessNode(ProxyNode):
+    __slots__ = ('uuid', 'alter_id', 'network', 'tls', 'sni', 'ws_path', 'ws_host')
+    type = 'vmess'
+    _derived = ('cipher', 'ws-opts')
+
+    def to_clash(self):
+        return {
+            "name": self.name,
+            "type": self.type,
+            "server": self.server,
+            "port": self.port,
+            "uuid": self.uuid,
+            "alterId": self.alter_id,
+            "cipher": "auto",
+            "network": self.network,
+            "tls": self.tls,
+            "sni": self.sni,
+            **self._ws_opts(self.network, self.ws_path, self.ws_host)
+        }
+
+# 节点转换为 Clash 节点字典，yaml 中加载的节点本身就是 dict
+def node_to_clash(node):
+    return node.to_clash() if isinstance(node, ProxyNode) else node
+
 # 解析 Hysteria2 链接
 def parse_hysteria2_link(link):
     link = link[14:]
@@ -1234,17 +1389,7 @@ def parse_hysteria2_link(link):
     sni = query_params.get('sni', [''])[0]
     name = urllib.parse.unquote(link.split('#')[-1].strip())
 
-    return {
-        "name": f"{name}",
-        "server": server,
-        "port": port,
-        "type": "hysteria2",
-        "password": uuid,
-        "auth": uuid,
-        "sni": sni,
-        "skip-cert-verify": not insecure,
-        "client-fingerprint": "chrome"
-    }
+    return Hysteria2Node(name=name, server=server, port=port, password=uuid, sni=sni, skip_cert_verify=not insecure)
 
 # 解析 Shadowsocks 链接
 def parse_ss_link(link):
@@ -1259,15 +1404,7 @@ def parse_ss_link(link):
     server_info = config_part.split('@')[1]
     server, port = server_info.split(':') if ":" in server_info else (server_info, "")
 
-    return {
-        "name": urllib.parse.unquote(name),
-        "type": "ss",
-        "server": server,
-        "port": int(port),
-        "cipher": cipher,
-        "password": password,
-        "udp": True
-    }
+    return SSNode(name=urllib.parse.unquote(name), server=server, port=int(port), cipher=sys.intern(cipher), password=password)
 
 # 解析 Trojan 链接
 def parse_trojan_link(link):
@@ -1277,16 +1414,16 @@ def parse_trojan_link(link):
     username, password = user_info.split(':') if ":" in user_info else ("", user_info)
     host, port_and_query = host_info.split(':') if ":" in host_info else (host_info, "")
     port, query = port_and_query.split('?', 1) if '?' in port_and_query else (port_and_query, "")
+    query_params = urllib.parse.parse_qs(query)
 
-    return {
-        "name": urllib.parse.unquote(name),
-        "type": "trojan",
-        "server": host,
-        "port": int(port),
-        "password": password,
-        "sni": urllib.parse.parse_qs(query).get("sni", [""])[0],
-        "skip-cert-verify": urllib.parse.parse_qs(query).get("skip-cert-verify", ["false"])[0] == "true"
-    }
+    return TrojanNode(
+        name=urllib.parse.unquote(name),
+        server=host,
+        port=int(port),
+        password=password,
+        sni=query_params.get("sni", [""])[0],
+        skip_cert_verify=query_params.get("skip-cert-verify", ["false"])[0] == "true"
+    )
 
 # 解析 VLESS 链接
 def parse_vless_link(link):
@@ -1297,25 +1434,20 @@ def parse_vless_link(link):
     host, query = host_info.split('?', 1) if '?' in host_info else (host_info, "")
     port = host.split(':')[-1] if ':' in host else ""
     host = host.split(':')[0] if ':' in host else ""
-
-    return {
-        "name": urllib.parse.unquote(name),
-        "type": "vless",
-        "server": host,
-        "port": int(port),
-        "uuid": uuid,
-        "security": urllib.parse.parse_qs(query).get("security", ["none"])[0],
-        "tls": urllib.parse.parse_qs(query).get("security", ["none"])[0] == "tls",
-        "sni": urllib.parse.parse_qs(query).get("sni", [""])[0],
-        "skip-cert-verify": urllib.parse.parse_qs(query).get("skip-cert-verify", ["false"])[0] == "true",
-        "network": urllib.parse.parse_qs(query).get("type", ["tcp"])[0],
-        "ws-opts": {
-            "path": urllib.parse.parse_qs(query).get("path", [""])[0],
-            "headers": {
-                "Host": urllib.parse.parse_qs(query).get("host", [""])[0]
-            }
-        } if urllib.parse.parse_qs(query).get("type", ["tcp"])[0] == "ws" else {}
-    }
+    query_params = urllib.parse.parse_qs(query)
+
+    return VlessNode(
+        name=urllib.parse.unquote(name),
+        server=host,
+        port=int(port),
+        uuid=uuid,
+        security=sys.intern(query_params.get("security", ["none"])[0]),
+        sni=query_params.get("sni", [""])[0],
+        skip_cert_verify=query_params.get("skip-cert-verify", ["false"])[0] == "true",
+        network=sys.intern(query_params.get("type", ["tcp"])[0]),
+        ws_path=query_params.get("path", [""])[0],
+        ws_host=query_params.get("host", [""])[0]
+    )
 
 # 解析 VMESS 链接
 def parse_vmess_link(link):
@@ -1323,31 +1455,25 @@ def parse_vmess_link(link):
     decoded_link = base64.urlsafe_b64decode(link + '=' * (-len(link) % 4)).decode("utf-8")
     vmess_info = json.loads(decoded_link)
 
-    return {
-        "name": urllib.parse.unquote(vmess_info.get("ps", "vmess")),
-        "type": "vmess",
-        "server": vmess_info["add"],
-        "port": int(vmess_info["port"]),
-        "uuid": vmess_info["id"],
-        "alterId": int(vmess_info.get("aid", 0)),
-        "cipher": "auto",
-        "network": vmess_info.get("net", "tcp"),
-        "tls": vmess_info.get("tls", "") == "tls",
-        "sni": vmess_info.get("sni", ""),
-        "ws-opts": {
-            "path": vmess_info.get("path", ""),
-            "headers": {
-                "Host": vmess_info.get("host", "")
-            }
-        } if vmess_info.get("net", "tcp") == "ws" else {}
-    }
+    return VmessNode(
+        name=urllib.parse.unquote(vmess_info.get("ps", "vmess")),
+        server=vmess_info["add"],
+        port=int(vmess_info["port"]),
+        uuid=vmess_info["id"],
+        alter_id=int(vmess_info.get("aid", 0)),
+        network=sys.intern(vmess_info.get("net", "tcp")),
+        tls=vmess_info.get("tls", "") == "tls",
+        sni=vmess_info.get("sni", ""),
+        ws_path=vmess_info.get("path", ""),
+        ws_host=vmess_info.get("host", "")
+    )
 
 # 解析ss订阅源
 def parse_ss_sub(link):
     new_links = []
     try:
         # 发送请求并获取内容
-        response = requests.get(link, headers=headers, verify=False, allow_redirects=True)
+        response = requests.get(link, headers=headers, verify=False, allow_redirects=True, timeout=REQUEST_TIMEOUT)
         if response.status_code == 200:
             data = response.json()
             new_links = [{"name": x['remarks'], "type": "ss", "server": x['server'], "port": x['server_port'], "cipher": x['method'],"password": x['password'], "udp": True} for x in data]
@@ -1359,7 +1485,7 @@ def parse_ss_sub(link):
 def parse_md_link(link):
     try:
         # 发送请求并获取内容
-        response = requests.get(link)
+        response = requests.get(link, timeout=REQUEST_TIMEOUT)
         response.raise_for_status()  # 检查请求是否成功
         content = response.text
         content = urllib.parse.unquote(content)
@@ -1401,12 +1527,19 @@ def match_nodes(text):
     yaml_data = {"proxies": proxies_list}
     return yaml_data
 
+# base64订阅内容解码为代理链接列表
+def decode_base64_content(content):
+    decoded_bytes = base64.b64decode(content)
+    decoded_content = decoded_bytes.decode('utf-8')
+    decoded_content = urllib.parse.unquote(decoded_content)
+    return decoded_content.splitlines()
+
 # link非代理协议时(https)，请求url解析
 def process_url(url):
     isyaml = False
     try:
         # 发送GET请求
-        response = requests.get(url, headers=headers, verify=False, allow_redirects=True)
+        response = requests.get(url, headers=headers, verify=False, allow_redirects=True, timeout=REQUEST_TIMEOUT)
         # 确保响应状态码为200
         if response.status_code == 200:
             content = response.content.decode('utf-8')
@@ -1420,10 +1553,7 @@ def process_url(url):
             else:
                 # 尝试Base64解码
                 try:
-                    decoded_bytes = base64.b64decode(content)
-                    decoded_content = decoded_bytes.decode('utf-8')
-                    decoded_content = urllib.parse.unquote(decoded_content)
-                    return decoded_content.splitlines(),isyaml
+                    return decode_base64_content(content),isyaml
                 except Exception as e:
                     try:
                         res = js_render(url)
@@ -1550,15 +1680,37 @@ def handle_links(new_links,resolve_name_conflicts):
     except Exception as e:
         pass
 
-# 生成 Clash 配置文件
-def generate_clash_config(links,load_nodes):
-    now = datetime.now()
-    print(f"当前时间: {now}\n---")
+# 解析单个link(代理链接或订阅地址)，返回节点列表
+def fetch_link_nodes(link):
+    nodes = []
+    if link.startswith(("hysteria2://", "hy2://","trojan://", "ss://", "vless://", "vmess://")):
+        node = parse_proxy_link(link)
+        nodes.append(node)
+    else:
+        if '|links' in link or '.md' in link:
+            link = link.replace('|links', '')
+            new_links = parse_md_link(link)
+            handle_links(new_links,nodes.append)
+        if '|ss' in link:
+            link = link.replace('|ss', '')
+            new_links = parse_ss_sub(link)
+            nodes.extend(new_links)
+        if '{' in link:
+            link = resolve_template_url(link)
+        print(f'当前正在处理link: {link}')
+        # 处理非特定协议的链接
+        new_links,isyaml = process_url(link)
+        if isyaml:
+            nodes.extend(new_links)
+        else:
+            handle_links(new_links, nodes.append)
+    return nodes
 
+# 根据节点列表构建 Clash 配置：过滤、重名处理、去重并填充策略组
+def build_clash_config(nodes):
     final_nodes = []
     existing_names = set()  # 存储所有节点名字以检查重复
-    config = clash_config_template.copy()
-
+    config = copy.deepcopy(clash_config_template)
 
     # 名称已存在的节点加随机后缀
     def resolve_name_conflicts(node):
@@ -1570,35 +1722,9 @@ def generate_clash_config(links,load_nodes):
             node["name"] = name
             final_nodes.append(node)
 
-    for node in load_nodes:
+    for node in nodes:
         resolve_name_conflicts(node)
 
-
-    for link in links:
-        if link.startswith(("hysteria2://", "hy2://","trojan://", "ss://", "vless://", "vmess://")):
-            node = parse_proxy_link(link)
-            resolve_name_conflicts(node)
-        else:
-            if '|links' in link or '.md' in link:
-                link = link.replace('|links', '')
-                new_links = parse_md_link(link)
-                handle_links(new_links,resolve_name_conflicts)
-            if '|ss' in link:
-                link = link.replace('|ss', '')
-                new_links = parse_ss_sub(link)
-                for node in new_links:
-                    resolve_name_conflicts(node)
-            if '{' in link:
-                link = resolve_template_url(link)
-            print(f'当前正在处理link: {link}')
-            # 处理非特定协议的链接
-            new_links,isyaml = process_url(link)
-            if isyaml:
-                for node in new_links:
-                    resolve_name_conflicts(node)
-            else:
-                handle_links(new_links, resolve_name_conflicts)
-
     final_nodes = deduplicate_proxies(final_nodes)
 
     for node in final_nodes:
@@ -1608,13 +1734,30 @@ def generate_clash_config(links,load_nodes):
             config["proxy-groups"][1]["proxies"].append(name)
             config["proxy-groups"][2]["proxies"].append(name)
             config["proxy-groups"][3]["proxies"].append(name)
-    config["proxies"] = final_nodes
+    config["proxies"] = [node_to_clash(node) for node in final_nodes]
+    return config
+
+# 写入 Clash 配置文件(yaml和json)
+def write_clash_config(config, config_file=None):
+    config_file = config_file or CONFIG_FILE
+    with open(config_file, "w", encoding="utf-8") as f:
+        yaml.dump(config, f, allow_unicode=True, default_flow_style=False)
+    with open(f'{config_file}.json', "w", encoding="utf-8") as f:
+        json.dump(config,f,ensure_ascii=False)
+    print(f"已经生成Clash配置文件{config_file}|{config_file}.json")
+
+# 生成 Clash 配置文件
+def generate_clash_config(links,load_nodes):
+    now = datetime.now()
+    print(f"当前时间: {now}\n---")
+
+    nodes = list(load_nodes)
+    for link in links:
+        nodes.extend(fetch_link_nodes(link))
+
+    config = build_clash_config(nodes)
     if config["proxies"]:
-        with open(CONFIG_FILE, "w", encoding="utf-8") as f:
-            yaml.dump(config, f, allow_unicode=True, default_flow_style=False)
-        with open(f'{CONFIG_FILE}.json', "w", encoding="utf-8") as f:
-            json.dump(config,f,ensure_ascii=False)
-        print(f"已经生成Clash配置文件{CONFIG_FILE}|{CONFIG_FILE}.json")
+        write_clash_config(config)
     else:
         print('没有节点数据更新')
 
@@ -1871,6 +2014,8 @@ class ClashAPI:
         }
         self.client = httpx.AsyncClient(timeout=1)
         self.semaphore = Semaphore(MAX_CONCURRENT_TESTS)
+        self.group_semaphore = Semaphore(MAX_CONCURRENT_GROUPS)
+        self.group_delay_supported = True
         self._test_results_cache: Dict[str, ProxyTestResult] = {}
 
     async def __aenter__(self):
@@ -1917,13 +2062,35 @@ class ClashAPI:
         except httpx.RequestError as e:
             raise ClashAPIException(f"请求错误: {e}")
 
-    async def test_proxy_delay(self, proxy_name: str) -> ProxyTestResult:
-        """测试指定代理节点的延迟，使用缓存避免重复测试"""
+    async def reload_config(self, config: Dict) -> bool:
+        """热重载配置，无需重启 mihomo 进程；配置内容通过 payload 发送，不受 mihomo 对配置文件路径(SAFE_PATHS)的限制"""
+        if not self.base_url:
+            raise ClashAPIException("未建立与 Clash API 的连接")
+
+        try:
+            response = await self.client.put(
+                f"{self.base_url}/configs",
+                headers=self.headers,
+                params={"force": "true"},
+                json={"payload": json.dumps(config, ensure_ascii=False)},
+                timeout=30
+            )
+            response.raise_for_status()
+            return True
+        except httpx.HTTPStatusError as e:
+            print(f"重载配置失败: {e.response.status_code} {e.response.text}")
+            return False
+        except httpx.HTTPError as e:
+            print(f"重载配置失败: {e}")
+            return False
+
+    async def test_proxy_delay(self, proxy_name: str, use_cache: bool = True) -> ProxyTestResult:
+        """测试指定代理节点的延迟，使用缓存避免重复测试；use_cache=False 时总是重新测试(常驻模式滚动重测)"""
         if not self.base_url:
             raise ClashAPIException("未建立与 Clash API 的连接")
 
         # 检查缓存
-        if proxy_name in self._test_results_cache:
+        if use_cache and proxy_name in self._test_results_cache:
             cached_result = self._test_results_cache[proxy_name]
             # 如果测试结果不超过60秒，直接返回缓存的结果
             if (datetime.now() - cached_result.tested_time).total_seconds() < 60:
@@ -1949,6 +2116,55 @@ class ClashAPI:
                 self._test_results_cache[proxy_name] = result
                 return result
 
+    async def test_group_delay(self, group_name: str, proxies: List[str]) -> Optional[List[ProxyTestResult]]:
+        """调用策略组测速接口，由内核一次测完组内所有节点；接口不可用时返回 None"""
+        if not self.base_url:
+            raise ClashAPIException("未建立与 Clash API 的连接")
+        if not self.group_delay_supported:
+            return None
+
+        async with self.group_semaphore:
+            try:
+                response = await self.client.get(
+                    f"{self.base_url}/group/{group_name}/delay",
+                    headers=self.headers,
+                    params={"url": TEST_URL, "timeout": int(TIMEOUT * 1000)},
+                    timeout=TIMEOUT + 10
+                )
+            except httpx.TimeoutException:
+                # 内核超时仍未返回，视为组内节点全部超时
+                response = None
+            except httpx.HTTPError as e:
+                print(f"\n测速组 {group_name} 请求失败，改为逐个节点测试: {e}")
+                return None
+            if response is not None and response.status_code in (404, 405):
+                # 旧内核不支持组测速
+                self.group_delay_supported = False
+                print("\n当前内核不支持策略组测速，回退到逐个节点测试")
+                return None
+            # 只有 504(组内节点全部超时)和请求超时视为全部失败，其余错误(401/500/503、响应无法解析)回退到逐个节点测试
+            if response is None or response.status_code == 504:
+                delays = {}
+            elif response.status_code != 200:
+                print(f"\n测速组 {group_name} 返回 {response.status_code}，改为逐个节点测试: {response.text[:200]}")
+                return None
+            else:
+                try:
+                    delays = response.json()
+                except ValueError as e:
+                    print(f"\n测速组 {group_name} 响应无法解析，改为逐个节点测试: {e}")
+                    return None
+                if not isinstance(delays, dict):
+                    print(f"\n测速组 {group_name} 响应格式错误，改为逐个节点测试")
+                    return None
+
+        results = []
+        for name in proxies:
+            result = ProxyTestResult(name, delays.get(name) or None)
+            self._test_results_cache[name] = result
+            results.append(result)
+        return results
+
 # 更新clash配置
 class ClashConfig:
     """Clash 配置管理类"""
@@ -2086,6 +2302,42 @@ async def test_group_proxies(clash_api: ClashAPI, proxies: List[str]) -> List[Pr
 
     return results
 
+# 将节点切分为测速组
+def make_test_groups(proxies: List[str]) -> List[Dict]:
+    return [{"name": f"{TEST_GROUP_PREFIX}{i // GROUP_TEST_SIZE + 1}", "type": "select", "proxies": proxies[i:i + GROUP_TEST_SIZE]}
+            for i in range(0, len(proxies), GROUP_TEST_SIZE)]
+
+# 按测速组批量测试，组测速不可用时该组回退到逐个节点测试
+async def test_proxies_by_groups(clash_api: ClashAPI, test_groups: List[Dict]) -> List[ProxyTestResult]:
+    """按测速组批量测试节点"""
+    total = sum(len(g["proxies"]) for g in test_groups)
+    print(f"开始按测速组测试 {total} 个节点 ({len(test_groups)} 组，每组最多 {GROUP_TEST_SIZE} 个，最大并发组数: {MAX_CONCURRENT_GROUPS})")
+
+    async def test_one_group(group):
+        group_results = await clash_api.test_group_delay(group["name"], group["proxies"])
+        if group_results is None:
+            group_results = await asyncio.gather(*(clash_api.test_proxy_delay(name) for name in group["proxies"]))
+        return group_results
+
+    results = []
+    for future in asyncio.as_completed([test_one_group(g) for g in test_groups]):
+        results.extend(await future)
+        # 显示进度
+        done = len(results)
+        print(f"\r进度: {done}/{total} ({done / total * 100:.1f}%)", end="", flush=True)
+
+    return results
+
+# 生成带测速组的配置并热重载，重载失败时回退到逐个节点测试
+async def test_proxies_in_groups(clash_api: ClashAPI, config: ClashConfig, proxies: List[str]) -> List[ProxyTestResult]:
+    test_groups = make_test_groups(proxies)
+    test_config = dict(config.config)
+    test_config["proxy-groups"] = config.proxy_groups + test_groups
+    if not await clash_api.reload_config(test_config):
+        print("加载测速组失败，回退到逐个节点测试")
+        return await test_group_proxies(clash_api, proxies)
+    return await test_proxies_by_groups(clash_api, test_groups)
+
 async def proxy_clean():
     # 更新全局配置
     global MAX_CONCURRENT_TESTS, TIMEOUT, CLASH_API_SECRET, LIMIT, CONFIG_FILE
@@ -2094,6 +2346,7 @@ async def proxy_clean():
     print(f"配置文件: {CONFIG_FILE}")
     print(f"API 端口: {CLASH_API_PORTS[0]}")
     print(f"并发数量: {MAX_CONCURRENT_TESTS}")
+    print(f"测速模式: {'测速组批量测速' if TEST_MODE == 'group' else '逐个节点测速'}")
     print(f"超时时间: {TIMEOUT}秒")
     print(f"保留节点：最多保留{LIMIT}个延迟最小的有效节点")
 
@@ -2136,7 +2389,10 @@ async def proxy_clean():
                 print(f"策略组 '{group_name}' 中没有代理节点")
             else:
                 # 测试该组的所有节点
-                results = await test_group_proxies(clash_api, proxies)
+                if TEST_MODE == "group":
+                    results = await test_proxies_in_groups(clash_api, config, proxies)
+                else:
+                    results = await test_group_proxies(clash_api, proxies)
                 all_test_results.extend(results)
                 # 打印测试结果摘要
                 print_test_summary(group_name, results)
@@ -2149,7 +2405,8 @@ async def proxy_clean():
             proxy_names = set()
             # 只对一个group的proxies排序即可
             group_proxies = config.get_group_proxies(group_name)
-            group_results = [r for r in all_test_results if r.name in group_proxies]
+            # 测速结果按完成顺序返回，先按延迟排序再截取，保留的才是延迟最小的节点
+            group_results = sorted((r for r in all_test_results if r.name in group_proxies), key=lambda r: r.delay)
             if LIMIT:
                 group_results = group_results[:LIMIT]
             for r in group_results:
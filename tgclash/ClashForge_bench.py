@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+# !/usr/bin/env python3
+'''
+ClashForge 离线性能基准测试，不访问网络
+生成合成语料(5种协议分享链接、base64订阅、大体积yaml)，对以下环节计时:
+parse_proxy_link / decode_base64_content / read_yaml_files / deduplicate_proxies / generate_clash_config / ClashConfig加载与保存
+并用 tracemalloc 统计节点常驻内存(__slots__ 节点对比 dict 节点)
+--tester 指定节点数时，启动本地模拟控制器(mock_mihomo.py)压测 test_group_proxies 的吞吐和并发
+结果写入json，可用 --compare 与其他版本的结果对比
+
+用法:
+python ClashForge_bench.py --sizes 10000,100000 --output bench_new.json --compare bench_old.json
+python ClashForge_bench.py --sizes "" --tester 50000 --mock-delay uniform:50:800 --mock-fail-rate 0.3
+'''
+import argparse
+import base64
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.parse
+import uuid
+import asyncio
+import socket
+import tracemalloc
+
+import yaml
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import ClashForge
+from mock_mihomo import MockMihomo
+
+SIZES = [10000, 100000, 1000000]
+PROTOCOLS = ["hysteria2", "ss", "trojan", "vless", "vmess"]
+CIPHERS = ["aes-128-gcm", "aes-256-gcm", "chacha20-ietf-poly1305"]
+REGIONS = ["香港", "日本", "新加坡", "美国", "台湾", "韩国", "德国", "英国"]
+# 重复节点比例，用于覆盖去重逻辑
+DUP_RATIO = 0.1
+
+
+# 生成单条分享链接
+def make_link(rnd, protocol, i):
+    server = f"{rnd.randint(1, 223)}.{rnd.randint(0, 255)}.{rnd.randint(0, 255)}.{rnd.randint(1, 254)}"
+    port = rnd.randint(1024, 65535)
+    name = urllib.parse.quote(f"{rnd.choice(REGIONS)}-{protocol}-{i}")
+    uid = str(uuid.UUID(int=rnd.getrandbits(128)))
+    if protocol == "hysteria2":
+        return f"hysteria2://{uid}@{server}:{port}/?sni=bench{i}.example.com&insecure=0#{name}"
+    if protocol == "ss":
+        userinfo = base64.urlsafe_b64encode(f"{rnd.choice(CIPHERS)}:{uid}".encode()).decode().rstrip('=')
+        return f"ss://{userinfo}@{server}:{port}#{name}"
+    if protocol == "trojan":
+        return f"trojan://{uid}@{server}:{port}?sni=bench{i}.example.com&skip-cert-verify=true#{name}"
+    if protocol == "vless":
+        return f"vless://{uid}@{server}:{port}?security=tls&sni=bench{i}.example.com&type=ws&path=%2Fws&host=bench{i}.example.com#{name}"
+    vmess_info = {"v": "2", "ps": urllib.parse.unquote(name), "add": server, "port": str(port), "id": uid, "aid": "0",
+                  "net": "ws", "type": "none", "host": f"bench{i}.example.com", "path": "/ws", "tls": "tls", "sni": f"bench{i}.example.com"}
+    return "vmess://" + base64.urlsafe_b64encode(json.dumps(vmess_info).encode()).decode()
+
+
+# 生成n条分享链接，五种协议均匀分布，并混入一定比例的重复节点
+def make_links(n, seed=0):
+    rnd = random.Random(seed)
+    unique = n - int(n * DUP_RATIO)
+    links = [make_link(rnd, PROTOCOLS[i % len(PROTOCOLS)], i) for i in range(unique)]
+    links.extend(rnd.choice(links) for _ in range(n - unique))
+    rnd.shuffle(links)
+    return links
+
+
+# 生成base64订阅内容
+def make_base64_sub(links):
+    return base64.b64encode("\n".join(links).encode('utf-8')).decode()
+
+
+# 对函数计时，返回每轮耗时(秒)
+def timeit(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+    return timings
+
+
+# 汇总单个基准结果
+def summarize(name, size, timings):
+    best = min(timings)
+    return {
+        "name": name,
+        "size": size,
+        "repeat": len(timings),
+        "min": best,
+        "median": statistics.median(timings),
+        "mean": statistics.mean(timings),
+        "ops_per_sec": size / best if best else None,
+    }
+
+
+# 统计func返回对象的常驻内存(字节)
+def measure_memory(name, size, func):
+    tracemalloc.start()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            before = tracemalloc.get_traced_memory()[0]
+            nodes = func()
+            current = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    del nodes
+    return {"name": name, "size": size, "bytes": current, "bytes_per_node": current / size if size else None}
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+# 运行指定规模的全部基准
+def run_size(size, repeat, workdir):
+    results = []
+    links = make_links(size)
+    print(f"\n===================语料规模: {size}======================")
+
+    def record(name, func):
+        r = summarize(name, size, timeit(func, repeat))
+        results.append(r)
+        print(f"{name:<28} min {r['min']:.3f}s  median {r['median']:.3f}s  {r['ops_per_sec']:.0f} ops/s")
+
+    record("parse_proxy_link", lambda: [ClashForge.parse_proxy_link(link) for link in links])
+    for name, func in (("nodes_memory_slots", lambda: [ClashForge.parse_proxy_link(link) for link in links]),
+                       ("nodes_memory_dict", lambda: [ClashForge.parse_proxy_link(link).to_clash() for link in links])):
+        r = measure_memory(name, size, func)
+        results.append(r)
+        print(f"{name:<28} {r['bytes'] / 1024 / 1024:.1f}MB  {r['bytes_per_node']:.0f} B/node")
+
+    sub = make_base64_sub(links)
+    record("decode_base64_content", lambda: [ClashForge.parse_proxy_link(link) for link in ClashForge.decode_base64_content(sub)])
+
+    nodes = [ClashForge.parse_proxy_link(link) for link in links]
+    record("deduplicate_proxies", lambda: ClashForge.deduplicate_proxies(nodes))
+
+    # 大体积yaml输入，放到input目录由read_yaml_files加载
+    input_dir = os.path.join(workdir, ClashForge.INPUT)
+    os.makedirs(input_dir, exist_ok=True)
+    yaml_path = os.path.join(input_dir, 'bench.yaml')
+    with open(yaml_path, 'w', encoding='utf-8') as f:
+        yaml.dump({"proxies": [ClashForge.node_to_clash(n) for n in nodes]}, f, allow_unicode=True, default_flow_style=False)
+    record("read_yaml_files", lambda: ClashForge.read_yaml_files(input_dir))
+    os.remove(yaml_path)
+
+    record("generate_clash_config", lambda: ClashForge.generate_clash_config(links, []))
+
+    config_path = os.path.join(workdir, ClashForge.CONFIG_FILE)
+    record("ClashConfig.load", lambda: ClashForge.ClashConfig(config_path))
+    config = ClashForge.ClashConfig(config_path)
+    record("ClashConfig.save", config.save)
+    return results
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+# 启动模拟控制器，压测 test_group_proxies
+def run_tester(size, args):
+    print(f"\n===================测速压测: {size} 个节点======================")
+    port = free_port()
+    mock = MockMihomo.synthetic(size, delay=args.mock_delay, fail_rate=args.mock_fail_rate, latency=args.mock_latency,
+                                time_scale=args.mock_time_scale, group_delay=not args.mock_no_group_delay)
+    names = list(mock.proxies)
+    test_groups = ClashForge.make_test_groups(names)
+    mock.start_in_thread(ClashForge.CLASH_API_HOST, port)
+    ClashForge.CLASH_API_PORTS = [port]
+
+    async def run():
+        async with ClashForge.ClashAPI(ClashForge.CLASH_API_HOST, [port], ClashForge.CLASH_API_SECRET) as clash_api:
+            await clash_api.check_connection()
+            if args.tester_mode == "group":
+                # 与 test_proxies_in_groups 一样通过热重载加载测速组
+                config = {"proxies": list(mock.proxies.values()), "proxy-groups": list(mock.groups.values()) + test_groups}
+                if not await clash_api.reload_config(config):
+                    raise ClashForge.ClashAPIException("加载测速组失败")
+                return await ClashForge.test_proxies_by_groups(clash_api, test_groups)
+            return await ClashForge.test_group_proxies(clash_api, names)
+
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            results = asyncio.run(run())
+            elapsed = time.perf_counter() - start
+    finally:
+        mock.stop()
+    valid = sum(1 for r in results if r.is_valid)
+    name = "test_proxies_by_groups" if args.tester_mode == "group" else "test_group_proxies"
+    r = summarize(name, size, [elapsed])
+    r.update({"valid": valid, "controller_requests": mock.stats["requests"], "max_in_flight": mock.stats["max_in_flight"],
+              "mock": {"delay": args.mock_delay, "fail_rate": args.mock_fail_rate, "latency": args.mock_latency, "time_scale": args.mock_time_scale}})
+    print(f"{name:<28} {elapsed:.3f}s  {r['ops_per_sec']:.0f} nodes/s  可用 {valid}  控制器请求 {r['controller_requests']}  最大并发 {r['max_in_flight']}")
+    return r
+
+
+# 与基线结果对比，输出耗时比值(当前/基线)
+def compare(results, baseline_path):
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    base = {(r['name'], r['size']): r for r in baseline.get('results', [])}
+    print(f"\n===================对比基线: {baseline_path} ({baseline.get('revision', 'unknown')})======================")
+    for r in results:
+        b = base.get((r['name'], r['size']))
+        if not b:
+            continue
+        if 'bytes' in r:
+            ratio = r['bytes'] / b['bytes'] if b.get('bytes') else float('inf')
+            print(f"{r['name']:<28} {r['size']:>8}  {b['bytes'] / 1024 / 1024:.1f}MB -> {r['bytes'] / 1024 / 1024:.1f}MB  x{ratio:.2f}")
+            continue
+        ratio = r['min'] / b['min'] if b['min'] else float('inf')
+        print(f"{r['name']:<28} {r['size']:>8}  {b['min']:.3f}s -> {r['min']:.3f}s  x{ratio:.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ClashForge 离线性能基准测试')
+    parser.add_argument('--sizes', default=','.join(map(str, SIZES)), help='语料规模，逗号分隔')
+    parser.add_argument('--repeat', type=int, default=3, help='每项重复次数，取最小值')
+    parser.add_argument('--output', default='bench_results.json', help='结果输出文件')
+    parser.add_argument('--compare', default='', help='对比的基线结果文件')
+    parser.add_argument('--tester', default='', help='测速压测的节点数，逗号分隔，默认不压测')
+    parser.add_argument('--tester-mode', default='proxy', choices=['proxy', 'group'], help='proxy: 逐个节点测速，group: 测速组批量测速')
+    parser.add_argument('--mock-no-group-delay', action='store_true', help='模拟不支持组测速的旧内核')
+    parser.add_argument('--mock-delay', default='uniform:50:800', help='模拟节点延迟分布(ms)')
+    parser.add_argument('--mock-fail-rate', type=float, default=0.3, help='模拟失效节点比例')
+    parser.add_argument('--mock-latency', type=float, default=0.0, help='模拟控制器请求延迟(ms)')
+    parser.add_argument('--mock-time-scale', type=float, default=0.05, help='模拟等待时间缩放系数')
+    args = parser.parse_args()
+
+    sizes = [int(x) for x in args.sizes.split(',') if x]
+    output = os.path.abspath(args.output)
+    baseline = os.path.abspath(args.compare) if args.compare else ''
+    results = []
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        # generate_clash_config/ClashConfig 读写当前目录，切换到临时目录避免污染
+        os.chdir(workdir)
+        try:
+            for size in sizes:
+                results.extend(run_size(size, args.repeat, workdir))
+        finally:
+            os.chdir(cwd)
+    for size in [int(x) for x in args.tester.split(',') if x]:
+        results.append(run_tester(size, args))
+
+    report = {
+        "revision": git_revision(),
+        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n基准结果已保存到: {output}")
+    if baseline:
+        compare(results, baseline)
+
+
+if __name__ == '__main__':
+    main()
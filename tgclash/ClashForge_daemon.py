@@ -0,0 +1,368 @@
+# -*- coding: utf-8 -*-
+# !/usr/bin/env python3
+'''
+ClashForge 常驻模式，替代定时任务每小时全量跑一次 ClashForge.py
+1. 调度器: 每个订阅源按各自的间隔刷新节点，有变化时重建配置并热重载 mihomo
+2. 滚动测速: 常驻一个 mihomo 进程，每轮只重测一小批最久未测的节点
+3. HTTP 服务: 提供当前最优配置，支持 yaml/json、ETag(304) 和 gzip
+   GET /clash.yaml  GET /clash.json  GET /status
+
+订阅源文件每行一个: <link> [刷新间隔秒数]，INPUT 目录中的 txt/yaml 作为本地源一并加载
+
+用法:
+python ClashForge_daemon.py --sources sources.txt --port 8000 --slice 200 --tick 10
+python ClashForge_daemon.py --sources sources.txt --controller 127.0.0.1:9090   # 使用已运行的控制器(如 mock_mihomo.py)
+'''
+import argparse
+import asyncio
+import functools
+import gzip
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import yaml
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import ClashForge
+
+DEFAULT_INTERVAL = 3600  # 订阅源默认刷新间隔(秒)
+SLICE_SIZE = 200  # 每轮重测的节点数
+TICK = 10  # 滚动测速间隔(秒)
+FETCH_TIMEOUT = 120  # 单轮刷新等待订阅源的最长时间(秒)，超时的在后台继续，完成后再应用
+MAX_FAILS = 3  # 连续失败次数超过后不再出现在最优配置中
+HTTP_HOST = "0.0.0.0"
+HTTP_PORT = 8000
+ALLOWED_TYPES = ["ss", "hysteria2", "hy2", "vless", "vmess", "trojan"]
+
+
+# 读取订阅源文件
+def read_sources(path, default_interval):
+    sources = []
+    if not path or not os.path.exists(path):
+        return sources
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            parts = line.split()
+            interval = int(parts[1]) if len(parts) > 1 else default_interval
+            sources.append({"link": parts[0], "interval": interval})
+    return sources
+
+
+# 重名节点按 类型/服务器/端口 的哈希加后缀，每次重建得到相同的名字，测速结果不会因随机后缀丢失
+def stable_names(nodes):
+    counts = {}
+    for node in nodes:
+        counts[str(node["name"])] = counts.get(str(node["name"]), 0) + 1
+    for node in nodes:
+        name = str(node["name"])
+        if counts[name] > 1:
+            key = f'{node.get("type")}:{node.get("server")}:{node.get("port")}'
+            node["name"] = f"{name}-{hashlib.sha1(key.encode('utf-8')).hexdigest()[:6]}"
+    return nodes
+
+
+class Source:
+    """订阅源及其刷新状态"""
+
+    def __init__(self, link: str, interval: int):
+        self.link = link
+        self.interval = interval
+        self.nodes = []
+        self.fetched_at = 0.0
+        self.digest = ""
+        self.fetching = False
+
+    @property
+    def due(self) -> bool:
+        return time.time() - self.fetched_at >= self.interval
+
+    def fetch(self) -> bool:
+        """拉取节点，返回节点是否有变化"""
+        if self.link == ClashForge.INPUT:
+            nodes = ClashForge.read_yaml_files(folder_path=ClashForge.INPUT)
+            for link in ClashForge.read_txt_files(folder_path=ClashForge.INPUT):
+                if link:
+                    nodes.extend(ClashForge.fetch_link_nodes(link))
+        else:
+            nodes = ClashForge.fetch_link_nodes(self.link)
+        nodes = ClashForge.filter_by_types_alt(ALLOWED_TYPES, [n for n in nodes if n])
+        self.fetched_at = time.time()
+        # 网络错误时 process_url 等返回空列表，保留上次的节点，不当作订阅源已清空
+        if not nodes and self.nodes:
+            print(f"订阅源 {self.link} 本次未获取到节点，保留上次的 {len(self.nodes)} 个节点")
+            return False
+        digest = hashlib.sha1(json.dumps([ClashForge.node_to_clash(n) for n in nodes], sort_keys=True, ensure_ascii=False, default=str).encode('utf-8')).hexdigest()
+        changed = digest != self.digest
+        self.nodes, self.digest = nodes, digest
+        return changed
+
+
+class ConfigHandler(BaseHTTPRequestHandler):
+    """提供最优配置的 HTTP 接口"""
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        daemon = self.server.daemon
+        if url.path == "/status":
+            return self.reply(200, json.dumps(daemon.status(), ensure_ascii=False).encode('utf-8'), "application/json")
+        if url.path in ("/", "/clash.yaml", "/config"):
+            fmt = query.get("format", ["yaml"])[0]
+        elif url.path == "/clash.json":
+            fmt = "json"
+        else:
+            return self.reply(404, b'not found', "text/plain")
+
+        snapshot = daemon.snapshot
+        if not snapshot or fmt not in snapshot:
+            return self.reply(503, '暂无可用节点，请稍后再试'.encode('utf-8'), "text/plain; charset=utf-8")
+        body, gz_body, etag = snapshot[fmt]
+        if self.headers.get("If-None-Match") == etag:
+            return self.reply(304, b'', None, etag=etag)
+        content_type = "application/json" if fmt == "json" else "text/yaml; charset=utf-8"
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            return self.reply(200, gz_body, content_type, etag=etag, encoding="gzip")
+        return self.reply(200, body, content_type, etag=etag)
+
+    def reply(self, status, body, content_type, etag=None, encoding=None):
+        self.send_response(status)
+        if content_type:
+            self.send_header("Content-Type", content_type)
+        if etag:
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", "no-cache")
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+        self.send_header("Vary", "Accept-Encoding")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    do_HEAD = do_GET
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ClashForgeDaemon:
+    """常驻调度器 + 滚动测速 + HTTP 配置服务"""
+
+    def __init__(self, sources, slice_size=SLICE_SIZE, tick=TICK, controller=None, http_host=HTTP_HOST, http_port=HTTP_PORT):
+        self.sources = [Source(s["link"], s["interval"]) for s in sources]
+        self.slice_size = slice_size
+        self.tick = tick
+        self.controller = controller
+        self.http_host = http_host
+        self.http_port = http_port
+        self.config = None  # 当前 mihomo 加载的完整配置
+        self.results = {}  # name -> ProxyTestResult
+        self.fails = {}  # name -> 连续失败次数
+        self.last_ok = {}  # name -> 最近一次成功的测试结果，偶发失败时仍保留
+        self.dirty = False
+        self.snapshot = None  # fmt -> (body, gzip_body, etag)，整体替换保证线程安全
+        self.clash_process = None
+        self.config_file = ClashForge.CONFIG_FILE  # start_clash 会改写全局 CONFIG_FILE，这里固定写入路径
+
+    def status(self):
+        return {
+            "sources": [{"link": s.link, "interval": s.interval, "nodes": len(s.nodes),
+                         "fetched_at": s.fetched_at} for s in self.sources],
+            "nodes": len(self.config["proxies"]) if self.config else 0,
+            "tested": len(self.results),
+            "valid": len(self.candidates()),
+        }
+
+    # 刷新到期的订阅源，节点有变化时标记重建；最多等待 FETCH_TIMEOUT 秒，慢的订阅源在后台完成后再标记
+    async def refresh_sources(self):
+        due = [s for s in self.sources if s.due and not s.fetching]
+        if not due:
+            return
+        tasks = []
+        for source in due:
+            source.fetching = True
+            task = asyncio.ensure_future(asyncio.to_thread(source.fetch))
+            task.add_done_callback(functools.partial(self.fetch_done, source))
+            tasks.append(task)
+        _, pending = await asyncio.wait(tasks, timeout=FETCH_TIMEOUT)
+        if pending:
+            print(f"{len(pending)} 个订阅源拉取超过 {FETCH_TIMEOUT} 秒，完成后再更新")
+
+    def fetch_done(self, source, task):
+        source.fetching = False
+        if task.cancelled():
+            return
+        if task.exception():
+            print(f"刷新订阅源失败 {source.link}: {task.exception()}")
+            source.fetched_at = time.time()
+        elif task.result():
+            print(f"订阅源有更新 {source.link}: {len(source.nodes)} 个节点")
+            self.dirty = True
+
+    # 订阅源调度器，独立于滚动测速运行，慢的订阅源不会阻塞测速和发布
+    async def schedule_sources(self):
+        while True:
+            await self.refresh_sources()
+            await asyncio.sleep(self.tick)
+
+    # 重建完整配置并写入文件
+    def rebuild(self):
+        nodes = stable_names([n.copy() for s in self.sources for n in s.nodes])
+        config = ClashForge.build_clash_config(nodes)
+        if not config["proxies"]:
+            return False
+        self.config = config
+        ClashForge.write_clash_config(config, self.config_file)
+        names = {p["name"] for p in config["proxies"]}
+        self.results = {k: v for k, v in self.results.items() if k in names}
+        self.fails = {k: v for k, v in self.fails.items() if k in names}
+        self.last_ok = {k: v for k, v in self.last_ok.items() if k in names}
+        return True
+
+    # 可用节点：最近成功过且连续失败次数未达到 MAX_FAILS
+    def candidates(self):
+        return [r for name, r in self.last_ok.items() if self.fails.get(name, 0) < MAX_FAILS]
+
+    # 按延迟排序后的最优配置
+    def best_config(self):
+        order = [r.name for r in sorted(self.candidates(), key=lambda r: r.delay)][:ClashForge.LIMIT]
+        proxies = {p["name"]: p for p in self.config["proxies"]}
+        config = dict(self.config)
+        config["proxies"] = [proxies[name] for name in order]
+        config["proxy-groups"] = [dict(g) for g in self.config["proxy-groups"]]
+        for group in config["proxy-groups"][1:]:
+            group["proxies"] = list(order)
+        return config
+
+    # 生成对外提供的快照(yaml/json + gzip + ETag)
+    def publish(self):
+        config = self.best_config()
+        if not config["proxies"]:
+            return
+        snapshot = {}
+        for fmt in ("yaml", "json"):
+            if fmt == "yaml":
+                body = yaml.dump(config, allow_unicode=True, sort_keys=False).encode('utf-8')
+            else:
+                body = json.dumps(config, ensure_ascii=False).encode('utf-8')
+            etag = f'"{hashlib.sha1(body).hexdigest()}"'
+            snapshot[fmt] = (body, gzip.compress(body), etag)
+        self.snapshot = snapshot
+
+    # 选出最久未测试的一批节点
+    def next_slice(self):
+        names = [p["name"] for p in self.config["proxies"]]
+        tested_time = {name: self.results[name].tested_time.timestamp() if name in self.results else 0 for name in names}
+        names.sort(key=lambda name: tested_time[name])
+        return names[:self.slice_size]
+
+    async def retest(self, clash_api):
+        names = self.next_slice()
+        if not names:
+            return
+        # 滚动重测需要最新结果，不使用 60 秒内的测速缓存
+        results = await asyncio.gather(*(clash_api.test_proxy_delay(name, use_cache=False) for name in names))
+        for r in results:
+            self.results[r.name] = r
+            if r.is_valid:
+                self.fails[r.name] = 0
+                self.last_ok[r.name] = r
+            else:
+                self.fails[r.name] = self.fails.get(r.name, 0) + 1
+        valid = sum(1 for r in results if r.is_valid)
+        print(f"{time.strftime('%H:%M:%S')} 滚动测速 {len(results)} 个节点，可用 {valid}，累计已测 {len(self.results)}/{len(self.config['proxies'])}")
+
+    async def ensure_controller(self):
+        """启动常驻 mihomo，或使用 --controller 指定的已有控制器"""
+        if self.controller:
+            host, port = self.controller.rsplit(':', 1)
+            ClashForge.CLASH_API_HOST, ClashForge.CLASH_API_PORTS = host, [int(port)]
+            return
+        self.clash_process = await asyncio.to_thread(ClashForge.start_clash)
+        ClashForge.switch_proxy('DIRECT')
+
+    def start_http(self):
+        server = ThreadingHTTPServer((self.http_host, self.http_port), ConfigHandler)
+        server.daemon = self
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print(f"配置服务已启动: http://{self.http_host}:{self.http_port}/clash.yaml")
+        return server
+
+    async def run(self):
+        server = self.start_http()
+        scheduler = None
+        try:
+            # 首次加载，至少拿到节点后再启动 mihomo
+            while not self.config:
+                await self.refresh_sources()
+                if self.dirty and self.rebuild():
+                    self.dirty = False
+                else:
+                    await asyncio.sleep(self.tick)
+            await self.ensure_controller()
+            async with ClashForge.ClashAPI(ClashForge.CLASH_API_HOST, ClashForge.CLASH_API_PORTS, ClashForge.CLASH_API_SECRET) as clash_api:
+                if not await clash_api.check_connection():
+                    return
+                if self.controller:
+                    # 已运行的控制器还没有加载当前配置，首轮重建后热重载
+                    self.dirty = True
+                scheduler = asyncio.create_task(self.schedule_sources())
+                while True:
+                    started = time.time()
+                    reloaded = True
+                    if self.dirty and self.rebuild():
+                        # 重载失败时 mihomo 仍是旧节点集，重新标记 dirty 下一轮重试，并跳过本轮测速，避免新节点被记为失败
+                        # 先清除再重载，重载期间调度器标记的更新不会被覆盖
+                        self.dirty = False
+                        reloaded = await clash_api.reload_config(self.config)
+                        if not reloaded:
+                            self.dirty = True
+                    if reloaded:
+                        await self.retest(clash_api)
+                    self.publish()
+                    await asyncio.sleep(max(0.0, self.tick - (time.time() - started)))
+        finally:
+            if scheduler is not None:
+                scheduler.cancel()
+            server.shutdown()
+            if self.clash_process is not None:
+                self.clash_process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ClashForge 常驻模式')
+    parser.add_argument('--sources', default='sources.txt', help='订阅源文件，每行: <link> [刷新间隔秒数]')
+    parser.add_argument('--interval', type=int, default=DEFAULT_INTERVAL, help='默认刷新间隔(秒)')
+    parser.add_argument('--slice', type=int, default=SLICE_SIZE, help='每轮重测的节点数')
+    parser.add_argument('--tick', type=float, default=TICK, help='滚动测速间隔(秒)')
+    parser.add_argument('--controller', default='', help='使用已运行的控制器 host:port，不启动 mihomo')
+    parser.add_argument('--host', default=HTTP_HOST)
+    parser.add_argument('--port', type=int, default=HTTP_PORT)
+    args = parser.parse_args()
+
+    sources = read_sources(args.sources, args.interval)
+    if os.path.isdir(ClashForge.INPUT):
+        sources.append({"link": ClashForge.INPUT, "interval": args.interval})
+    if not sources:
+        print(f"没有可用的订阅源，请在 {args.sources} 或 {ClashForge.INPUT} 目录中添加")
+        sys.exit(1)
+
+    daemon = ClashForgeDaemon(sources, slice_size=args.slice, tick=args.tick, controller=args.controller,
+                              http_host=args.host, http_port=args.port)
+    try:
+        asyncio.run(daemon.run())
+    except KeyboardInterrupt:
+        print("\n用户中断执行")
+
+
+if __name__ == '__main__':
+    main()
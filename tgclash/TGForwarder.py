@@ -1,18 +1,25 @@
 import os
 import socks
-import random
+import math
+import hashlib
+import sqlite3
+import functools
+import contextlib
+import itertools
+import contextvars
 import time
 import json
+import unicodedata
 import re
 import asyncio
 import urllib.parse
 from datetime import datetime, timezone, timedelta
-from telethon import TelegramClient,functions, events
-from telethon.tl.types import MessageMediaPhoto, MessageEntityTextUrl
+from telethon import TelegramClient,functions, events, errors, utils
+from telethon.tl.types import MessageMediaPhoto, MessageEntityTextUrl, DocumentAttributeVideo, DocumentAttributeFilename, InputPeerChannel, InputPeerUser, InputPeerChat
 from telethon.sessions import StringSession
 from telethon.tl.functions.messages import GetHistoryRequest
 from telethon.tl.functions.channels import JoinChannelRequest
-from collections import deque
+from collections import defaultdict, OrderedDict
 
 '''
 代理参数说明:
@@ -27,17 +34,697 @@ proxy=(socks.HTTP,http_proxy_list[1][2:],int(http_proxy_list[2]),proxy_username,
 if os.environ.get("HTTP_PROXY"):
     http_proxy_list = os.environ["HTTP_PROXY"].split(":")
 
+# 按请求类型限速(每秒令牌数, 桶容量)：read 读取历史/评论/实体，send 发送/置顶/加入，delete 删除消息
+RATE_LIMITS = {'read': (5, 10), 'send': (1, 3), 'delete': (2, 5)}
+# 触发 FloodWaitError 后的最大重试次数
+FLOOD_RETRIES = 3
+# 去重记录保留天数，超过后自动过期
+HISTORY_TTL_DAYS = 30
+# 视频指纹保留天数
+MEDIA_TTL_DAYS = 30
+# 发送队列的工作协程数，大于 1 时转发顺序可能与源频道不一致
+SEND_WORKERS = 1
+# 发送失败后在本次运行内重新入队的次数，第 n 次重试前等待 SEND_RETRY_DELAY * 2**(n-1) 秒
+SEND_RETRIES = 2
+SEND_RETRY_DELAY = 5
+# 仍失败的记入数据库，之后的运行按 SEND_RETRY_INTERVAL * 2**(失败次数-1) 秒退避后重发，累计失败 SEND_RETRY_RUNS 次后放弃
+SEND_RETRY_INTERVAL = 600
+SEND_RETRY_RUNS = 5
+# Telegram 单次删除请求最多 100 条消息
+DELETE_BATCH = 100
+# 遍历消息时每页拉取的条数(Telegram 单次最多 100 条)
+ITER_PAGE = 100
+# 实时模式下按检查点补扫遗漏消息的间隔(秒)，以及更新今日统计、删除重复消息的间隔(秒)
+CATCHUP_INTERVAL = 600
+MAINTENANCE_INTERVAL = 3600
+# 等待机器人回复资源链接的超时时间(秒)，以及最多读取的回复条数
+BOT_TIMEOUT = 15
+BOT_MAX_REPLIES = 3
+# 每次扫描时重新检查评论的最近图文消息数，资源常在发帖后才补到评论中，只检查新消息会漏掉
+REPLY_RECHECK_POSTS = 10
+# 同时扫描的监控频道数
+SCAN_CONCURRENCY = 4
+# 今日统计与服务器重新核对的间隔(秒)，其余时间使用发送队列维护的本地计数
+COUNT_RECOUNT_INTERVAL = 6 * 3600
+# 频道/用户实体缓存保留天数，超过后重新解析，避免用户名易主后仍指向旧实体
+PEER_TTL_DAYS = 7
+# 缓存的实体已失效时 Telegram 返回的错误，遇到后清除缓存，下次重新解析
+PEER_ERRORS = (errors.ChannelInvalidError, errors.ChannelPrivateError, errors.PeerIdInvalidError, errors.ChatIdInvalidError,
+               errors.UsernameNotOccupiedError, errors.UsernameInvalidError)
+# 近似重复检测：窗口内(秒)标题相近的资源(换了分享链接、文案、表情的重发)只转发第一条，窗口为 0 时关闭
+# 标题规范化后按编辑距离比较，距离不超过允许的改动数且标题中的数字(季/集/部)相同、年份不冲突视为同一资源
+# 允许的改动数随标题长度增加：每 NEAR_DUP_CHARS_PER_EDIT 个汉字(英文字母按半个汉字计)允许改动一个字，最多 NEAR_DUP_MAX_EDITS 个
+# 中文短标题只有几个字，3 个字以内的标题不做近似匹配，只有完全相同才算重复
+# 内存中最多保留 NEAR_DUP_MAX_TITLES 条标题
+NEAR_DUP_WINDOW = 24 * 3600
+NEAR_DUP_CHARS_PER_EDIT = 4
+NEAR_DUP_MAX_EDITS = 3
+NEAR_DUP_MAX_TITLES = 50000
+# 标题：名称/片名/剧名 后的一行，或书名号中的内容
+TITLE_PATTERN = re.compile(r'(?:名称|片名|剧名)[:：]\s*([^\n]+)|《([^》\n]+)》')
+# 标题中的画质、版本等修饰词，不参与比较
+TITLE_NOISE_PATTERN = re.compile(r'4k|8k|2160p|1080p|720p|hdr10\+?|hdr|dolby ?vision|杜比视界|杜比|高码率|高清|超清|蓝光|原盘|'
+                                 r'中字|中英字幕|双语字幕|国语|粤语|国粤双语|内封字幕|完结|全集|合集|无水印|附字幕|'
+                                 r'全\d+集|\d+集全|导演剪辑版|加长版|未删减版')
+# 标题中的年份，只用来排除不同年份的同名资源，不参与标题比较
+TITLE_YEAR_PATTERN = re.compile(r'(?<!\d)(?:19|20)\d{2}(?!\d)')
+# 标题中用汉字写的季/部/集序号，转成数字后与阿拉伯数字写法一致
+TITLE_ORDINAL_PATTERN = re.compile(r'第([零一二两三四五六七八九十百]+)([季部集期章])')
+CN_DIGITS = {'零': 0, '一': 1, '二': 2, '两': 2, '三': 3, '四': 4, '五': 5, '六': 6, '七': 7, '八': 8, '九': 9}
+# 每次运行的指标报告(JSON)和 Prometheus textfile(可指向 node_exporter 的 textfile 目录)，留空不输出
+METRICS_REPORT = 'metrics.json'
+METRICS_TEXTFILE = 'tgforwarder.prom'
+# 当前处理的监控频道，接口耗时、FloodWait 等指标按它归属到频道
+current_chat = contextvars.ContextVar('current_chat', default='')
+# 资源链接(不含 t.me 链接)，"链接：" 前缀不计入结果
+LINK_PATTERN = re.compile(r"(?:链接：\s*)?((?!https?://t\.me)(?:https?://[^\s'】\n]+|magnet:\?xt=urn:btih:[a-zA-Z0-9]+))")
+# 机器人回复中的链接
+BOT_LINK_PATTERN = re.compile(r'(https?://[^\s]+)')
+# 网盘分类及其域名，按域名后缀匹配(www.alipan.com 命中 alipan.com)，未命中的归入 others
+URL_CATEGORIES = {
+    "magnet": [],  # 磁力链接，按协议判断
+    "uc": ["drive.uc.cn"],  # UC
+    "mobile": ["caiyun.139.com"],  # 移动
+    "tianyi": ["cloud.189.cn"],  # 天翼
+    "quark": ["pan.quark.cn"],  # 夸克
+    "115": ["115cdn.com", "115.com", "anxia.com"],  # 115
+    "aliyun": ["alipan.com", "aliyundrive.com"],  # 阿里云
+    "pikpak": ["mypikpak.com"],
+    "baidu": ["pan.baidu.com"],
+    "others": []  # 其他
+}
+DOMAIN_CATEGORIES = {domain: category for category, domains in URL_CATEGORIES.items() for domain in domains}
+
+
+@functools.lru_cache(maxsize=4096)
+def url_category(url):
+    '''
+    链接分类：从完整域名开始逐级去掉最左侧的标签查域名索引，每个链接只需几次字典查找
+    '''
+    if url.startswith("magnet:"):
+        return "magnet"
+    try:
+        host = urllib.parse.urlsplit(url).hostname or ''
+    except ValueError:
+        return "others"
+    while host:
+        category = DOMAIN_CATEGORIES.get(host)
+        if category:
+            return category
+        host = host.partition('.')[2]
+    return "others"
+
+
+def cn_number(text):
+    '''
+    汉字数字转整数，只处理序号常见的百以内写法：十二、二十、一百零五
+    '''
+    total, current = 0, 0
+    for char in text:
+        if char == '百':
+            total += (current or 1) * 100
+            current = 0
+        elif char == '十':
+            total += (current or 1) * 10
+            current = 0
+        else:
+            current = CN_DIGITS[char]
+    return total + current
+
+
+def title_key(text):
+    '''
+    提取并规范化消息标题：全角转半角、转小写、去掉修饰词、年份和标点表情，中文标题再去掉附带的英文名
+    返回 (标题文字, 标题中的数字, 年份)，数字(季/集/部)单独比较，不留在标题文字中；没有标题时返回 None
+    '''
+    found = TITLE_PATTERN.search(text or '')
+    if not found:
+        return None
+    title = TITLE_NOISE_PATTERN.sub(' ', unicodedata.normalize('NFKC', found.group(1) or found.group(2)).lower())
+    years = tuple(TITLE_YEAR_PATTERN.findall(title))
+    title = TITLE_YEAR_PATTERN.sub(' ', title)
+    title = TITLE_ORDINAL_PATTERN.sub(lambda m: f' 第{cn_number(m.group(1))}{m.group(2)} ', title)
+    # 先取数字再去标点，避免 "第2季 12集" 的两个数字连在一起
+    numbers = tuple(re.findall(r'\d+', title))
+    title = re.sub(r'第\d+[季部集期章]|\d+', '', title)
+    if re.search(r'[\u4e00-\u9fff]', title):
+        title = re.sub(r'[a-z]+', '', title)
+    title = re.sub(r'[^\w]|_', '', title)
+    if not title:
+        return None
+    return title, numbers, years
+
+
+def edit_limit(title):
+    '''
+    标题允许的改动数：汉字按 2、其他字符按 1 计权，每 NEAR_DUP_CHARS_PER_EDIT 个汉字允许改动一个
+    '''
+    weight = sum(2 if '\u4e00' <= char <= '\u9fff' else 1 for char in title)
+    return min(NEAR_DUP_MAX_EDITS, weight // (NEAR_DUP_CHARS_PER_EDIT * 2))
+
+
+def edit_distance(a, b, limit):
+    '''
+    编辑距离(插入/删除/替换)，只计算对角线两侧 limit 宽的带状区域，超过 limit 时返回 limit + 1
+    '''
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [limit + 1] * (len(b) + 1)
+        if i <= limit:
+            current[0] = i
+        for j in range(max(1, i - limit), min(len(b), i + limit) + 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (a[i - 1] != b[j - 1]))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return min(previous[len(b)], limit + 1)
+
+
+class TitleIndex:
+    """
+    标题的近似重复索引，只保留 window 秒内最多 max_titles 条，超出时淘汰最早的
+    按 (标题中的数字, 字符二元组(首尾加边界符)) 建倒排表：数字必须相同，同名不同季/集的标题不会成为候选；
+    编辑距离不超过 k 的两个标题，二元组最多相差 2k 个，查询时只对共有二元组足够多的候选计算编辑距离
+    """
+    def __init__(self, window=NEAR_DUP_WINDOW, max_edits=NEAR_DUP_MAX_EDITS, max_titles=NEAR_DUP_MAX_TITLES):
+        self.window = window
+        self.max_edits = max_edits
+        self.max_titles = max_titles
+        self.entries = OrderedDict()
+        self.grams = defaultdict(set)
+    @staticmethod
+    def _grams(key):
+        title = f'^{key[0]}$'
+        return {(key[1], title[i:i + 2]) for i in range(len(title) - 1)}
+    def _remove(self, key):
+        del self.entries[key]
+        for gram in self._grams(key):
+            self.grams[gram].discard(key)
+            if not self.grams[gram]:
+                del self.grams[gram]
+    def expire(self, now=None):
+        expire = (now or time.time()) - self.window
+        while self.entries and (len(self.entries) > self.max_titles or next(iter(self.entries.values())) < expire):
+            self._remove(next(iter(self.entries)))
+    def find(self, key, now=None):
+        '''
+        返回窗口内与 key 近似的已有标题，没有时返回 None
+        '''
+        self.expire(now)
+        title, numbers, years = key
+        grams = self._grams(key)
+        shared = defaultdict(int)
+        for gram in grams:
+            for other in self.grams.get(gram, ()):
+                shared[other] += 1
+        need = max(1, len(grams) - 2 * self.max_edits)
+        for other, count in shared.items():
+            # 一方没写年份时不比较年份
+            if count < need or (years and other[2] and other[2] != years):
+                continue
+            limit = min(edit_limit(max(title, other[0], key=len)), self.max_edits)
+            if edit_distance(title, other[0], limit) <= limit:
+                return other
+        return None
+    def add(self, key, ts=None):
+        '''
+        按时间顺序添加，最早的在前面，淘汰时从头部开始
+        '''
+        ts = ts or time.time()
+        if key in self.entries:
+            ts = max(ts, self.entries.pop(key))
+        else:
+            for gram in self._grams(key):
+                self.grams[gram].add(key)
+        self.entries[key] = ts
+        self.expire()
+    def __len__(self):
+        return len(self.entries)
+    @staticmethod
+    def dumps(key):
+        # 规范化后的标题只含文字，不会出现分隔符
+        return f"{','.join(key[1])}:{','.join(key[2])}:{key[0]}"
+    @staticmethod
+    def loads(text):
+        numbers, years, title = text.split(':', 2)
+        return title, tuple(numbers.split(',')) if numbers else (), tuple(years.split(',')) if years else ()
+
+
+class RateLimiter:
+    """
+    异步令牌桶限速器，等待时只挂起当前协程，不阻塞事件循环
+    """
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self.lock = asyncio.Lock()
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+    def pause(self, seconds):
+        # FloodWait 提示的等待时间内，该类请求全部暂停并清空令牌
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+
+class BloomFilter:
+    """
+    内存布隆过滤器，判断不存在时一定不存在，判断存在时再查库确认
+    """
+    def __init__(self, capacity, error_rate=0.01):
+        capacity = max(capacity, 1)
+        self.size = int(-capacity * math.log(error_rate) / (math.log(2) ** 2)) + 1
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+    def add(self, key):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+    def __contains__(self, key):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+
+def media_fingerprints(document):
+    '''
+    视频指纹：主键为 Telegram 文件 ID(同一文件转发/复制后不变)，副键为 大小+时长+类型，用于识别重新上传的同一视频
+    没有时长时只靠大小+类型容易误判，改用 大小+文件名+类型；文件名也没有时不生成副键
+    '''
+    attributes = document.attributes or []
+    duration = next((attr.duration for attr in attributes if isinstance(attr, DocumentAttributeVideo)), 0)
+    if round(duration or 0):
+        return f'id:{document.id}', f'{document.size}:{round(duration)}:{document.mime_type}'
+    file_name = next((attr.file_name for attr in attributes if isinstance(attr, DocumentAttributeFilename)), '')
+    if file_name:
+        return f'id:{document.id}', f'{document.size}:name:{file_name}:{document.mime_type}'
+    return f'id:{document.id}',
+
+
+def peers_path(session):
+    '''
+    实体缓存文件按账号区分：access_hash 与账号绑定，多个脚本/账号共用一个文件时会互相覆盖，导致缓存反复失效
+    '''
+    return f"peers_{hashlib.sha1(str(session).encode('utf-8')).hexdigest()[:12]}.json"
+
+
+class PeerCache:
+    """
+    频道/用户实体的磁盘缓存(用户名 -> id/access_hash)，跨运行复用
+    StringSession 不保存实体，每次运行都要 ResolveUsername，该接口限流很严，监控频道多时容易触发 FloodWaitError
+    """
+    types = {'channel': (InputPeerChannel, 'channel_id'), 'user': (InputPeerUser, 'user_id'), 'chat': (InputPeerChat, 'chat_id')}
+    def __init__(self, path, ttl_days=PEER_TTL_DAYS):
+        self.path = path
+        self.peers = {}
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.peers = json.load(f)
+            except (OSError, ValueError):
+                self.peers = {}
+        expire = time.time() - ttl_days * 86400
+        self.peers = {name: peer for name, peer in self.peers.items() if peer.get('ts', 0) >= expire}
+    @staticmethod
+    def key(name):
+        return str(name).lstrip('@').lower()
+    def __contains__(self, name):
+        return self.key(name) in self.peers
+    def get(self, name):
+        peer = self.peers.get(self.key(name))
+        if not peer:
+            return None
+        cls, field = self.types[peer['type']]
+        if cls is InputPeerChat:
+            return cls(peer['id'])
+        return cls(peer['id'], peer['access_hash'])
+    def set(self, name, input_peer):
+        for kind, (cls, field) in self.types.items():
+            if isinstance(input_peer, cls):
+                self.peers[self.key(name)] = {'type': kind, 'id': getattr(input_peer, field),
+                                              'access_hash': getattr(input_peer, 'access_hash', 0), 'ts': time.time()}
+                return
+    def invalidate(self, name):
+        return self.peers.pop(self.key(name), None) is not None
+    def save(self):
+        tmp = f'{self.path}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.peers, f)
+        os.replace(tmp, self.path)
+
+
+class Metrics:
+    """
+    按监控频道统计运行指标：扫描/过滤(按原因)/重复/近似重复/转发条数、机器人链接解析数、FloodWait 秒数、各接口调用次数和耗时
+    未指定频道时归属到 current_chat，发送队列、统计等不属于某个监控频道的请求归属到空频道
+    """
+    def __init__(self):
+        self.started = time.time()
+        self.counts = defaultdict(lambda: defaultdict(int))
+        self.filtered = defaultdict(lambda: defaultdict(int))
+        self.flood_wait = defaultdict(lambda: defaultdict(int))
+        # (频道, 接口) -> [次数, 总耗时, 最大耗时]
+        self.api = defaultdict(lambda: [0, 0.0, 0.0])
+    def incr(self, name, value=1):
+        self.counts[current_chat.get()][name] += value
+    def filter(self, reason):
+        self.filtered[current_chat.get()][reason] += 1
+    def flood(self, kind, seconds):
+        self.flood_wait[current_chat.get()][kind] += seconds
+    def observe(self, method, seconds):
+        stat = self.api[(current_chat.get(), method)]
+        stat[0] += 1
+        stat[1] += seconds
+        stat[2] = max(stat[2], seconds)
+    def report(self):
+        '''
+        汇总为报告，频道按接口总耗时降序，便于找出耗时多、转发少的来源
+        '''
+        chats = set(self.counts) | set(self.filtered) | set(self.flood_wait) | {chat for chat, method in self.api}
+        channels = {}
+        methods = {}
+        for chat in chats:
+            api = {method: {'count': n, 'seconds': round(total, 3), 'max': round(peak, 3)}
+                   for (c, method), (n, total, peak) in self.api.items() if c == chat}
+            channels[chat] = {
+                **{name: self.counts[chat].get(name, 0) for name in ('scanned', 'forwarded', 'duplicates', 'near_duplicates', 'bot_links_resolved')},
+                'filtered': dict(self.filtered[chat]),
+                'flood_wait_seconds': dict(self.flood_wait[chat]),
+                'api_requests': sum(stat['count'] for stat in api.values()),
+                'api_seconds': round(sum(stat['seconds'] for stat in api.values()), 3),
+                'api': api,
+            }
+        for (chat, method), (n, total, peak) in self.api.items():
+            stat = methods.setdefault(method, {'count': 0, 'seconds': 0.0, 'max': 0.0})
+            stat['count'] += n
+            stat['seconds'] += total
+            stat['max'] = max(stat['max'], peak)
+        for stat in methods.values():
+            stat['avg'] = round(stat['seconds'] / stat['count'], 3) if stat['count'] else 0
+            stat['seconds'] = round(stat['seconds'], 3)
+            stat['max'] = round(stat['max'], 3)
+        return {
+            'started': datetime.fromtimestamp(self.started).strftime("%Y-%m-%d %H:%M:%S"),
+            'duration': round(time.time() - self.started, 3),
+            'channels': dict(sorted(channels.items(), key=lambda item: -item[1]['api_seconds'])),
+            'api': methods,
+        }
+    @staticmethod
+    def _write(path, content):
+        # 先写临时文件再替换，textfile 采集不会读到写了一半的文件
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.replace(tmp, path)
+    def write_json(self, path):
+        self._write(path, json.dumps(self.report(), ensure_ascii=False, indent=2))
+    def write_textfile(self, path):
+        def label(value):
+            return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        lines = []
+        def metric(name, kind, help_text, samples):
+            lines.append(f'# HELP tgforwarder_{name} {help_text}')
+            lines.append(f'# TYPE tgforwarder_{name} {kind}')
+            for labels, value in samples:
+                text = ','.join(f'{k}="{label(v)}"' for k, v in labels.items())
+                lines.append(f'tgforwarder_{name}{{{text}}} {value}' if text else f'tgforwarder_{name} {value}')
+        for name, help_text in (('scanned', 'Messages scanned'), ('forwarded', 'Resources forwarded'),
+                                ('duplicates', 'Duplicate resources skipped'), ('near_duplicates', 'Reposts skipped by similar title'),
+                                ('bot_links_resolved', 'Bot deep links resolved')):
+            metric(f'{name}_total', 'counter', help_text,
+                   [({'chat': chat}, counts[name]) for chat, counts in self.counts.items() if name in counts])
+        metric('filtered_total', 'counter', 'Messages filtered out by reason',
+               [({'chat': chat, 'reason': reason}, n) for chat, reasons in self.filtered.items() for reason, n in reasons.items()])
+        metric('flood_wait_seconds_total', 'counter', 'FloodWait seconds by request kind',
+               [({'chat': chat, 'kind': kind}, n) for chat, kinds in self.flood_wait.items() for kind, n in kinds.items()])
+        metric('api_requests_total', 'counter', 'Telegram API requests',
+               [({'chat': chat, 'method': method}, n) for (chat, method), (n, total, peak) in self.api.items()])
+        metric('api_seconds_total', 'counter', 'Telegram API time in seconds',
+               [({'chat': chat, 'method': method}, round(total, 6)) for (chat, method), (n, total, peak) in self.api.items()])
+        metric('api_seconds_max', 'gauge', 'Slowest Telegram API request in seconds',
+               [({'chat': chat, 'method': method}, round(peak, 6)) for (chat, method), (n, total, peak) in self.api.items()])
+        metric('run_duration_seconds', 'gauge', 'Run duration in seconds', [({}, round(time.time() - self.started, 3))])
+        metric('last_run_timestamp_seconds', 'gauge', 'Unix time of the last report', [({}, round(time.time()))])
+        self._write(path, '\n'.join(lines) + '\n')
+
+
+class Account:
+    """
+    一个登录账号：客户端、按请求类型的限速器和实体缓存
+    Telegram 按账号限流，access_hash 也与账号绑定，因此限速器和实体缓存都按账号分开
+    """
+    def __init__(self, client, peers_path):
+        self.client = client
+        self.limiters = {kind: RateLimiter(rate, burst) for kind, (rate, burst) in RATE_LIMITS.items()}
+        self.peers = PeerCache(peers_path)
+
+
+class DedupStore:
+    """
+    基于 SQLite 的去重记录，每条记录带时间戳，超过 ttl 自动过期
+    kind 区分记录类型：link 资源链接，media 视频指纹，title 标题指纹(近似重复检测)
+    同时保存每个监控频道已处理到的消息 ID，转发目标频道的消息索引(消息 ID -> 链接)，机器人跳转链接的解析结果，
+    每条频道消息已检查到的评论 ID，以及发送失败待重发的消息(按源消息和目标频道记录)
+    """
+    def __init__(self, path, ttl_days=HISTORY_TTL_DAYS, media_ttl_days=MEDIA_TTL_DAYS):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS seen (kind TEXT NOT NULL, key TEXT NOT NULL, ts REAL NOT NULL, '
+                          'PRIMARY KEY (kind, key)) WITHOUT ROWID')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS seen_ts ON seen (kind, ts)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS checkpoints (chat TEXT PRIMARY KEY, message_id INTEGER NOT NULL)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS target_index (chat TEXT NOT NULL, message_id INTEGER NOT NULL, link TEXT NOT NULL, '
+                          'PRIMARY KEY (chat, message_id)) WITHOUT ROWID')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS target_index_link ON target_index (chat, link)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS bot_links (bot TEXT NOT NULL, param TEXT NOT NULL, link TEXT NOT NULL, ts REAL NOT NULL, '
+                          'PRIMARY KEY (bot, param)) WITHOUT ROWID')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS reply_cursors (chat TEXT NOT NULL, message_id INTEGER NOT NULL, reply_id INTEGER NOT NULL, '
+                          'ts REAL NOT NULL, PRIMARY KEY (chat, message_id)) WITHOUT ROWID')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS send_retries (chat TEXT NOT NULL, message_id INTEGER NOT NULL, reply_id INTEGER NOT NULL, '
+                          'target TEXT NOT NULL, text TEXT NOT NULL, media INTEGER NOT NULL, attempts INTEGER NOT NULL, next_ts REAL NOT NULL, '
+                          'PRIMARY KEY (chat, message_id, reply_id, target)) WITHOUT ROWID')
+        self.conn.execute('DELETE FROM bot_links WHERE ts < ?', (time.time() - ttl_days * 86400,))
+        self.conn.execute('DELETE FROM reply_cursors WHERE ts < ?', (time.time() - ttl_days * 86400,))
+        self.conn.execute('DELETE FROM seen WHERE ts < ?', (time.time() - ttl_days * 86400,))
+        self.conn.execute("DELETE FROM seen WHERE kind = 'media' AND ts < ?", (time.time() - media_ttl_days * 86400,))
+        # 旧版按视频大小去重的记录，同样大小的不同视频会被误判，已由视频指纹取代
+        self.conn.execute("DELETE FROM seen WHERE kind = 'size'")
+        # 旧版没有时长的视频副键为 大小:0:类型，同样大小的不同视频会被误判
+        self.conn.execute("DELETE FROM seen WHERE kind = 'media' AND key GLOB '[0-9]*:0:*' AND key NOT LIKE '%:name:%'")
+        self.conn.commit()
+        count = self.conn.execute('SELECT COUNT(*) FROM seen').fetchone()[0]
+        # 预留空间，容量不足时只是误判率升高，结果仍以数据库为准
+        self.bloom = BloomFilter(max(count * 2, 100000))
+        for kind, key in self.conn.execute('SELECT kind, key FROM seen'):
+            self.bloom.add(f'{kind}:{key}')
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM seen').fetchone()[0]
+    def claim(self, kind, key):
+        '''
+        检查并占用：未出现过则记录并返回 True，已存在返回 False
+        检查和写入之间没有 await，并发扫描的协程不会重复占用同一条记录
+        '''
+        if self.seen(kind, key):
+            return False
+        self.add(kind, key)
+        return True
+    def seen_media(self, document):
+        return any(self.seen('media', key) for key in media_fingerprints(document))
+    def claim_media(self, document, ts=None):
+        '''
+        视频的检查并占用，主键或副键任一已存在即视为重复
+        '''
+        if self.seen_media(document):
+            return False
+        self.add_media(document, ts)
+        return True
+    def add_media(self, document, ts=None):
+        for key in media_fingerprints(document):
+            self.add('media', key, ts)
+    def seen(self, kind, key):
+        if f'{kind}:{key}' not in self.bloom:
+            return False
+        return self.conn.execute('SELECT 1 FROM seen WHERE kind = ? AND key = ?', (kind, str(key))).fetchone() is not None
+    def add(self, kind, key, ts=None):
+        self.conn.execute('INSERT INTO seen (kind, key, ts) VALUES (?, ?, ?) ON CONFLICT (kind, key) DO UPDATE SET ts = MAX(ts, excluded.ts)',
+                          (kind, str(key), ts or time.time()))
+        self.bloom.add(f'{kind}:{key}')
+    def since(self, kind, ts):
+        return {key for key, in self.conn.execute('SELECT key FROM seen WHERE kind = ? AND ts >= ?', (kind, ts))}
+    def entries(self, kind, ts):
+        '''
+        按时间升序返回 ts 之后的 (key, 时间戳)
+        '''
+        return self.conn.execute('SELECT key, ts FROM seen WHERE kind = ? AND ts >= ? ORDER BY ts', (kind, ts)).fetchall()
+    def checkpoint(self, chat):
+        row = self.conn.execute('SELECT message_id FROM checkpoints WHERE chat = ?', (chat,)).fetchone()
+        return row[0] if row else 0
+    def set_checkpoint(self, chat, message_id):
+        self.conn.execute('INSERT INTO checkpoints (chat, message_id) VALUES (?, ?) '
+                          'ON CONFLICT (chat) DO UPDATE SET message_id = MAX(message_id, excluded.message_id)', (chat, message_id))
+    def index_message(self, chat, message_id, link):
+        self.conn.execute('INSERT OR REPLACE INTO target_index (chat, message_id, link) VALUES (?, ?, ?)', (chat, message_id, link))
+    def unindex_messages(self, chat, message_ids):
+        self.conn.executemany('DELETE FROM target_index WHERE chat = ? AND message_id = ?', [(chat, i) for i in message_ids])
+    def duplicate_groups(self, chat, links):
+        '''
+        返回 links 中出现多次的链接对应的消息 ID 列表，每组按消息 ID 降序(最新的在前)
+        '''
+        rows = self.conn.execute('SELECT link, message_id FROM target_index WHERE chat = ? AND link IN '
+                                 '(SELECT link FROM target_index WHERE chat = ? GROUP BY link HAVING COUNT(*) > 1) '
+                                 'ORDER BY link, message_id DESC', (chat, chat))
+        groups = {}
+        for link, message_id in rows:
+            if link in links:
+                groups.setdefault(link, []).append(message_id)
+        return list(groups.values())
+    def bot_link(self, bot, param):
+        row = self.conn.execute('SELECT link FROM bot_links WHERE bot = ? AND param = ?', (bot, param)).fetchone()
+        return row[0] if row else ''
+    def set_bot_link(self, bot, param, link):
+        self.conn.execute('INSERT OR REPLACE INTO bot_links (bot, param, link, ts) VALUES (?, ?, ?, ?)', (bot, param, link, time.time()))
+        self.conn.commit()
+    def reply_cursor(self, chat, message_id):
+        row = self.conn.execute('SELECT reply_id FROM reply_cursors WHERE chat = ? AND message_id = ?', (chat, message_id)).fetchone()
+        return row[0] if row else 0
+    def recent_reply_posts(self, chat, limit):
+        '''
+        返回频道最近 limit 条需要检查评论的消息 ID，按 ID 降序
+        '''
+        return [message_id for message_id, in self.conn.execute(
+            'SELECT message_id FROM reply_cursors WHERE chat = ? ORDER BY message_id DESC LIMIT ?', (chat, limit))]
+    def forget_reply_posts(self, chat, message_ids):
+        self.conn.executemany('DELETE FROM reply_cursors WHERE chat = ? AND message_id = ?', [(chat, i) for i in message_ids])
+    def set_reply_cursor(self, chat, message_id, reply_id):
+        self.conn.execute('INSERT INTO reply_cursors (chat, message_id, reply_id, ts) VALUES (?, ?, ?, ?) '
+                          'ON CONFLICT (chat, message_id) DO UPDATE SET reply_id = MAX(reply_id, excluded.reply_id), ts = excluded.ts',
+                          (chat, message_id, reply_id, time.time()))
+    def add_retry(self, source, target, text, media):
+        '''
+        记录发送失败的消息，source 为 (监控频道, 消息 ID, 评论 ID)，按失败次数指数退避，返回累计失败次数
+        '''
+        chat, message_id, reply_id = source
+        row = self.conn.execute('SELECT attempts FROM send_retries WHERE chat = ? AND message_id = ? AND reply_id = ? AND target = ?',
+                                (chat, message_id, reply_id, target)).fetchone()
+        attempts = (row[0] if row else 0) + 1
+        self.conn.execute('INSERT OR REPLACE INTO send_retries (chat, message_id, reply_id, target, text, media, attempts, next_ts) '
+                          'VALUES (?, ?, ?, ?, ?, ?, ?, ?)', (chat, message_id, reply_id, target, text, int(media), attempts,
+                                                               time.time() + SEND_RETRY_INTERVAL * 2 ** (attempts - 1)))
+        return attempts
+    def remove_retry(self, source, target):
+        self.conn.execute('DELETE FROM send_retries WHERE chat = ? AND message_id = ? AND reply_id = ? AND target = ?', (*source, target))
+    def take_retries(self):
+        '''
+        取出已到重发时间的记录，并推迟其下次重发时间，重发未完成前再次调用不会重复取出
+        '''
+        now = time.time()
+        rows = self.conn.execute('SELECT chat, message_id, reply_id, target, text, media FROM send_retries WHERE next_ts <= ? '
+                                 'ORDER BY chat, message_id, reply_id', (now,)).fetchall()
+        self.conn.execute('UPDATE send_retries SET next_ts = ? WHERE next_ts <= ?', (now + SEND_RETRY_INTERVAL, now))
+        return rows
+    def commit(self):
+        self.conn.commit()
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+
+class KeywordMatcher:
+    """
+    Aho-Corasick 多关键词匹配，一次扫描文本得出命中了哪些关键词分组
+    groups: {分组名: 关键词列表}，match(text) 返回命中的分组名集合
+    """
+    def __init__(self, groups):
+        self.names = list(groups)
+        # 每个状态的转移表(已合并失败指针的转移，扫描时无需回溯)和命中分组位掩码
+        goto = [{}]
+        masks = [0]
+        for bit, name in enumerate(self.names):
+            for word in groups[name] or []:
+                if not word:
+                    continue
+                state = 0
+                for ch in word:
+                    nxt = goto[state].get(ch)
+                    if nxt is None:
+                        nxt = len(goto)
+                        goto[state][ch] = nxt
+                        goto.append({})
+                        masks.append(0)
+                    state = nxt
+                masks[state] |= 1 << bit
+        fail = [0] * len(goto)
+        self.delta = [None] * len(goto)
+        self.delta[0] = dict(goto[0])
+        # 按深度广度优先构建，根节点的直接子节点失败指针指向根节点
+        queue = list(goto[0].values())
+        for state in queue:
+            masks[state] |= masks[fail[state]]
+            self.delta[state] = {**self.delta[fail[state]], **goto[state]}
+            for ch, nxt in goto[state].items():
+                fail[nxt] = self.delta[fail[state]].get(ch, 0)
+                queue.append(nxt)
+        self.masks = masks
+        self.match = functools.lru_cache(maxsize=4096)(self._match)
+    def _match(self, text):
+        delta, masks = self.delta, self.masks
+        state = hit = 0
+        for ch in text or '':
+            state = delta[state].get(ch, 0)
+            hit |= masks[state]
+        return frozenset(name for bit, name in enumerate(self.names) if hit >> bit & 1)
+
+
+class Replacer:
+    """
+    多词替换，替换规则启动时编译为一个正则，扫描一次文本完成全部替换，同一位置优先替换最长的词
+    replacements: {目标词: 被替换词或被替换词列表}
+    """
+    def __init__(self, replacements):
+        self.table = {}
+        for target_word, source_words in (replacements or {}).items():
+            if isinstance(source_words, str):
+                source_words = [source_words]
+            for word in source_words:
+                # 同一个词出现在多条规则中时，以先出现的规则为准
+                if word:
+                    self.table.setdefault(word, target_word)
+        words = sorted(self.table, key=len, reverse=True)
+        self.regex = re.compile('|'.join(map(re.escape, words))) if words else None
+    def __call__(self, text):
+        if self.regex is None:
+            return text
+        return self.regex.sub(lambda m: self.table[m.group()], text)
+
 
 class TGForwarder:
     def __init__(self, api_id, api_hash, string_session, channels_groups_monitor, forward_to_channel,
                  limit, replies_limit, include, exclude, check_replies, proxy, checknum, replacements, message_md, channel_match, hyperlink_text, past_years, only_today):
         self.urls_kw = ['magnet', 'drive.uc.cn', 'caiyun.139.com', 'cloud.189.cn', 'pan.quark.cn', '115cdn.com','115.com', 'anxia.com', 'alipan.com', 'aliyundrive.com','pan.baidu.com','mypikpak.com']
-        self.checkbox = {"links":[],"sizes":[],"bot_links":{},"chat_forward_count_msg_id":{},"today":"","today_count":0}
+        self.checkbox = {"chat_forward_count_msg_id":{},"today":"","today_count":0}
         self.checknum = checknum
         self.today_count = 0
         self.history = 'history.json'
+        # 链接/视频大小去重记录
+        self.store = DedupStore('history.db')
         # 正则表达式匹配资源链接
-        self.pattern = r"(?:链接：\s*)?((?!https?://t\.me)(?:https?://[^\s'】\n]+|magnet:\?xt=urn:btih:[a-zA-Z0-9]+))"
+        self.pattern = LINK_PATTERN
         self.api_id = api_id
         self.api_hash = api_hash
         self.string_session = string_session
@@ -60,19 +747,248 @@ class TGForwarder:
         self.only_today = only_today
         self.hyperlink_text = hyperlink_text
         self.replacements = replacements
+        self.replacer = Replacer(replacements)
         self.message_md = message_md
         self.channel_match = channel_match
         self.check_replies = check_replies
+        # 关键词分组编译为一个自动机，每段文本只扫描一次
+        keyword_groups = {'include': self.include, 'exclude': self.exclude, 'urls': self.urls_kw}
+        for i, rule in enumerate(self.channel_match or []):
+            keyword_groups[f'rule{i}_include'] = rule.get('include')
+            keyword_groups[f'rule{i}_exclude'] = rule.get('exclude')
+        self.keywords = KeywordMatcher(keyword_groups)
         self.download_folder = 'downloads'
-        if not proxy:
-            self.client = TelegramClient(StringSession(string_session), api_id, api_hash)
-        else:
-            self.client = TelegramClient(StringSession(string_session), api_id, api_hash, proxy=proxy)
-    def random_wait(self, min_ms, max_ms):
-        min_sec = min_ms / 1000
-        max_sec = max_ms / 1000
-        wait_time = random.uniform(min_sec, max_sec)
-        time.sleep(wait_time)
+        # 支持配置多个账号，监控频道按历史消息量分配给各账号并行扫描，去重库和发送队列共用
+        # 第一个为主账号，负责发送、统计和去重等目标频道操作
+        sessions = string_session if isinstance(string_session, (list, tuple)) else [string_session]
+        self.accounts = []
+        for session in sessions:
+            if not proxy:
+                client = TelegramClient(StringSession(session), api_id, api_hash)
+            else:
+                client = TelegramClient(StringSession(session), api_id, api_hash, proxy=proxy)
+            # 实体缓存按账号(会话)保存
+            self.accounts.append(Account(client, peers_path(session)))
+        self.client = self.accounts[0].client
+        self.limiters = self.accounts[0].limiters
+        self.peers = self.accounts[0].peers
+        # 各监控频道本次转发数
+        self.counters = defaultdict(int)
+        # 同一个机器人同时只进行一个会话，不同机器人并行解析
+        self.bot_locks = defaultdict(asyncio.Lock)
+        self.metrics = Metrics()
+        # 标题近似重复索引，启动时从去重库加载窗口内的标题
+        self.titles = TitleIndex()
+    async def call(self, kind, func, *args, **kwargs):
+        '''
+        按请求类型限速调用 Telegram 接口，触发 FloodWaitError 时暂停该类请求，等待结束后重试
+        func 为客户端或客户端的方法，按所属账号限速
+        '''
+        client = getattr(func, '__self__', func)
+        limiter = self.account_of(client).limiters[kind]
+        # 接口名：直接调用客户端时为请求类型，否则为方法名
+        method = type(args[0]).__name__ if func is client else getattr(func, '__name__', kind)
+        for attempt in range(FLOOD_RETRIES + 1):
+            await limiter.acquire()
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            except errors.FloodWaitError as e:
+                if attempt == FLOOD_RETRIES:
+                    raise
+                print(f"触发 FloodWaitError，{kind} 类请求暂停 {e.seconds} 秒")
+                self.metrics.flood(kind, e.seconds)
+                limiter.pause(e.seconds)
+            finally:
+                self.metrics.observe(method, time.perf_counter() - start)
+    def account_of(self, client):
+        return next((account for account in self.accounts if account.client is client), self.accounts[0])
+    async def iter_messages(self, chat, limit=None, account=None, **kwargs):
+        '''
+        限速遍历消息：按页(每页 ITER_PAGE 条)通过 call 调用 get_messages，每页请求前先取 read 令牌，FloodWaitError 时暂停后重试
+        参数与 Telethon 的 iter_messages 相同，翻页时用上一页最后一条消息的 ID 作为 offset_id(正序/倒序都不含该条)
+        '''
+        account = account or self.accounts[0]
+        count = 0
+        while limit is None or count < limit:
+            size = ITER_PAGE if limit is None else min(ITER_PAGE, limit - count)
+            page = await self.call('read', account.client.get_messages, chat, limit=size, **kwargs)
+            for message in page:
+                yield message
+            count += len(page)
+            if len(page) < size:
+                break
+            kwargs['offset_id'] = page[-1].id
+            # offset_id 已确定位置，不再按时间偏移
+            kwargs.pop('offset_date', None)
+    async def input_peer(self, chat_name, save=True, account=None):
+        '''
+        优先使用磁盘缓存的实体，未缓存时向服务器解析并写入缓存，默认使用主账号
+        '''
+        account = account or self.accounts[0]
+        peer = account.peers.get(chat_name)
+        if peer is None:
+            peer = await self.call('read', account.client.get_input_entity, chat_name)
+            account.peers.set(chat_name, peer)
+            if save:
+                account.peers.save()
+        return peer
+    async def resolve_peers(self, names, account=None):
+        '''
+        并发解析未缓存的实体(受 read 限速约束)，返回无法解析的名称
+        '''
+        account = account or self.accounts[0]
+        missing = [name for name in dict.fromkeys(names) if name not in account.peers]
+        if not missing:
+            return []
+        results = await asyncio.gather(*(self.input_peer(name, False, account) for name in missing), return_exceptions=True)
+        account.peers.save()
+        failed = []
+        for name, result in zip(missing, results):
+            if isinstance(result, Exception):
+                print(f"【{name}】无法解析: {result}")
+                failed.append(name)
+        return failed
+    @contextlib.contextmanager
+    def peer_guard(self, chat_name, account=None):
+        '''
+        缓存的实体已失效(频道被删/改名/无权限)时清除缓存，下次重新解析
+        '''
+        peers = (account or self.accounts[0]).peers
+        try:
+            yield
+        except PEER_ERRORS:
+            if peers.invalidate(chat_name):
+                peers.save()
+            raise
+    def start_outbox(self):
+        '''
+        启动发送/删除队列的工作协程，扫描频道时只入队，不等待 Telegram 请求完成
+        '''
+        self.send_queue = asyncio.Queue()
+        self.delete_queue = asyncio.Queue()
+        self.send_retry_tasks = set()
+        self.outbox_workers = [asyncio.create_task(self.send_worker()) for _ in range(SEND_WORKERS)]
+        self.outbox_workers.append(asyncio.create_task(self.delete_worker()))
+    def enqueue_send(self, target_chat, text, file=None, client=None, source=None):
+        '''
+        带媒体的消息由读取它的账号发送(媒体的 file_reference 与账号绑定)，其余由主账号发送
+        source 为源消息 (监控频道, 消息 ID, 评论 ID)，多次发送失败后记入数据库，之后的运行只向失败的目标频道重发
+        '''
+        account = self.account_of(client) if file is not None else self.accounts[0]
+        self.send_queue.put_nowait((target_chat, text, file, account, source, 0))
+    def enqueue_delete(self, chat_name, message_ids):
+        '''
+        入队删除时同时移出目标频道的消息索引，否则被删的最新一条仍在索引中，更早的副本会被当作重复删除
+        '''
+        message_ids = [i for i in message_ids if i]
+        if message_ids:
+            self.store.unindex_messages(chat_name, message_ids)
+            self.store.commit()
+            self.delete_queue.put_nowait((chat_name, message_ids))
+    async def send_worker(self):
+        while True:
+            target_chat, text, file, account, source, attempt = await self.send_queue.get()
+            retrying = False
+            try:
+                with self.peer_guard(target_chat, account):
+                    peer = await self.input_peer(target_chat, account=account)
+                    await self.call('send', account.client.send_message, peer, text, file=file)
+                if source:
+                    self.store.remove_retry(source, target_chat)
+                # 本地维护各目标频道今日转发数
+                daily_counts = self.checkbox.setdefault("daily_counts", {})
+                daily_counts[target_chat] = daily_counts.get(target_chat, 0) + 1
+            except Exception as e:
+                if attempt < SEND_RETRIES:
+                    delay = SEND_RETRY_DELAY * 2 ** attempt
+                    print(f"发送到【{target_chat}】失败，{delay} 秒后重试: {e}")
+                    task = asyncio.create_task(self.requeue_send((target_chat, text, file, account, source, attempt + 1), delay))
+                    self.send_retry_tasks.add(task)
+                    task.add_done_callback(self.send_retry_tasks.discard)
+                    retrying = True
+                elif source:
+                    # 去重记录保持占用，已发送成功的目标频道不会重复收到，只向失败的目标频道重发
+                    attempts = self.store.add_retry(source, target_chat, text, file is not None)
+                    if attempts < SEND_RETRY_RUNS:
+                        print(f"发送到【{target_chat}】失败，下次运行重发: {e}")
+                    else:
+                        print(f"发送到【{target_chat}】累计失败 {attempts} 次，放弃重发: {e}")
+                        self.store.remove_retry(source, target_chat)
+                    self.store.commit()
+                else:
+                    print(f"发送到【{target_chat}】失败: {e}")
+            finally:
+                if not retrying:
+                    self.send_queue.task_done()
+    async def requeue_send(self, item, delay):
+        '''
+        等待 delay 秒后重新入队，入队后才结束原任务，flush_outbox 会等到重试完成
+        '''
+        try:
+            await asyncio.sleep(delay)
+            self.send_queue.put_nowait(item)
+        finally:
+            self.send_queue.task_done()
+    async def resend_failed(self, shards):
+        '''
+        重发之前运行中多次发送失败的消息，只发往失败的目标频道
+        带媒体的重新读取源消息(媒体的 file_reference 会过期)，源消息已被删除的放弃重发
+        '''
+        rows = self.store.take_retries()
+        if not rows:
+            return
+        print(f"重发 {len(rows)} 条之前发送失败的消息")
+        accounts = {chat_name: account for account, monitors in shards for chat_name, limit in monitors}
+        for chat_name, message_id, reply_id, target, text, media in rows:
+            source = (chat_name, message_id, reply_id)
+            if not media:
+                self.enqueue_send(target, text, source=source)
+                continue
+            account = accounts.get(chat_name, self.accounts[0])
+            try:
+                with self.peer_guard(chat_name, account):
+                    peer = await self.input_peer(chat_name, account=account)
+                    if reply_id:
+                        message = await self.get_reply(account.client, peer, message_id, reply_id)
+                    else:
+                        message = await self.call('read', account.client.get_messages, peer, ids=message_id)
+            except Exception as e:
+                print(f"读取【{chat_name}】消息 {message_id} 失败，下次运行重发: {e}")
+                continue
+            if message is None or message.media is None:
+                print(f"【{chat_name}】消息 {message_id} 已被删除，放弃重发")
+                self.store.remove_retry(source, target)
+                continue
+            self.enqueue_send(target, text, message.media, account.client, source)
+        self.store.commit()
+    async def delete_worker(self):
+        while True:
+            jobs = [await self.delete_queue.get()]
+            # 合并队列中已有的删除任务，同一聊天的消息按每批 DELETE_BATCH 条删除
+            while not self.delete_queue.empty():
+                jobs.append(self.delete_queue.get_nowait())
+            pending = {}
+            for chat_name, message_ids in jobs:
+                pending.setdefault(chat_name, []).extend(message_ids)
+            for chat_name, message_ids in pending.items():
+                for i in range(0, len(message_ids), DELETE_BATCH):
+                    try:
+                        with self.peer_guard(chat_name):
+                            await self.call('delete', self.client.delete_messages, await self.input_peer(chat_name), message_ids[i:i + DELETE_BATCH])
+                    except Exception as e:
+                        print(f"删除【{chat_name}】消息失败: {e}")
+            for _ in jobs:
+                self.delete_queue.task_done()
+    async def flush_outbox(self):
+        # 等待已入队的发送/删除全部完成
+        await self.send_queue.join()
+        await self.delete_queue.join()
+    async def close_outbox(self):
+        await self.flush_outbox()
+        for worker in self.outbox_workers:
+            worker.cancel()
+        await asyncio.gather(*self.outbox_workers, return_exceptions=True)
     def contains(self, s, include):
         return any(k in s for k in include)
     def nocontains(self, s, exclude):
@@ -82,42 +998,19 @@ class TGForwarder:
         根据用户自定义的替换规则替换文本内容
         参数:
         message (str): 需要替换的原始文本
-        replacements (dict): 替换规则字典，键为目标替换词，值为要被替换的词语列表
+        替换规则(self.replacements)在初始化时已编译为 self.replacer，一次扫描完成全部替换
         """
-        # 遍历替换规则
-        if self.replacements:
-            for target_word, source_words in self.replacements.items():
-                # 确保source_words是列表
-                if isinstance(source_words, str):
-                    source_words = [source_words]
-                # 遍历每个需要替换的词
-                for word in source_words:
-                    # 使用替换方法，而不是正则
-                    message = message.replace(word, target_word)
+        message = self.replacer(message)
         message = message.strip()
         return message
-    async def dispatch_channel(self, message, jumpLinks=[]):
-        hit = False
-        if self.channel_match:
-            for rule in self.channel_match:
-                if rule.get('include'):
-                    if not self.contains(message.message, rule['include']):
-                        continue
-                if rule.get('exclude'):
-                    if not self.nocontains(message.message, rule['exclude']):
-                        continue
-                await self.send(message, rule['target'], jumpLinks)
-                hit = True
-            if not hit:
-                await self.send(message, self.forward_to_channel, jumpLinks)
-        else:
-            await self.send(message, self.forward_to_channel, jumpLinks)
-    async def send(self, message, target_chat_name, jumpLinks=[]):
-        text = message.message
+    def apply_hyperlinks(self, text, jumpLinks):
+        '''
+        将消息中的超链接文字替换为对应分类的第一个 URL
+        '''
         if jumpLinks and self.hyperlink_text:
             categorized_urls = self.categorize_urls(jumpLinks)
             # 遍历每个分类
-            for category, keywords in hyperlink_text.items():
+            for category, keywords in self.hyperlink_text.items():
                 # 获取该分类的第一个 URL（如果有）
                 if categorized_urls.get(category):
                     url = categorized_urls[category][0]  # 使用第一个 URL
@@ -127,20 +1020,46 @@ class TGForwarder:
                 for keyword in keywords:
                     if keyword in text:
                         text = text.replace(keyword, url)
-        if self.nocontains(text, self.urls_kw):
+        return text
+    def render(self, message, jumpLinks=[]):
+        '''
+        生成转发文本，每条消息只生成一次，分发到多个频道时共用；不含资源链接时返回 None
+        '''
+        text = self.apply_hyperlinks(message.message, jumpLinks)
+        if 'urls' not in self.keywords.match(text):
+            return None
+        return self.replace_targets(text)
+    async def dispatch_channel(self, message, jumpLinks=[]):
+        hit = False
+        text = self.render(message, jumpLinks)
+        if text is None:
             return
+        if self.channel_match:
+            hits = self.keywords.match(message.message)
+            for i, rule in enumerate(self.channel_match):
+                if rule.get('include'):
+                    if f'rule{i}_include' not in hits:
+                        continue
+                if rule.get('exclude'):
+                    if f'rule{i}_exclude' in hits:
+                        continue
+                await self.send(message, rule['target'], text)
+                hit = True
+            if not hit:
+                await self.send(message, self.forward_to_channel, text)
+        else:
+            await self.send(message, self.forward_to_channel, text)
+    async def send(self, message, target_chat_name, text):
+        source = (current_chat.get(), message.id, 0)
         if message.media and isinstance(message.media, MessageMediaPhoto):
-            await self.client.send_message(
-                target_chat_name,
-                self.replace_targets(text),  # 复制消息文本
-                file=message.media  # 复制消息的媒体文件
-            )
+            # 复制消息文本和媒体文件
+            self.enqueue_send(target_chat_name, text, message.media, message.client, source)
         else:
-            await self.client.send_message(target_chat_name, self.replace_targets(text))
+            self.enqueue_send(target_chat_name, text, source=source)
     async def get_peer(self,client, channel_name):
         peer = None
         try:
-            peer = await client.get_input_entity(channel_name)
+            peer = await self.input_peer(channel_name, account=self.account_of(client))
         except Exception as e:
             print(f"Unexpected error: {e}")
         finally:
@@ -148,33 +1067,71 @@ class TGForwarder:
     async def get_all_replies(self,chat_name, message):
         '''
         获取频道消息下的评论，有些视频/资源链接被放在评论中
+        只请求一次，取上次检查之后最新的 replies_limit 条，按时间升序返回；已预取的直接使用预取结果
         '''
-        offset_id = 0
-        all_replies = []
-        peer = await self.get_peer(self.client, chat_name)
+        prefetched = getattr(message, '_replies', None)
+        if prefetched is not None:
+            return prefetched
+        # 使用读取该消息的账号，实体 access_hash 与账号绑定
+        client = self.account_of(message.client).client
+        peer = await self.get_peer(client, chat_name)
         if peer is None:
             return []
-        while True:
-            try:
-                replies = await self.client(functions.messages.GetRepliesRequest(
-                    peer=peer,
-                    msg_id=message.id,
-                    offset_id=offset_id,
-                    offset_date=None,
-                    add_offset=0,
-                    limit=100,
-                    max_id=0,
-                    min_id=0,
-                    hash=0
-                ))
-                all_replies.extend(replies.messages)
-                if len(replies.messages) < 100:
-                    break
-                offset_id = replies.messages[-1].id
-            except Exception as e:
-                print(f"Unexpected error while fetching replies: {e.__class__.__name__} {e}")
-                break
-        return all_replies
+        try:
+            replies = await self.call('read', client, functions.messages.GetRepliesRequest(
+                peer=peer,
+                msg_id=message.id,
+                offset_id=0,
+                offset_date=None,
+                add_offset=0,
+                limit=self.replies_limit,
+                max_id=0,
+                min_id=self.store.reply_cursor(chat_name, message.id),
+                hash=0
+            ))
+        except Exception as e:
+            print(f"Unexpected error while fetching replies: {e.__class__.__name__} {e}")
+            return []
+        return list(reversed(self.finish_replies(client, replies)))
+    def finish_replies(self, client, replies):
+        # 补全消息的客户端和实体信息，评论中的媒体由该账号发送
+        entities = {utils.get_peer_id(x): x for x in itertools.chain(replies.users, replies.chats)}
+        for reply in replies.messages:
+            reply._finish_init(client, entities, None)
+        return replies.messages
+    async def get_reply(self, client, peer, message_id, reply_id):
+        '''
+        读取频道消息下的指定评论，不存在时返回 None
+        '''
+        replies = await self.call('read', client, functions.messages.GetRepliesRequest(
+            peer=peer,
+            msg_id=message_id,
+            offset_id=0,
+            offset_date=None,
+            add_offset=0,
+            limit=1,
+            max_id=reply_id + 1,
+            min_id=reply_id - 1,
+            hash=0
+        ))
+        return next((reply for reply in self.finish_replies(client, replies) if reply.id == reply_id), None)
+    def wants_replies(self, message):
+        '''
+        是否需要检查评论：带媒体、不含关键词、不是视频且未被排除的图文，资源可能被放在评论中
+        '''
+        if not (self.check_replies and message.media and message.message):
+            return False
+        hits = self.keywords.match(message.message)
+        is_video = hasattr(message.document, 'mime_type') and self.contains(message.document.mime_type, 'video')
+        return 'exclude' not in hits and 'include' not in hits and not is_video
+    async def prefetch_replies(self, chat_name, messages):
+        '''
+        并发拉取扫描窗口内需要检查评论的消息的评论(受 read 限速约束)，结果暂存在消息对象上
+        '''
+        posts = [message for message in messages if not self.outdated(message) and self.wants_replies(message)]
+        results = await asyncio.gather(*(self.get_all_replies(chat_name, message) for message in posts))
+        for message, replies in zip(posts, results):
+            message._replies = replies
     async def daily_forwarded_count(self,target_channel):
         # 统计今日更新
         # 设置中国时区偏移（UTC+8）
@@ -187,8 +1144,8 @@ class TGForwarder:
         # 转换为 UTC 时间
         start_of_day_utc = start_of_day_china.astimezone(timezone.utc)
         # 获取今天第一条消息
-        result = await self.client(GetHistoryRequest(
-            peer=target_channel,
+        result = await self.call('read', self.client, GetHistoryRequest(
+            peer=await self.input_peer(target_channel),
             limit=1,  # 只需要获取一条消息
             offset_date=start_of_day_utc,
             offset_id=0,
@@ -201,101 +1158,120 @@ class TGForwarder:
         first_message_pos = result.offset_id_offset
         # 今日消息总数就是从第一条消息到最新消息的距离
         today_count = first_message_pos if first_message_pos else 0
+        return today_count
+    def daily_count_text(self, today_count):
         msg = f'**今日共更新【{today_count}】条资源 **\n\n'
         msg = msg + self.message_md
-        return msg,today_count
-    async def del_channel_forward_count_msg(self):
-        # 删除消息
-        chat_forward_count_msg_id = self.checkbox.get("chat_forward_count_msg_id")
-        if not chat_forward_count_msg_id:
-            return
-
-        forward_to_channel_message_id = chat_forward_count_msg_id.get(self.forward_to_channel)
-        if forward_to_channel_message_id:
-            await self.client.delete_messages(self.forward_to_channel, [forward_to_channel_message_id])
-
-        if self.channel_match:
-            for rule in self.channel_match:
-                target_channel_msg_id = chat_forward_count_msg_id.get(rule['target'])
-                await self.client.delete_messages(rule['target'], [target_channel_msg_id])
+        return msg
+    async def edit_count_msg(self, target, message_id, text):
+        '''
+        原地编辑置顶的统计消息，消息已不存在时返回 False
+        '''
+        try:
+            with self.peer_guard(target):
+                await self.call('send', self.client.edit_message, await self.input_peer(target), message_id, text, parse_mode='md')
+            return True
+        except errors.MessageNotModifiedError:
+            return True
+        except Exception as e:
+            print(f"编辑【{target}】统计消息失败，重新发送: {e}")
+            return False
     async def send_daily_forwarded_count(self):
-        await self.del_channel_forward_count_msg()
-
-        chat_forward_count_msg_id = {}
-        msg,tc = await self.daily_forwarded_count(self.forward_to_channel)
-        sent_message = await self.client.send_message(self.forward_to_channel, msg , parse_mode='md')
-        self.checkbox["today_count"] = tc
-        # 置顶消息
-        await self.client.pin_message(self.forward_to_channel, sent_message.id)
-        await self.client.delete_messages(self.forward_to_channel, [sent_message.id + 1])
-
-        chat_forward_count_msg_id[self.forward_to_channel] = sent_message.id
-        if self.channel_match:
-            for rule in self.channel_match:
-                m,t = await self.daily_forwarded_count(rule['target'])
-                sm = await self.client.send_message(rule['target'], m)
-                self.checkbox["today_count"] = self.checkbox["today_count"] + t
-                chat_forward_count_msg_id[rule['target']] = sm.id
-                await self.client.pin_message(rule['target'], sm.id)
-                await self.client.delete_messages(rule['target'], [sm.id+1])
-        self.checkbox["chat_forward_count_msg_id"] = chat_forward_count_msg_id
+        '''
+        更新各目标频道置顶的今日统计：平时用本地计数原地编辑置顶消息，
+        跨天或距上次核对超过 COUNT_RECOUNT_INTERVAL 时才向服务器重新统计，跨天时发送新的统计消息并置顶
+        '''
+        day = (datetime.utcnow() + self.china_timezone_offset).date().isoformat()
+        daily_counts = self.checkbox.setdefault("daily_counts", {})
+        chat_forward_count_msg_id = self.checkbox.setdefault("chat_forward_count_msg_id", {})
+        rollover = self.checkbox.get("counts_day") != day
+        recount = rollover or time.time() - self.checkbox.get("counts_checked", 0) >= COUNT_RECOUNT_INTERVAL
+        targets = self.target_chats()
+        for target in targets:
+            if recount or target not in daily_counts:
+                daily_counts[target] = await self.daily_forwarded_count(target)
+            text = self.daily_count_text(daily_counts[target])
+            message_id = chat_forward_count_msg_id.get(target)
+            if not rollover and message_id and await self.edit_count_msg(target, message_id, text):
+                continue
+            # 删除旧的统计消息，发送新消息并置顶
+            self.enqueue_delete(target, [message_id])
+            peer = await self.input_peer(target)
+            sent_message = await self.call('send', self.client.send_message, peer, text, parse_mode='md')
+            await self.call('send', self.client.pin_message, peer, sent_message.id)
+            # 删除置顶产生的服务消息
+            self.enqueue_delete(target, [sent_message.id + 1])
+            chat_forward_count_msg_id[target] = sent_message.id
+        if recount:
+            self.checkbox["counts_checked"] = time.time()
+        self.checkbox["counts_day"] = day
+        self.checkbox["today_count"] = sum(daily_counts.get(target, 0) for target in targets)
     async def redirect_url(self, message):
         links = []
         if message.entities:
-            for entity in message.entities:
-                if isinstance(entity, MessageEntityTextUrl):
-                    if 'start' in entity.url:
-                        url = await self.tgbot(entity.url)
-                        if url:
-                            links.append(url)
-                    elif self.nocontains(entity.url, self.urls_kw):
-                        continue
-                    else:
-                        url = urllib.parse.unquote(entity.url)
-                        matches = re.findall(self.pattern, url)
-                        if matches:
-                            links+=matches
-            return links
+            # 消息中的超链接并行解析，结果按原顺序合并
+            urls = [entity.url for entity in message.entities if isinstance(entity, MessageEntityTextUrl)]
+            for found in await asyncio.gather(*(self.resolve_url(url) for url in urls)):
+                links += found
+        return links
+    async def resolve_url(self, url):
+        if 'start' in url:
+            link = await self.tgbot(url)
+            return [link] if link else []
+        if 'urls' not in self.keywords.match(url):
+            return []
+        url = urllib.parse.unquote(url)
+        return self.pattern.findall(url)
     async def tgbot(self,url):
+        '''
+        向机器人发送 /start 参数，在会话中等待机器人回复资源链接；结果按 机器人+参数 长期缓存
+        '''
         link = ''
         try:
-            # 发送 /start 命令，带上自定义参数
             # 提取机器人用户名
             bot_username = url.split('/')[-1].split('?')[0]
             # 提取命令和参数
             query_string = url.split('?')[1]
             command, parameter = query_string.split('=')
-            bot_links = self.checkbox["bot_links"]
-
-            if bot_links.get(parameter):
-                link = bot_links.get(parameter)
+            link = self.store.bot_link(bot_username, parameter)
+            if link:
                 return link
-            else:
-                await self.client.send_message(bot_username, f'/{command} {parameter}')
-                # 等待一段时间以便消息到达
-                await asyncio.sleep(2)
-                # 获取最近的消息
-                messages = await self.client.get_messages(bot_username, limit=1)  # 获取最近1条消息
-                # print(f'消息内容: {messages[0].message}')
-                message = messages[0].message
-                links = re.findall(r'(https?://[^\s]+)', message)
-                if links:
-                    link = links[0]
-                    bot_links[parameter] = link
-                    self.checkbox["bot_links"] = bot_links
+            async with self.bot_locks[bot_username]:
+                # 等锁期间可能已被其他消息解析过
+                link = self.store.bot_link(bot_username, parameter)
+                if link:
+                    return link
+                await self.limiters['send'].acquire()
+                start = time.perf_counter()
+                try:
+                    async with self.client.conversation(bot_username, timeout=BOT_TIMEOUT) as conv:
+                        # 发送 /start 命令，带上自定义参数
+                        await conv.send_message(f'/{command} {parameter}')
+                        # 机器人可能先回复提示语，读取前几条回复直到出现链接
+                        for _ in range(BOT_MAX_REPLIES):
+                            response = await conv.get_response()
+                            links = BOT_LINK_PATTERN.findall(response.message or '')
+                            if links:
+                                link = links[0]
+                                self.store.set_bot_link(bot_username, parameter, link)
+                                self.metrics.incr('bot_links_resolved')
+                                break
+                finally:
+                    self.metrics.observe('bot_conversation', time.perf_counter() - start)
+        except asyncio.TimeoutError:
+            print(f'TG_Bot 等待回复超时: {url}')
         except Exception as e:
             print(f'TG_Bot error: {e}')
         return link
-    async def reverse_async_iter(self, async_iter, limit):
-        # 使用 deque 存储消息，方便从尾部添加
-        buffer = deque(maxlen=limit)
-
-        # 将消息填充到 buffer 中
-        async for message in async_iter:
-            buffer.append(message)
-
-        # 从 buffer 的尾部开始逆序迭代
-        for message in reversed(buffer):
+    async def new_messages(self, chat, chat_name, limit, account=None):
+        '''
+        按消息 ID 升序返回上次处理之后最新的 limit 条消息；首次运行没有检查点，取最近 limit 条
+        由新到旧拉取再倒序，两次运行间新消息超过 limit 条时跳过较早的，检查点直接推进到频道最新消息，不会越积越多
+        '''
+        account = account or self.accounts[0]
+        min_id = self.store.checkpoint(chat_name)
+        messages = await self.call('read', account.client.get_messages, chat, limit=limit, min_id=min_id)
+        for message in reversed(messages):
             yield message
     async def delete_messages_in_time_range(self, chat_name, start_time_str, end_time_str):
         """
@@ -310,18 +1286,22 @@ class TGForwarder:
         # 将字符串时间解析为带有时区信息的 datetime 对象
         start_time = datetime.strptime(start_time_str, "%Y-%m-%d %H:%M").replace(tzinfo=china_timezone)
         end_time = datetime.strptime(end_time_str, "%Y-%m-%d %H:%M").replace(tzinfo=china_timezone)
-        # 获取聊天实体
-        chat = await self.client.get_entity(chat_name)
-        # 遍历消息
-        async for message in self.client.iter_messages(chat):
-            # 将消息时间转换为中国时区
-            message_china_time = message.date.astimezone(china_timezone)
-            # 判断消息是否在目标时间范围内
-            if start_time <= message_china_time <= end_time:
-                # print(f"删除消息：{message.text} (时间：{message_china_time})")
-                await message.delete()  # 删除消息
+        with self.peer_guard(chat_name):
+            # 获取聊天实体
+            chat = await self.input_peer(chat_name)
+            message_ids = []
+            # 从结束时间直接跳到范围内(offset_date 取该时间之前的消息，加 1 秒包含结束时间)，由新到旧遍历，早于开始时间即停止
+            async for message in self.iter_messages(chat, offset_date=end_time + timedelta(seconds=1)):
+                if message.date < start_time:
+                    break
+                message_ids.append(message.id)
+            # 由删除队列按每批 DELETE_BATCH 条删除
+            self.enqueue_delete(chat_name, message_ids)
+            print(f"【{chat_name}】待删除消息: {len(message_ids)} 条")
     async def clear_main(self, start_time, end_time):
+        self.start_outbox()
         await self.delete_messages_in_time_range(self.forward_to_channel, start_time, end_time)
+        await self.close_outbox()
     def clear(self):
         start_time = "2025-01-08 23:55"
         end_time = "2025-01-09 08:00"
@@ -331,47 +1311,26 @@ class TGForwarder:
         """
         将 URL 按云盘厂商和磁力链接分类并存储到字典中
         """
-        # 定义分类规则
-        categories = {
-            "magnet": ["magnet"],  # 磁力链接
-            "uc": ["drive.uc.cn"],  # UC
-            "mobile": ["caiyun.139.com"],  # 移动
-            "tianyi": ["cloud.189.cn"],  # 天翼
-            "quark": ["pan.quark.cn"],  # 夸克
-            "115": ["115cdn.com","115.com", "anxia.com"],  # 115
-            "aliyun": ["alipan.com", "aliyundrive.com"],  # 阿里云
-            "pikpak": ["mypikpak.com"],
-            "baidu": ["pan.baidu.com"],
-            "others": []  # 其他
-        }
-        # 初始化结果字典
-        result = {category: [] for category in categories}
-        # 遍历 URL 列表
+        result = {category: [] for category in URL_CATEGORIES}
         for url in urls:
-            # 单独处理磁力链接
-            if url.startswith("magnet:"):
-                result["magnet"].append(url)
-                continue
-            # 解析 URL
-            parsed_url = urllib.parse.urlparse(url)
-            domain = parsed_url.netloc.lower()  # 获取域名并转换为小写
-            # 判断 URL 类型
-            categorized = False
-            for category, domains in categories.items():
-                if any(pattern in domain for pattern in domains):
-                    result[category].append(url)
-                    categorized = True
-                    break
-            # 如果未分类，放入 "others"
-            if not categorized:
-                result["others"].append(url)
+            result[url_category(url)].append(url)
         return result
+    def message_links(self, message):
+        '''
+        提取消息中的资源链接，结果缓存在消息对象上，过滤、去重、转发共用，同一条消息只匹配一次
+        '''
+        links = getattr(message, '_resource_links', None)
+        if links is None:
+            links = self.pattern.findall(message.message or '')
+            message._resource_links = links
+        return links
     async def deduplicate_links(self,links=[]):
         """
         删除聊天中重复链接的旧消息，只保留最新的消息
         """
-        # 将 links 列表转换为集合，方便快速查找
-        target_links = set(self.checkbox['links']) if not links else links
+        # 默认处理今日转发过的链接
+        start_of_today = datetime.combine(self.today, datetime.min.time()).replace(tzinfo=timezone(self.china_timezone_offset)).timestamp()
+        target_links = self.store.since('link', start_of_today) if not links else links
         if not target_links:
             return 
         chats = [self.forward_to_channel]
@@ -379,211 +1338,469 @@ class TGForwarder:
             for rule in self.channel_match:
                 chats.append(rule['target'])
         for chat_name in chats:
-            # 已经存在的link
-            links_exist = set()
+            with self.peer_guard(chat_name):
+                # 获取聊天实体
+                chat = await self.input_peer(chat_name)
+                # 增量同步本地索引，只读取上次索引之后的新消息
+                await self.sync_target_index(chat, chat_name)
+                groups = self.store.duplicate_groups(chat_name, target_links)
+                # 索引中的消息可能已被手动或其他工具删除，先核对哪些仍存在，每组保留仍存在的最新一条
+                ids = [message_id for group in groups for message_id in group]
+                existing = set()
+                for i in range(0, len(ids), ITER_PAGE):
+                    messages = await self.call('read', self.client.get_messages, chat, ids=ids[i:i + ITER_PAGE])
+                    existing.update(message.id for message in messages if message)
+            dead = [message_id for message_id in ids if message_id not in existing]
+            if dead:
+                self.store.unindex_messages(chat_name, dead)
+                self.store.commit()
             # 用于批量删除的消息ID列表
-            messages_to_delete = []
-            # 获取聊天实体
-            chat = await self.client.get_entity(chat_name)
-            # 遍历消息
-            messages = self.client.iter_messages(chat)
-            async for message in messages:
-                if message.message:
-                    # 提取消息中的链接
-                    links_in_message = re.findall(self.pattern, message.message)
-                    if not links_in_message:
-                        continue  # 如果消息中没有链接，跳过
-                    link = links_in_message[0]
-                    # 检查消息中的链接是否在目标链接列表中
-                    if link in target_links:  # 只处理目标链接
-                        if link in links_exist:
-                            messages_to_delete.append(message.id)
-                        else:
-                            links_exist.add(link)
+            messages_to_delete = [message_id for group in groups for message_id in [m for m in group if m in existing][1:]]
             # 批量删除旧消息
             if messages_to_delete:
                 print(f"【{chat_name}】删除 {len(messages_to_delete)} 条历史重复消息")
-                await self.client.delete_messages(chat, messages_to_delete)
+                self.enqueue_delete(chat_name, messages_to_delete)
+    async def sync_target_index(self, chat, chat_name):
+        '''
+        将目标频道上次索引之后的消息(消息 ID -> 第一个资源链接)写入本地索引，首次运行读取全部历史
+        '''
+        key = f'index:{chat_name}'
+        min_id = self.store.checkpoint(key)
+        last_id = 0
+        async for message in self.iter_messages(chat, min_id=min_id, reverse=True):
+            last_id = message.id
+            if message.message:
+                # 提取消息中的链接
+                links_in_message = self.message_links(message)
+                if links_in_message:
+                    self.store.index_message(chat_name, message.id, links_in_message[0])
+        if last_id:
+            self.store.set_checkpoint(key, last_id)
+        self.store.commit()
     async def checkhistory(self):
         '''
-        检索历史消息用于过滤去重
+        检索历史消息用于过滤去重，结果写入去重库
         '''
-        links = []
-        sizes = []
         if os.path.exists(self.history):
             with open(self.history, 'r', encoding='utf-8') as f:
                 self.checkbox = json.loads(f.read())
-                if self.checkbox.get('today') == datetime.now().strftime("%Y-%m-%d"):
-                    links = self.checkbox['links']
-                    sizes = self.checkbox['sizes']
-                else:
-                    self.checkbox['links'] = []
-                    self.checkbox['sizes'] = []
-                    self.checkbox["bot_links"] = {}
+                # 旧版 history.json 中的链接迁移到去重库，视频大小记录已由视频指纹取代
+                for link in self.checkbox.pop('links', []):
+                    self.store.add('link', link)
+                self.checkbox.pop('sizes', None)
+                # 机器人链接缓存已移到去重库，按 机器人+参数 保存，不再每日清空
+                self.checkbox.pop('bot_links', None)
+                if self.checkbox.get('today') != datetime.now().strftime("%Y-%m-%d"):
                     self.checkbox["today_count"] = 0
                 self.today_count = self.checkbox.get('today_count') if self.checkbox.get('today_count') else self.checknum
         self.checknum = self.checknum if self.today_count < self.checknum else self.today_count
-        chat = await self.client.get_entity(self.forward_to_channel)
-        messages = self.client.iter_messages(chat, limit=self.checknum)
-        async for message in messages:
-            # 视频类型对比大小
-            if hasattr(message.document, 'mime_type'):
-                sizes.append(message.document.size)
-            # 匹配出链接
-            if message.message:
-                matches = re.findall(self.pattern, message.message)
-                if matches:
-                    links.append(matches[0])
-        links = list(set(links))
-        sizes = list(set(sizes))
-        return links,sizes
-    async def copy_and_send_message(self, source_chat, target_chat, message_id, text=''):
+        with self.peer_guard(self.forward_to_channel):
+            chat = await self.input_peer(self.forward_to_channel)
+            messages = self.iter_messages(chat, limit=self.checknum)
+            async for message in messages:
+                ts = message.date.timestamp()
+                # 视频记录指纹
+                if hasattr(message.document, 'mime_type'):
+                    self.store.add_media(message.document, ts)
+                # 匹配出链接
+                if message.message:
+                    matches = self.message_links(message)
+                    if matches:
+                        self.store.add('link', matches[0], ts)
+                    key = title_key(message.message)
+                    if key and NEAR_DUP_WINDOW:
+                        self.store.add('title', TitleIndex.dumps(key), ts)
+        self.store.commit()
+        if NEAR_DUP_WINDOW:
+            for key, ts in self.store.entries('title', time.time() - NEAR_DUP_WINDOW):
+                self.titles.add(TitleIndex.loads(key), ts)
+    def claim_title(self, message):
+        '''
+        标题近似重复的检查并占用：窗口内已有相近标题返回 False，否则记录标题并返回 True；没有标题或未开启时返回 True
+        '''
+        key = title_key(message.message) if NEAR_DUP_WINDOW else None
+        if key is None:
+            return True
+        if self.titles.find(key):
+            return False
+        self.titles.add(key)
+        self.store.add('title', TitleIndex.dumps(key))
+        return True
+    def copy_and_send_message(self, message, target_chat, text='', post=None):
         """
-        复制消息内容并发送新消息
-        :param source_chat: 源聊天（可以是用户名、ID 或输入实体）
+        复制消息内容并发送新消息，直接使用已获取的消息对象，不重新拉取
+        :param message: 要复制的消息
         :param target_chat: 目标聊天（可以是用户名、ID 或输入实体）
-        :param message_id: 要复制的消息 ID
+        :param text: 发送的文本
+        :param post: message 为评论时所属的频道消息，发送失败后据此重新读取评论
         """
+        source = (current_chat.get(), post.id, message.id) if post else (current_chat.get(), message.id, 0)
+        # 发送新消息（复制原始消息内容和媒体文件）
+        self.enqueue_send(target_chat, text, message.media, message.client, source)
+    async def forward_messages(self, chat_name, limit, account=None):
+        account = account or self.accounts[0]
+        current_chat.set(chat_name)
+        print(f'当前监控频道【{chat_name}】，本次检测最近【{len(self.store)}】条历史资源进行去重')
         try:
-            # 获取原始消息
-            message = await self.client.get_messages(source_chat, ids=message_id)
-            if not message:
-                print("未找到消息")
-                return
-
-            # 发送新消息（复制原始消息内容和媒体文件）
-            await self.client.send_message(
-                target_chat,
-                text,  # 复制消息文本
-                file=message.media  # 复制消息的媒体文件
-            )
-            # print("消息复制并发送成功")
-        except Exception as e:
-            print(f"操作失败: {e}")
-    async def forward_messages(self, chat_name, limit, hlinks, hsizes):
-        global total
-        links = hlinks
-        sizes = hsizes
-        print(f'当前监控频道【{chat_name}】，本次检测最近【{len(links)}】条历史资源进行去重')
-        try:
-            if try_join:
-                await self.client(JoinChannelRequest(chat_name))
-            chat = await self.client.get_entity(chat_name)
-            messages = self.client.iter_messages(chat, limit=limit, reverse=False)
-            async for message in self.reverse_async_iter(messages, limit=limit):
-                if self.only_today:
-                    # 将消息时间转换为中国时区
-                    message_china_time = message.date + self.china_timezone_offset
-                    # 判断消息日期是否是当天
-                    if message_china_time.date() != self.today:
-                        continue
-                self.random_wait(200, 1000)
-                if message.media:
-                    # 视频
-                    if hasattr(message.document, 'mime_type') and self.contains(message.document.mime_type,'video') and self.nocontains(message.message, self.exclude):
-                        size = message.document.size
-                        text = message.message
-                        if message.message:
-                            jumpLinks = await self.redirect_url(message)
-                            if jumpLinks and self.hyperlink_text:
-                                categorized_urls = self.categorize_urls(jumpLinks)
-                                # 遍历每个分类
-                                for category, keywords in hyperlink_text.items():
-                                    # 获取该分类的第一个 URL（如果有）
-                                    if categorized_urls.get(category):
-                                        url = categorized_urls[category][0]  # 使用第一个 URL
-                                    else:
-                                        continue  # 如果没有 URL，跳过
-                                    # 遍历关键词并替换
-                                    for keyword in keywords:
-                                        if keyword in text:
-                                            text = text.replace(keyword, url)
-                        if size not in sizes:
-                            await self.copy_and_send_message(chat_name,self.forward_to_channel,message.id,text)
-                            sizes.append(size)
-                            total += 1
-                        else:
-                            print(f'视频已经存在，size: {size}')
-                    # 图文(匹配关键词)
-                    elif self.contains(message.message, self.include) and message.message and self.nocontains(message.message, self.exclude):
-                        jumpLinks = await self.redirect_url(message)
-                        matches = re.findall(self.pattern, message.message) if self.contains(message.message, self.urls_kw) else []
-                        if matches or jumpLinks:
-                            link = jumpLinks[0] if jumpLinks else matches[0]
-                            if link not in links:
-                                await self.dispatch_channel(message, jumpLinks)
-                                total += 1
-                                links.append(link)
-                            else:
-                                print(f'链接已存在，link: {link}')
-                    # 资源被放到评论中，图文(不含关键词)
-                    elif self.check_replies and message.message and self.nocontains(message.message, self.exclude):
-                        replies = await self.get_all_replies(chat_name,message)
-                        replies = replies[-self.replies_limit:]
-                        for r in replies:
-                            # 评论中的视频
-                            if hasattr(r.document, 'mime_type') and self.contains(r.document.mime_type,'video') and self.nocontains(r.message, self.exclude):
-                                size = r.document.size
-                                if size not in sizes:
-                                    # await self.client.forward_messages(self.forward_to_channel, r)
-                                    await self.copy_and_send_message(chat_name, self.forward_to_channel, r.id, r.message)
-                                    total += 1
-                                    sizes.append(size)
-                                else:
-                                    print(f'视频已经存在，size: {size}')
-                            # 评论中链接关键词
-                            elif self.contains(r.message, self.include) and r.message and self.nocontains(r.message, self.exclude):
-                                matches = re.findall(self.pattern, r.message)
-                                if matches:
-                                    link = matches[0]
-                                    if link not in links:
-                                        await self.dispatch_channel(message)
-                                        total += 1
-                                        links.append(link)
-                                    else:
-                                        print(f'链接已存在，link: {link}')
-                # 纯文本消息
-                elif message.message:
-                    if self.contains(message.message, self.include) and self.nocontains(message.message, self.exclude):
-                        jumpLinks = await self.redirect_url(message)
-                        matches = re.findall(self.pattern, message.message) if self.contains(message.message, self.urls_kw) else []
-                        if matches or jumpLinks:
-                            link = jumpLinks[0] if jumpLinks else matches[0]
-                            if link not in links:
-                                await self.dispatch_channel(message, jumpLinks)
-                                total += 1
-                                links.append(link)
-                            else:
-                                print(f'链接已存在，link: {link}')
-            print(f"从 {chat_name} 转发资源 成功: {total}")
-            return list(set(links)), list(set(sizes))
+            with self.peer_guard(chat_name, account):
+                chat = await self.input_peer(chat_name, account=account)
+                if try_join:
+                    await self.call('send', account.client, JoinChannelRequest(chat))
+                first_id = self.store.checkpoint(chat_name)
+                last_id = 0
+                count = 0
+                messages = [message async for message in self.new_messages(chat, chat_name, limit, account)]
+                if self.check_replies:
+                    await self.prefetch_replies(chat_name, messages)
+                for message in messages:
+                    # 上一条消息已处理完，推进检查点
+                    if last_id:
+                        self.store.set_checkpoint(chat_name, last_id)
+                    last_id = message.id
+                    count += 1
+                    self.counters[chat_name] += await self.process_message(chat_name, message)
+                if last_id:
+                    self.store.set_checkpoint(chat_name, last_id)
+                if self.check_replies:
+                    self.counters[chat_name] += await self.recheck_replies(chat, chat_name, {message.id for message in messages}, account)
+                # 频道消息 ID 连续递增，两次检查点之差即期间新发的消息数
+                self.record_volume(chat_name, last_id - first_id if first_id and last_id else count)
+            print(f"从 {chat_name} 转发资源 成功: {self.counters[chat_name]}")
         except Exception as e:
             print(f"从 {chat_name} 转发资源 失败: {e}")
-    async def main(self):
-        start_time = time.time()
-        links,sizes = await self.checkhistory()
+        finally:
+            self.store.commit()
+    def outdated(self, message):
+        '''
+        只转发当日消息时，判断消息是否不是当天发布的
+        '''
+        if not self.only_today:
+            return False
+        # 将消息时间转换为中国时区
+        message_china_time = message.date + self.china_timezone_offset
+        # 判断消息日期是否是当天
+        return message_china_time.date() != self.today
+    async def process_message(self, chat_name, message):
+        '''
+        对单条消息执行过滤、去重、分发，批量扫描和实时事件共用，返回转发数
+        去重使用 store.claim 检查并占用，多个频道并发扫描时同一资源只会转发一次
+        '''
+        forwarded = 0
+        current_chat.set(chat_name)
+        self.metrics.incr('scanned')
+        if self.outdated(message):
+            self.metrics.filter('outdated')
+            return forwarded
+        hits = self.keywords.match(message.message)
+        if message.media:
+            # 视频
+            if hasattr(message.document, 'mime_type') and self.contains(message.document.mime_type,'video') and 'exclude' not in hits:
+                document = message.document
+                # 已知视频直接跳过，不再解析消息中的链接
+                if self.store.seen_media(document):
+                    print(f'视频已经存在，id: {document.id}')
+                    self.metrics.incr('duplicates')
+                    return forwarded
+                text = message.message
+                if message.message:
+                    jumpLinks = await self.redirect_url(message)
+                    text = self.apply_hyperlinks(text, jumpLinks)
+                if self.store.claim_media(document):
+                    self.copy_and_send_message(message, self.forward_to_channel, text)
+                    forwarded += 1
+                else:
+                    print(f'视频已经存在，id: {document.id}')
+                    self.metrics.incr('duplicates')
+            # 图文(匹配关键词)
+            elif 'include' in hits and 'exclude' not in hits:
+                jumpLinks = await self.redirect_url(message)
+                matches = self.message_links(message) if 'urls' in hits else []
+                if matches or jumpLinks:
+                    link = jumpLinks[0] if jumpLinks else matches[0]
+                    if not self.store.claim('link', link):
+                        print(f'链接已存在，link: {link}')
+                        self.metrics.incr('duplicates')
+                    elif not self.claim_title(message):
+                        print(f'相似资源已存在，link: {link}')
+                        self.metrics.incr('near_duplicates')
+                    else:
+                        await self.dispatch_channel(message, jumpLinks)
+                        forwarded += 1
+                else:
+                    self.metrics.filter('no_link')
+            # 资源被放到评论中，图文(不含关键词)
+            elif self.wants_replies(message):
+                replies = await self.get_all_replies(chat_name,message)
+                forwarded += await self.process_replies(chat_name, message, replies)
+                if not replies:
+                    self.metrics.filter('no_replies')
+            else:
+                self.metrics.filter('excluded' if 'exclude' in hits else 'no_keyword')
+        # 纯文本消息
+        elif message.message:
+            if 'include' in hits and 'exclude' not in hits:
+                jumpLinks = await self.redirect_url(message)
+                matches = self.message_links(message) if 'urls' in hits else []
+                if matches or jumpLinks:
+                    link = jumpLinks[0] if jumpLinks else matches[0]
+                    if not self.store.claim('link', link):
+                        print(f'链接已存在，link: {link}')
+                        self.metrics.incr('duplicates')
+                    elif not self.claim_title(message):
+                        print(f'相似资源已存在，link: {link}')
+                        self.metrics.incr('near_duplicates')
+                    else:
+                        await self.dispatch_channel(message, jumpLinks)
+                        forwarded += 1
+                else:
+                    self.metrics.filter('no_link')
+            else:
+                self.metrics.filter('excluded' if 'exclude' in hits else 'no_keyword')
+        else:
+            self.metrics.filter('empty')
+        self.metrics.incr('forwarded', forwarded)
+        return forwarded
+    async def process_replies(self, chat_name, message, replies):
+        '''
+        处理频道消息下的评论(视频或含资源链接)，并记录已检查到的评论 ID，返回转发数
+        没有新评论时也记录，之后的扫描在最近 REPLY_RECHECK_POSTS 条内继续检查这条消息的新评论
+        '''
+        forwarded = 0
+        # 下次只检查更新的评论
+        self.store.set_reply_cursor(chat_name, message.id, replies[-1].id if replies else 0)
+        for r in replies:
+            r_hits = self.keywords.match(r.message)
+            # 评论中的视频
+            if hasattr(r.document, 'mime_type') and self.contains(r.document.mime_type,'video') and 'exclude' not in r_hits:
+                if self.store.claim_media(r.document):
+                    # await self.client.forward_messages(self.forward_to_channel, r)
+                    self.copy_and_send_message(r, self.forward_to_channel, r.message, message)
+                    forwarded += 1
+                else:
+                    print(f'视频已经存在，id: {r.document.id}')
+                    self.metrics.incr('duplicates')
+            # 评论中链接关键词
+            elif 'include' in r_hits and 'exclude' not in r_hits:
+                matches = self.message_links(r)
+                if matches:
+                    link = matches[0]
+                    if not self.store.claim('link', link):
+                        print(f'链接已存在，link: {link}')
+                        self.metrics.incr('duplicates')
+                    # 转发的是频道消息本身，按频道消息的标题判断近似重复
+                    elif not self.claim_title(message):
+                        print(f'相似资源已存在，link: {link}')
+                        self.metrics.incr('near_duplicates')
+                    else:
+                        await self.dispatch_channel(message)
+                        forwarded += 1
+        return forwarded
+    async def recheck_replies(self, chat, chat_name, checked, account=None):
+        '''
+        重新检查最近需要检查评论的消息(本次已检查的除外)，从记录的评论 ID 之后读取新评论，返回转发数
+        '''
+        account = account or self.accounts[0]
+        ids = [i for i in self.store.recent_reply_posts(chat_name, REPLY_RECHECK_POSTS) if i not in checked]
+        if not ids:
+            return 0
+        posts = await self.call('read', account.client.get_messages, chat, ids=ids)
+        # 已被删除的消息不再检查
+        self.store.forget_reply_posts(chat_name, [i for i, post in zip(ids, posts) if post is None])
+        posts = [post for post in posts if post]
+        await self.prefetch_replies(chat_name, posts)
+        forwarded = 0
+        for post in posts:
+            if hasattr(post, '_replies'):
+                forwarded += await self.process_replies(chat_name, post, post._replies)
+        self.metrics.incr('forwarded', forwarded)
+        return forwarded
+    def record_volume(self, chat_name, count):
+        '''
+        记录频道每次扫描的新消息数(指数平滑)，用于在账号间分配监控频道
+        '''
+        volumes = self.checkbox.setdefault("channel_volume", {})
+        old = volumes.get(chat_name)
+        volumes[chat_name] = count if old is None else round(old * 0.5 + count * 0.5, 1)
+    def shard_monitors(self, monitors):
+        '''
+        按历史消息量把监控频道分配给各账号：从消息量大的频道开始，每次分给当前负载最小的账号
+        单次扫描最多读取 limit 条，负载按 min(消息量, limit) 计算，没有记录的频道按 limit 计算
+        '''
+        volumes = self.checkbox.get("channel_volume", {})
+        weight = lambda m: max(min(volumes.get(m[0], m[1]), m[1]), 1)
+        shards = [[] for _ in self.accounts]
+        loads = [0] * len(self.accounts)
+        for monitor in sorted(monitors, key=weight, reverse=True):
+            i = loads.index(min(loads))
+            shards[i].append(monitor)
+            loads[i] += weight(monitor)
+        return list(zip(self.accounts, shards))
+    def monitor_limits(self):
+        '''
+        解析监控列表，支持 频道|条数 的写法单独指定检测条数
+        '''
+        monitors = []
         for chat_name in self.channels_groups_monitor:
             limit = self.limit
             if '|' in chat_name:
                 limit = int(chat_name.split('|')[1])
                 chat_name = chat_name.split('|')[0]
-            global total
-            total = 0
-            links, sizes = await self.forward_messages(chat_name, limit, links, sizes)
-        await self.send_daily_forwarded_count()
+            monitors.append((chat_name, limit))
+        return monitors
+    def save_metrics(self):
+        '''
+        输出指标报告和 Prometheus textfile
+        '''
+        try:
+            if METRICS_REPORT:
+                self.metrics.write_json(METRICS_REPORT)
+            if METRICS_TEXTFILE:
+                self.metrics.write_textfile(METRICS_TEXTFILE)
+        except OSError as e:
+            print(f"写入指标失败: {e}")
+    def save_history(self):
         with open(self.history, 'w+', encoding='utf-8') as f:
-            self.checkbox['links'] = list(set(links))[-self.checkbox["today_count"]:]
-            self.checkbox['sizes'] = list(set(sizes))[-self.checkbox["today_count"]:]
             self.checkbox['today'] = datetime.now().strftime("%Y-%m-%d")
             f.write(json.dumps(self.checkbox))
+    async def scan_channels(self, shards):
+        '''
+        各账号并行扫描分到的监控频道，每个账号最多同时扫描 SCAN_CONCURRENCY 个，结束后汇总各频道转发数
+        '''
+        async def scan(account, semaphore, chat_name, limit):
+            async with semaphore:
+                await self.forward_messages(chat_name, limit, account)
+
+        tasks = []
+        for account, monitors in shards:
+            semaphore = asyncio.Semaphore(SCAN_CONCURRENCY)
+            tasks += [scan(account, semaphore, chat_name, limit) for chat_name, limit in monitors]
+        await asyncio.gather(*tasks)
+        print(f"本次共转发资源: {sum(self.counters.values())}")
+    def target_chats(self):
+        targets = [self.forward_to_channel]
+        if self.channel_match:
+            targets += [rule['target'] for rule in self.channel_match if rule['target'] not in targets]
+        return targets
+    async def prepare_shards(self):
+        '''
+        把监控频道分配给各账号，各账号并发解析自己分到的频道中未缓存的实体，跳过无法访问的监控频道
+        '''
+        shards = self.shard_monitors(self.monitor_limits())
+        results = await asyncio.gather(self.resolve_peers(self.target_chats()),
+                                       *(self.resolve_peers([chat_name for chat_name, limit in monitors], account)
+                                         for account, monitors in shards))
+        for (account, monitors), failed in zip(shards, results[1:]):
+            monitors[:] = [(chat_name, limit) for chat_name, limit in monitors if chat_name not in failed]
+        if len(shards) > 1:
+            for i, (account, monitors) in enumerate(shards):
+                print(f"账号{i + 1} 负责监控 {len(monitors)} 个频道")
+        return shards
+    async def start_accounts(self):
+        # 主账号由 run() 启动，其余账号在这里连接
+        await asyncio.gather(*(account.client.start() for account in self.accounts[1:]))
+    async def stop_accounts(self):
+        await asyncio.gather(*(account.client.disconnect() for account in self.accounts))
+    async def main(self):
+        start_time = time.time()
+        await self.start_accounts()
+        self.start_outbox()
+        # 读取历史后再分配，分配依据历史记录中的各频道消息量
+        await self.checkhistory()
+        shards = await self.prepare_shards()
+        await self.resend_failed(shards)
+        await self.scan_channels(shards)
+        # 转发全部发出后再统计今日更新
+        await self.flush_outbox()
+        await self.send_daily_forwarded_count()
+        self.save_history()
         # 调用函数，删除重复链接的旧消息
         await self.deduplicate_links()
-        await self.client.disconnect()
+        await self.close_outbox()
+        self.store.close()
+        await self.stop_accounts()
+        self.save_metrics()
         end_time = time.time()
         print(f'耗时: {end_time - start_time} 秒')
+    async def ensure_joined(self, chat_name, peer, account):
+        '''
+        Telegram 只推送已加入频道的新消息事件，未加入的频道开启 try_join 时加入，否则提示只能依靠定期补扫
+        '''
+        try:
+            entity = await self.call('read', account.client.get_entity, peer)
+            if not getattr(entity, 'left', False):
+                return
+            if try_join:
+                await self.call('send', account.client, JoinChannelRequest(peer))
+                print(f"已加入监控频道【{chat_name}】")
+            else:
+                print(f"警告: 未加入监控频道【{chat_name}】，收不到实时消息，只能每 {CATCHUP_INTERVAL} 秒补扫一次，可开启 try_join 自动加入")
+        except Exception as e:
+            print(f"检查【{chat_name}】是否已加入失败: {e}")
+    async def watch(self):
+        '''
+        实时模式：订阅监控频道的新消息和编辑事件即时转发，定期按检查点补扫断线期间遗漏的消息
+        实时事件不推进检查点，遗漏或已转发的消息都由补扫兜底，重复的由去重库过滤
+        '''
+        await self.start_accounts()
+        self.start_outbox()
+        await self.checkhistory()
+        shards = await self.prepare_shards()
+        chats = {}
+        account_chats = []
+        for account, monitors in shards:
+            peer_ids = []
+            for chat_name, limit in monitors:
+                peer = await self.input_peer(chat_name, account=account)
+                await self.ensure_joined(chat_name, peer, account)
+                peer_ids.append(utils.get_peer_id(peer))
+            chats.update(zip(peer_ids, (chat_name for chat_name, limit in monitors)))
+            account_chats.append((account, peer_ids))
+
+        async def on_message(event):
+            chat_name = chats.get(event.chat_id)
+            try:
+                self.counters[chat_name] += await self.process_message(chat_name, event.message)
+                self.store.commit()
+            except Exception as e:
+                print(f"处理【{chat_name}】实时消息失败: {e}")
+
+        # 每个账号只订阅分配给自己的频道，同一频道不会被多个账号重复处理
+        handlers = []
+        for account, peer_ids in account_chats:
+            if not peer_ids:
+                continue
+            for event in (events.NewMessage(chats=peer_ids), events.MessageEdited(chats=peer_ids)):
+                account.client.add_event_handler(on_message, event)
+                handlers.append((account.client, event))
+        print(f"实时监控 {len(chats)} 个频道")
+        last_maintenance = 0
+        try:
+            while True:
+                self.today = (datetime.utcnow() + self.china_timezone_offset).date()
+                await self.resend_failed(shards)
+                await self.scan_channels(shards)
+                if time.time() - last_maintenance >= MAINTENANCE_INTERVAL:
+                    await self.flush_outbox()
+                    await self.send_daily_forwarded_count()
+                    self.save_history()
+                    await self.deduplicate_links()
+                    self.save_metrics()
+                    last_maintenance = time.time()
+                await asyncio.sleep(CATCHUP_INTERVAL)
+        finally:
+            for client, event in handlers:
+                client.remove_event_handler(on_message, event)
+            await self.close_outbox()
+            self.save_history()
+            self.store.close()
+            await self.stop_accounts()
+            self.save_metrics()
     def run(self):
         with self.client.start():
             self.client.loop.run_until_complete(self.main())
+    def run_realtime(self):
+        with self.client.start():
+            self.client.loop.run_until_complete(self.watch())
 
 
 if __name__ == '__main__':
@@ -651,6 +1868,8 @@ if __name__ == '__main__':
     # 是否下载图片发送消息
     api_id = 6627460
     api_hash = '27a53a0965e486a2bc1b1fcde473b1c4'
+    # 可配置多个账号 ['xxx', 'yyy']，监控频道按消息量分配给各账号并行扫描，第一个账号负责发送和统计
+    # 其他账号转发带媒体的消息时由该账号发送，需要在目标频道有发消息权限
     string_session = 'xxx'
     # 默认不开启代理
     proxy = None
@@ -660,5 +1879,11 @@ if __name__ == '__main__':
     past_years = False
     # 只允许转发当日的
     only_today = True
-    TGForwarder(api_id, api_hash, string_session, channels_groups_monitor, forward_to_channel, limit, replies_limit,
-                include,exclude, check_replies, proxy, checknum, replacements,message_md,channel_match, hyperlink_text, past_years, only_today).run()
+    # 实时模式：常驻运行，监控频道有新消息立即转发，否则运行一次后退出
+    realtime = False
+    forwarder = TGForwarder(api_id, api_hash, string_session, channels_groups_monitor, forward_to_channel, limit, replies_limit,
+                include,exclude, check_replies, proxy, checknum, replacements,message_md,channel_match, hyperlink_text, past_years, only_today)
+    if realtime:
+        forwarder.run_realtime()
+    else:
+        forwarder.run()
@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+# !/usr/bin/env python3
+'''
+TGForwarder 离线性能基准测试，不连接 Telegram
+使用 TGForwarder.py 中的默认配置(include/exclude/replacements 等)，对消息语料逐条计时:
+keyword_filter 关键词过滤(include/exclude/urls_kw)
+replace_targets 替换规则(replacements)
+extract_links 提取资源链接并按网盘分类(categorize_urls)
+语料可用 --corpus 指定录制的消息(jsonl，每行一个含 message 字段的对象)，默认生成合成语料
+结果写入json，可用 --compare 与其他版本的结果对比
+
+用法:
+python TGForwarder_bench.py --sizes 10000,100000 --output tg_bench_new.json --compare tg_bench_old.json
+python TGForwarder_bench.py --corpus messages.jsonl
+'''
+import argparse
+import ast
+import re
+import urllib.parse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import TGForwarder
+from ClashForge_bench import timeit, summarize, git_revision, compare
+
+SIZES = [10000, 100000]
+TITLES = ["流浪地球", "繁花", "三体", "庆余年", "漫长的季节", "狂飙", "沙丘", "奥本海默", "周处除三害", "热辣滚烫"]
+HOSTS = ["pan.quark.cn/s/", "drive.uc.cn/s/", "www.alipan.com/s/", "pan.baidu.com/s/", "115cdn.com/s/", "cloud.189.cn/t/"]
+TAGS = ["#电影", "#剧集", "#科幻", "#动作", "#悬疑", "#4K", "#国产剧", "#美剧"]
+SOURCES = ["yunpanall", "NewAliPan", "Quark_Movies", "hao115", "🦜投稿", "树洞频道", "via 匿名", "🎁 详情及下载"]
+# 重发已有资源的比例，其中 SAME_LINK_RATE 沿用原链接(完全重复)，其余换了链接(只有标题相近)
+REPOST_RATE = 0.1
+SAME_LINK_RATE = 0.5
+
+
+# 读取 TGForwarder.py 中 __main__ 块里的默认配置
+def load_defaults():
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'TGForwarder.py')
+    with open(path, 'r', encoding='utf-8') as f:
+        tree = ast.parse(f.read())
+    namespace = {}
+    for node in tree.body:
+        if isinstance(node, ast.If) and 'name' in ast.dump(node.test):
+            for stmt in node.body:
+                # 只取配置项，跳过构造和运行 TGForwarder 的语句
+                if isinstance(stmt, ast.Assign) and not isinstance(stmt.value, ast.Call):
+                    exec(compile(ast.Module(body=[stmt], type_ignores=[]), path, 'exec'), namespace)
+    return namespace
+
+
+# 资源的原始链接，由资源编号确定，重发时可以沿用
+def resource_link(part):
+    rnd = random.Random(part)
+    return f"https://{rnd.choice(HOSTS)}{rnd.getrandbits(48):012x}"
+
+
+# 生成单条频道消息文本
+# 每条消息是不同的资源(第几部)，按 REPOST_RATE 重发更早的资源；年份取默认配置不排除的近三年，避免语料大多被年份关键词过滤
+def make_message(rnd, i):
+    part = rnd.randrange(i) if i and rnd.random() < REPOST_RATE else i
+    title = f"{TITLES[part % len(TITLES)]} 第{part + 1}部"
+    year = time.localtime().tm_year - part % 3
+    if part == i or rnd.random() < SAME_LINK_RATE:
+        link = resource_link(part)
+    else:
+        link = f"https://{rnd.choice(HOSTS)}{rnd.getrandbits(48):012x}"
+    lines = [f"名称：{title} ({year}) 4K 高码率", "",
+             f"描述：{title}，讲述了一个关于勇气和友情的故事。" * rnd.randint(1, 4), "",
+             f"链接：{link}", "", f"📁 大小：{rnd.randint(1, 80)}G",
+             f"🏷 标签：{' '.join(rnd.sample(TAGS, 3))}", f"🎉 来自：{rnd.choice(SOURCES)}", f"#{i}"]
+    if rnd.random() < 0.2:
+        lines.insert(1, rnd.choice(["电子书 mobi epub", "课程 零基础入门", "短剧 全集", "app 破解版"]))
+    return "\n".join(lines)
+
+
+def make_corpus(n, seed=0):
+    rnd = random.Random(seed)
+    return [make_message(rnd, i) for i in range(n)]
+
+
+def load_corpus(path):
+    messages = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                messages.append(json.loads(line).get('message') or '')
+    return messages
+
+
+# 按 __main__ 中的默认配置构造 TGForwarder，不连接 Telegram
+def make_forwarder(defaults):
+    d = defaults
+    return TGForwarder.TGForwarder(d['api_id'], d['api_hash'], '', d['channels_groups_monitor'], d['forward_to_channel'],
+                                   d['limit'], d['replies_limit'], d['include'], d['exclude'], d['check_replies'], None,
+                                   d['checknum'], d['replacements'], d['message_md'], d['channel_match'], d['hyperlink_text'],
+                                   d['past_years'], d['only_today'])
+
+
+# 逐个关键词子串查找的过滤方式，作为对比基线
+def keyword_filter_baseline(forwarder, messages):
+    for text in messages:
+        (any(k in text for k in forwarder.include), not any(k in text for k in forwarder.exclude),
+         any(k in text for k in forwarder.urls_kw))
+
+
+def keyword_filter(forwarder, messages):
+    # 绕过 lru_cache，统计真实扫描开销
+    match = forwarder.keywords._match
+    for text in messages:
+        hits = match(text)
+        ('include' in hits, 'exclude' not in hits, 'urls' in hits)
+
+
+# 按规则逐词 str.replace 的替换方式，作为对比基线
+def replace_targets_baseline(forwarder, messages):
+    for text in messages:
+        for target_word, source_words in forwarder.replacements.items():
+            if isinstance(source_words, str):
+                source_words = [source_words]
+            for word in source_words:
+                text = text.replace(word, target_word)
+        text.strip()
+
+
+def replace_targets(forwarder, messages):
+    for text in messages:
+        forwarder.replace_targets(text)
+
+
+# 每次调用重新构建分类表、逐个域名子串查找的分类方式，作为对比基线
+CATEGORIES_BASELINE = {"magnet": ["magnet"], "uc": ["drive.uc.cn"], "mobile": ["caiyun.139.com"], "tianyi": ["cloud.189.cn"],
+                       "quark": ["pan.quark.cn"], "115": ["115cdn.com", "115.com", "anxia.com"], "aliyun": ["alipan.com", "aliyundrive.com"],
+                       "pikpak": ["mypikpak.com"], "baidu": ["pan.baidu.com"], "others": []}
+
+
+def extract_links_baseline(forwarder, messages):
+    pattern = forwarder.pattern.pattern
+    for text in messages:
+        urls = re.findall(pattern, text)
+        categories = dict(CATEGORIES_BASELINE)
+        result = {category: [] for category in categories}
+        for url in urls:
+            if url.startswith("magnet:"):
+                result["magnet"].append(url)
+                continue
+            domain = urllib.parse.urlparse(url).netloc.lower()
+            for category, domains in categories.items():
+                if any(p in domain for p in domains):
+                    result[category].append(url)
+                    break
+            else:
+                result["others"].append(url)
+
+
+def extract_links(forwarder, messages):
+    # 清空分类缓存，统计真实解析开销
+    TGForwarder.url_category.cache_clear()
+    findall = forwarder.pattern.findall
+    for text in messages:
+        forwarder.categorize_urls(findall(text))
+
+
+# 标题近似重复的样例：(标题1, 标题2, 是否视为同一资源)
+TITLE_CASES = [
+    ("流浪地球", "流浪地求", True),
+    ("漫长的季节", "漫长得季节", True),
+    ("周处除三害 4K", "周处除三害 导演剪辑版", True),
+    ("奥本海默 Oppenheimer", "奥本海默", True),
+    ("庆余年 第二季", "庆余年第2季 全36集", True),
+    ("封神第一部", "封神第二部", False),
+    ("漫长的季节", "漫长的告白", False),
+    ("三体", "三傻", False),
+    ("沙丘 (2021)", "沙丘 (2024)", False),
+]
+
+
+# 检查标题近似重复的判定，改动标题规范化或匹配规则后先确认样例结果不变
+def check_titles():
+    for first, second, expected in TITLE_CASES:
+        index = TGForwarder.TitleIndex()
+        index.add(TGForwarder.title_key(f"名称：{first}"))
+        found = index.find(TGForwarder.title_key(f"名称：{second}")) is not None
+        assert found == expected, f"标题近似重复判定错误: {first} / {second} 应为 {expected}"
+    print(f"标题近似重复检查通过: {len(TITLE_CASES)} 组")
+
+
+# 运行指定语料的全部基准
+def run_corpus(forwarder, messages, repeat):
+    results = []
+    size = len(messages)
+    print(f"\n===================语料规模: {size}======================")
+
+    def record(name, func):
+        r = summarize(name, size, timeit(func, repeat))
+        results.append(r)
+        print(f"{name:<28} min {r['min']:.3f}s  median {r['median']:.3f}s  {r['ops_per_sec']:.0f} msgs/s")
+
+    record("keyword_filter_baseline", lambda: keyword_filter_baseline(forwarder, messages))
+    record("keyword_filter", lambda: keyword_filter(forwarder, messages))
+    record("replace_targets_baseline", lambda: replace_targets_baseline(forwarder, messages))
+    record("replace_targets", lambda: replace_targets(forwarder, messages))
+    record("extract_links_baseline", lambda: extract_links_baseline(forwarder, messages))
+    record("extract_links", lambda: extract_links(forwarder, messages))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='TGForwarder 离线性能基准测试')
+    parser.add_argument('--sizes', default=','.join(map(str, SIZES)), help='合成语料规模，逗号分隔')
+    parser.add_argument('--corpus', default='', help='录制的消息语料(jsonl)，指定后忽略 --sizes')
+    parser.add_argument('--repeat', type=int, default=3, help='每项重复次数，取最小值')
+    parser.add_argument('--output', default='tg_bench_results.json', help='结果输出文件')
+    parser.add_argument('--compare', default='', help='对比的基线结果文件')
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output)
+    baseline = os.path.abspath(args.compare) if args.compare else ''
+    check_titles()
+    corpora = [load_corpus(args.corpus)] if args.corpus else [make_corpus(int(x)) for x in args.sizes.split(',') if x]
+    results = []
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        # TGForwarder 在当前目录创建去重库，切换到临时目录避免污染
+        os.chdir(workdir)
+        try:
+            forwarder = make_forwarder(load_defaults())
+            for messages in corpora:
+                results.extend(run_corpus(forwarder, messages, args.repeat))
+            forwarder.store.close()
+        finally:
+            os.chdir(cwd)
+
+    report = {
+        "revision": git_revision(),
+        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "corpus": args.corpus or "synthetic",
+        "results": results,
+    }
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n基准结果已保存到: {output}")
+    if baseline:
+        compare(results, baseline)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,416 @@
+# -*- coding: utf-8 -*-
+# !/usr/bin/env python3
+'''
+TGForwarder 录制回放工具，离线测试/压测 forward_messages 的过滤、去重、分发流程
+record  用真实账号把监控频道的消息(文本、超链接、媒体元数据、评论)导出为 jsonl 语料
+replay  用模拟客户端加载语料运行 TGForwarder，不连接 Telegram，统计吞吐和转发结果
+
+模拟客户端实现了 TGForwarder 用到的 Telethon 接口:
+get_input_entity / iter_messages / get_messages / send_message / delete_messages / edit_message / pin_message /
+conversation(机器人跳转链接) / GetRepliesRequest / GetHistoryRequest / JoinChannelRequest
+发送的消息写入目标频道，后续的去重、统计、删除重复消息都基于回放过程中的目标频道状态
+
+语料格式(每行一条消息):
+{"chat": "频道", "id": 1, "date": "2025-01-01T00:00:00+00:00", "message": "文本",
+ "entities": [{"offset": 0, "length": 4, "url": "https://..."}],
+ "media": {"type": "photo"} 或 {"type": "document", "id": 1, "size": 1, "mime_type": "video/mp4", "duration": 60},
+ "replies": [与消息相同的结构，不含 chat]}
+
+用法:
+python TGForwarder_replay.py record --channels yunpanall,NewAliPan --limit 1000 --replies 3 --output fixture.jsonl
+python TGForwarder_replay.py replay --fixture fixture.jsonl --scale 100000 --output tg_replay.json
+python TGForwarder_replay.py replay --synthetic 100000 --latency 50 --compare tg_replay_old.json
+'''
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import TGForwarder
+import TGForwarder_bench as bench
+from telethon import TelegramClient
+from telethon._updates import EntityCache
+from telethon.sessions import StringSession
+from telethon.tl.functions.channels import JoinChannelRequest
+from telethon.tl.functions.messages import GetHistoryRequest, GetRepliesRequest
+from telethon.tl.types import (Message, PeerChannel, InputPeerChannel, MessageEntityTextUrl, MessageMediaPhoto,
+                               MessageMediaDocument, Document, DocumentAttributeVideo)
+from telethon.tl.types.messages import ChannelMessages
+
+# 回放时的目标频道 ID 从这里开始分配，避免与语料中的频道冲突
+TARGET_ID_BASE = 10 ** 9
+
+
+# 消息对象 -> 语料记录
+def dump_message(message):
+    record = {
+        "id": message.id,
+        "date": message.date.isoformat() if message.date else None,
+        "message": message.message or "",
+        "entities": [{"offset": e.offset, "length": e.length, "url": e.url}
+                     for e in message.entities or [] if isinstance(e, MessageEntityTextUrl)],
+    }
+    if isinstance(message.media, MessageMediaPhoto):
+        record["media"] = {"type": "photo"}
+    elif message.document:
+        document = message.document
+        duration = next((a.duration for a in document.attributes or [] if isinstance(a, DocumentAttributeVideo)), 0)
+        record["media"] = {"type": "document", "id": document.id, "size": document.size,
+                           "mime_type": document.mime_type, "duration": duration}
+    return record
+
+
+# 语料记录 -> Telethon 消息对象
+def load_message(record, channel_id):
+    media = None
+    spec = record.get("media")
+    if spec and spec["type"] == "photo":
+        media = MessageMediaPhoto()
+    elif spec and spec["type"] == "document":
+        attributes = [DocumentAttributeVideo(duration=spec.get("duration") or 0, w=0, h=0)] if spec.get("duration") else []
+        media = MessageMediaDocument(document=Document(
+            id=spec["id"], access_hash=0, file_reference=b'', date=None, mime_type=spec.get("mime_type") or "",
+            size=spec.get("size") or 0, dc_id=0, attributes=attributes))
+    entities = [MessageEntityTextUrl(offset=e["offset"], length=e["length"], url=e["url"]) for e in record.get("entities") or []]
+    date = datetime.fromisoformat(record["date"]) if record.get("date") else datetime.now(timezone.utc)
+    return Message(id=record["id"], peer_id=PeerChannel(channel_id), date=date, message=record.get("message") or "",
+                   media=media, entities=entities or None)
+
+
+def load_fixture(path):
+    records = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                records.append(json.loads(line))
+    return records
+
+
+# 用 bench 的合成语料生成回放记录，按频道轮流分配
+def synthetic_fixture(n, channels=8):
+    return [{"chat": f"channel{i % channels}", "id": i // channels + 1, "message": text}
+            for i, text in enumerate(bench.make_corpus(n))]
+
+
+def scale_fixture(records, n, unique_links):
+    '''
+    循环复制语料到 n 条，每轮重新编号；unique_links 时给链接、超链接加上轮次后缀并改写视频指纹，避免复制出的消息全部被判为重复
+    '''
+    if not records or len(records) >= n:
+        return records[:n] if records else records
+    scaled = []
+    next_id = defaultdict(int)
+    round_no = 0
+    while len(scaled) < n:
+        for record in records:
+            if len(scaled) >= n:
+                break
+            record = dict(record)
+            next_id[record["chat"]] += 1
+            record["id"] = next_id[record["chat"]]
+            if unique_links and round_no:
+                suffix = f"r{round_no}"
+                record["message"] = TGForwarder.LINK_PATTERN.sub(lambda m: m.group(0) + suffix, record.get("message") or "")
+                record["entities"] = [{**e, "url": e["url"] + suffix} for e in record.get("entities") or []]
+                if (record.get("media") or {}).get("type") == "document":
+                    media = record["media"]
+                    record["media"] = {**media, "id": media["id"] + round_no * 10 ** 12, "size": (media.get("size") or 0) + round_no}
+            scaled.append(record)
+        round_no += 1
+    return scaled
+
+
+class FakeConversation:
+    """
+    模拟机器人会话，收到 /start 参数后回复一条带链接的消息
+    """
+    def __init__(self, client, bot):
+        self.client = client
+        self.bot = bot
+        self.parameter = ''
+    async def __aenter__(self):
+        return self
+    async def __aexit__(self, *exc):
+        return False
+    async def send_message(self, text):
+        await self.client.delay()
+        self.parameter = text.split(' ', 1)[-1]
+    async def get_response(self):
+        await self.client.delay()
+        return Message(id=0, peer_id=PeerChannel(0), date=None, message=f"https://pan.quark.cn/s/{self.bot}{self.parameter}")
+
+
+class FakeClient:
+    """
+    模拟 Telethon 客户端，消息保存在内存中，latency 为每次请求的模拟延迟(秒)
+    """
+    def __init__(self, records, latency=0.0):
+        self.latency = latency
+        self.ids = {}
+        self.chats = defaultdict(dict)
+        self.replies = {}
+        self.requests = defaultdict(int)
+        self.sent = 0
+        self.deleted = 0
+        # Message._finish_init 需要的客户端属性
+        self._self_id = 0
+        self._mb_entity_cache = EntityCache()
+        for record in records:
+            channel_id = self.channel_id(record["chat"])
+            message = self.finish(load_message(record, channel_id))
+            self.chats[channel_id][message.id] = message
+            if record.get("replies"):
+                self.replies[(channel_id, message.id)] = [load_message(r, channel_id) for r in record["replies"]]
+    def finish(self, message):
+        message._finish_init(self, {}, None)
+        return message
+    def channel_id(self, name):
+        key = str(name).lstrip('@').lower()
+        if key not in self.ids:
+            self.ids[key] = len(self.ids) + 1
+        return self.ids[key]
+    def target_id(self, name):
+        # 未出现在语料中的频道视为转发目标频道
+        key = str(name).lstrip('@').lower()
+        if key not in self.ids:
+            self.ids[key] = TARGET_ID_BASE + len(self.ids)
+        return self.ids[key]
+    def resolve(self, entity):
+        if isinstance(entity, InputPeerChannel):
+            return entity.channel_id
+        return self.target_id(entity)
+    async def delay(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+    async def get_input_entity(self, name):
+        self.requests['get_input_entity'] += 1
+        await self.delay()
+        return InputPeerChannel(self.target_id(name), 0)
+    def select(self, entity, min_id=0, offset_date=None, reverse=False):
+        messages = sorted(self.chats[self.resolve(entity)].values(), key=lambda m: m.id, reverse=not reverse)
+        if min_id:
+            messages = [m for m in messages if m.id > min_id]
+        if offset_date:
+            messages = [m for m in messages if m.date < offset_date]
+        return messages
+    async def iter_messages(self, entity, limit=None, min_id=0, offset_date=None, reverse=False, **kwargs):
+        messages = self.select(entity, min_id, offset_date, reverse)[:limit]
+        for i, message in enumerate(messages):
+            if i % 100 == 0:
+                self.requests['iter_messages'] += 1
+                await self.delay()
+            yield message
+    async def get_messages(self, entity, limit=None, min_id=0, offset_id=0, offset_date=None, reverse=False, ids=None, **kwargs):
+        self.requests['get_messages'] += 1
+        await self.delay()
+        if ids is not None:
+            chat = self.chats[self.resolve(entity)]
+            return [chat.get(i) for i in ids] if isinstance(ids, (list, tuple)) else chat.get(ids)
+        messages = self.select(entity, min_id, offset_date, reverse)
+        if offset_id:
+            # 与 Telethon 一样不含 offset_id 本身，倒序时取更早的，正序时取更新的
+            messages = [m for m in messages if (m.id > offset_id if reverse else m.id < offset_id)]
+        return messages[:limit]
+    async def send_message(self, entity, text, file=None, parse_mode=None, **kwargs):
+        self.requests['send_message'] += 1
+        await self.delay()
+        channel_id = self.resolve(entity)
+        chat = self.chats[channel_id]
+        message = Message(id=max(chat, default=0) + 1, peer_id=PeerChannel(channel_id), date=datetime.now(timezone.utc),
+                          message=text, media=file if isinstance(file, (MessageMediaPhoto, MessageMediaDocument)) else None)
+        chat[message.id] = self.finish(message)
+        self.sent += 1
+        return message
+    async def edit_message(self, entity, message_id, text, **kwargs):
+        self.requests['edit_message'] += 1
+        await self.delay()
+        message = self.chats[self.resolve(entity)].get(message_id)
+        if message:
+            message.message = text
+        return message
+    async def pin_message(self, entity, message_id, **kwargs):
+        self.requests['pin_message'] += 1
+        await self.delay()
+    async def delete_messages(self, entity, message_ids, **kwargs):
+        self.requests['delete_messages'] += 1
+        await self.delay()
+        chat = self.chats[self.resolve(entity)]
+        for message_id in message_ids:
+            if chat.pop(message_id, None) is not None:
+                self.deleted += 1
+    def conversation(self, bot, timeout=None):
+        self.requests['conversation'] += 1
+        return FakeConversation(self, bot)
+    async def __call__(self, request):
+        self.requests[type(request).__name__] += 1
+        await self.delay()
+        if isinstance(request, GetRepliesRequest):
+            replies = self.replies.get((self.resolve(request.peer), request.msg_id), [])
+            replies = [self.finish(r) for r in sorted(replies, key=lambda m: -m.id) if r.id > request.min_id and (not request.max_id or r.id < request.max_id)][:request.limit]
+            return ChannelMessages(pts=0, count=len(replies), messages=replies, topics=[], chats=[], users=[])
+        if isinstance(request, GetHistoryRequest):
+            # 今日消息数：offset_date 之后的消息条数
+            chat = self.chats[self.resolve(request.peer)].values()
+            count = sum(1 for m in chat if m.date and m.date >= request.offset_date)
+            return ChannelMessages(pts=0, count=len(chat), messages=[], topics=[], chats=[], users=[], offset_id_offset=count)
+        if isinstance(request, JoinChannelRequest):
+            return None
+        raise NotImplementedError(type(request).__name__)
+
+
+async def record(args):
+    '''
+    用真实账号导出监控频道的消息，默认使用 TGForwarder.py 中的账号配置
+    '''
+    defaults = bench.load_defaults()
+    session = args.session or defaults['string_session']
+    client = TelegramClient(StringSession(session), defaults['api_id'], defaults['api_hash'])
+    await client.start()
+    channels = [c.split('|')[0] for c in args.channels.split(',')] if args.channels else \
+        [c.split('|')[0] for c in defaults['channels_groups_monitor']]
+    total = 0
+    with open(args.output, 'w', encoding='utf-8') as f:
+        for chat_name in channels:
+            try:
+                chat = await client.get_input_entity(chat_name)
+                async for message in client.iter_messages(chat, limit=args.limit):
+                    item = {"chat": chat_name, **dump_message(message)}
+                    if args.replies and message.replies and message.replies.replies:
+                        replies = await client.get_messages(chat, reply_to=message.id, limit=args.replies)
+                        item["replies"] = [dump_message(r) for r in replies]
+                    f.write(json.dumps(item, ensure_ascii=False) + "\n")
+                    total += 1
+                print(f"已录制【{chat_name}】")
+            except Exception as e:
+                print(f"录制【{chat_name}】失败: {e}")
+    await client.disconnect()
+    print(f"共录制 {total} 条消息: {args.output}")
+
+
+async def replay_once(records, latency, only_today):
+    '''
+    构造 TGForwarder 并替换为模拟客户端，按语料中的频道扫描一遍，返回耗时和统计
+    '''
+    forwarder = bench.make_forwarder(bench.load_defaults())
+    forwarder.only_today = only_today
+    client = FakeClient(records, latency)
+    account = forwarder.accounts[0]
+    account.client = forwarder.client = client
+    # 回放只测处理本身，不限速
+    for kind in account.limiters:
+        account.limiters[kind] = TGForwarder.RateLimiter(float('inf'), float('inf'))
+    # 监控列表改为语料中的频道，每个频道扫描全部消息
+    counts = defaultdict(int)
+    for item in records:
+        counts[item["chat"]] += 1
+    forwarder.channels_groups_monitor = [f'{chat_name}|{n}' for chat_name, n in counts.items()]
+    start = time.perf_counter()
+    forwarder.start_outbox()
+    await forwarder.checkhistory()
+    shards = await forwarder.prepare_shards()
+    await forwarder.scan_channels(shards)
+    await forwarder.flush_outbox()
+    await forwarder.deduplicate_links()
+    await forwarder.close_outbox()
+    elapsed = time.perf_counter() - start
+    report = forwarder.metrics.report()
+    forwarder.store.close()
+    filtered = defaultdict(int)
+    for channel in report['channels'].values():
+        for reason, n in channel['filtered'].items():
+            filtered[reason] += n
+    return elapsed, {
+        "scanned": sum(c['scanned'] for c in report['channels'].values()),
+        "forwarded": sum(forwarder.counters.values()),
+        "duplicates": sum(c['duplicates'] for c in report['channels'].values()),
+        "near_duplicates": sum(c['near_duplicates'] for c in report['channels'].values()),
+        "filtered": dict(filtered),
+        "sent": client.sent,
+        "deleted": client.deleted,
+        "requests": dict(client.requests),
+    }
+
+
+def replay(args):
+    if args.fixture:
+        records = load_fixture(args.fixture)
+    else:
+        records = synthetic_fixture(args.synthetic)
+    if args.scale:
+        records = scale_fixture(records, args.scale, not args.keep_links)
+    chats = set(item["chat"] for item in records)
+    TGForwarder.try_join = False
+    size = len(records)
+    print(f"===================回放 {size} 条消息，{len(chats)} 个频道======================")
+    output = os.path.abspath(args.output)
+    baseline = os.path.abspath(args.compare) if args.compare else ''
+    timings = []
+    stats = {}
+    cwd = os.getcwd()
+    for _ in range(args.repeat):
+        # 每轮使用新的临时目录，去重库、实体缓存从空开始
+        with tempfile.TemporaryDirectory() as workdir:
+            os.chdir(workdir)
+            try:
+                elapsed, stats = asyncio.run(replay_once(records, args.latency / 1000, args.only_today))
+            finally:
+                os.chdir(cwd)
+        timings.append(elapsed)
+        print(f"耗时 {elapsed:.3f}s  {size / elapsed:.0f} msgs/s  转发 {stats['forwarded']}  重复 {stats['duplicates']}  近似重复 {stats['near_duplicates']}  "
+              f"发送 {stats['sent']}  删除 {stats['deleted']}")
+    print(f"过滤: {stats['filtered']}")
+    print(f"请求: {stats['requests']}")
+    results = [bench.summarize("replay_forward", size, timings)]
+    report = {
+        "revision": bench.git_revision(),
+        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "corpus": args.fixture or "synthetic",
+        "latency_ms": args.latency,
+        "stats": stats,
+        "results": results,
+    }
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n回放结果已保存到: {output}")
+    if baseline:
+        bench.compare(results, baseline)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='TGForwarder 录制回放工具')
+    sub = parser.add_subparsers(dest='command', required=True)
+    rec = sub.add_parser('record', help='用真实账号录制频道消息')
+    rec.add_argument('--channels', default='', help='频道列表，逗号分隔，默认使用 TGForwarder.py 中的监控列表')
+    rec.add_argument('--limit', type=int, default=1000, help='每个频道录制的消息数')
+    rec.add_argument('--replies', type=int, default=0, help='每条消息录制的评论数')
+    rec.add_argument('--session', default='', help='StringSession，默认使用 TGForwarder.py 中的配置')
+    rec.add_argument('--output', default='tg_fixture.jsonl', help='语料输出文件')
+    rep = sub.add_parser('replay', help='用模拟客户端回放语料')
+    rep.add_argument('--fixture', default='', help='录制的语料(jsonl)，不指定时使用合成语料')
+    rep.add_argument('--synthetic', type=int, default=100000, help='合成语料条数')
+    rep.add_argument('--scale', type=int, default=0, help='循环复制语料到指定条数')
+    rep.add_argument('--keep-links', action='store_true', help='复制语料时保留原链接(复制出的消息会被判为重复)')
+    rep.add_argument('--latency', type=float, default=0, help='模拟每次请求的延迟(毫秒)')
+    rep.add_argument('--only-today', action='store_true', help='只转发当日消息(默认关闭，录制的消息大多不是当日的)')
+    rep.add_argument('--repeat', type=int, default=1, help='重复次数')
+    rep.add_argument('--output', default='tg_replay_results.json', help='结果输出文件')
+    rep.add_argument('--compare', default='', help='对比的基线结果文件')
+    args = parser.parse_args()
+    if args.command == 'record':
+        asyncio.run(record(args))
+    else:
+        replay(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+# !/usr/bin/env python3
+'''
+本地模拟 mihomo 控制器(External Controller)，用于离线压测 ClashAPI / proxy_clean
+只依赖标准库，实现了 ClashForge 用到的接口:
+GET  /version
+GET  /configs
+PUT  /configs                热重载配置 {"payload": ...}，与 mihomo 一样只接受工作目录下的 {"path": ...}
+GET  /proxies
+GET  /proxies/{name}
+GET  /proxies/{name}/delay?url=...&timeout=...
+PUT  /proxies/{name}          切换 select 策略组节点
+GET  /group/{name}/delay?url=...&timeout=...   策略组批量测速，--no-group-delay 模拟不支持该接口的旧内核
+GET  /stats                   (模拟器专用) 请求数、最大并发等统计
+
+延迟分布写法:
+fixed:100 / uniform:50:800 / normal:300:100 / lognormal:5.5:0.6
+
+用法:
+python mock_mihomo.py --config clash_config.yaml --port 9090 --delay uniform:50:800 --fail-rate 0.3 --latency 2
+python mock_mihomo.py --nodes 50000 --time-scale 0.01
+'''
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+import urllib.parse
+from http import HTTPStatus
+
+import yaml
+
+GROUP_TYPES = {"select": "Selector", "url-test": "URLTest", "fallback": "Fallback", "load-balance": "LoadBalance"}
+
+
+# 解析延迟分布描述，返回 rnd -> 毫秒 的采样函数
+def parse_delay_dist(spec):
+    kind, *args = spec.split(':')
+    args = [float(x) for x in args]
+    if kind == 'fixed':
+        return lambda rnd: args[0]
+    if kind == 'uniform':
+        return lambda rnd: rnd.uniform(args[0], args[1])
+    if kind == 'normal':
+        return lambda rnd: max(1.0, rnd.gauss(args[0], args[1]))
+    if kind == 'lognormal':
+        return lambda rnd: rnd.lognormvariate(args[0], args[1])
+    raise ValueError(f"不支持的延迟分布: {spec}")
+
+
+class MockMihomo:
+    """模拟 mihomo 控制器"""
+
+    def __init__(self, proxies, groups, delay='uniform:50:800', fail_rate=0.0, flaky_rate=0.0, latency=0.0,
+                 time_scale=1.0, secret='', seed=0, group_delay=True):
+        self.load(proxies, groups)
+        self.sample_delay = parse_delay_dist(delay)
+        self.fail_rate = fail_rate
+        self.flaky_rate = flaky_rate
+        self.latency = latency
+        self.time_scale = time_scale
+        self.secret = secret
+        self.seed = seed
+        self.group_delay = group_delay
+        self.rnd = random.Random(seed)
+        self.server = None
+        self.loop = None
+        self.thread = None
+        self.writers = set()  # 保持中的连接，停止时先关闭
+        self.stats = {"requests": 0, "group_delay_requests": 0, "delay_requests": 0, "delay_ok": 0, "delay_fail": 0, "in_flight": 0, "max_in_flight": 0, "started": time.time()}
+
+    def load(self, proxies, groups):
+        """加载(或热重载)节点和策略组"""
+        self.proxies = {p["name"]: p for p in proxies}
+        self.groups = {g["name"]: g for g in groups}
+        self.selected = {name: (g.get("proxies") or ["DIRECT"])[0] for name, g in self.groups.items()}
+
+    @classmethod
+    def from_config(cls, config_path, **kwargs):
+        """从 clash 配置文件加载节点和策略组"""
+        with open(config_path, 'r', encoding='utf-8') as f:
+            config = yaml.safe_load(f)
+        return cls(config.get("proxies", []), config.get("proxy-groups", []), **kwargs)
+
+    @classmethod
+    def synthetic(cls, count, **kwargs):
+        """生成 count 个合成节点，全部放入一个 url-test 策略组"""
+        proxies = [{"name": f"mock-{i}", "type": "ss"} for i in range(count)]
+        names = [p["name"] for p in proxies]
+        groups = [{"name": "节点选择", "type": "select", "proxies": ["自动选择", "DIRECT"]},
+                  {"name": "自动选择", "type": "url-test", "proxies": names}]
+        return cls(proxies, groups, **kwargs)
+
+    # 节点是否为失效节点，按名称哈希固定，保证多次测试结果一致
+    def _is_dead(self, name):
+        if not self.fail_rate:
+            return False
+        digest = hashlib.md5(f"{self.seed}:{name}".encode('utf-8')).digest()
+        return int.from_bytes(digest[:4], 'big') / 0xFFFFFFFF < self.fail_rate
+
+    async def _sleep_ms(self, ms):
+        if ms > 0 and self.time_scale > 0:
+            await asyncio.sleep(ms * self.time_scale / 1000)
+
+    def _proxy_info(self, name):
+        if name in self.groups:
+            group = self.groups[name]
+            return {"name": name, "type": GROUP_TYPES.get(group.get("type"), "Selector"), "all": group.get("proxies", []),
+                    "now": self.selected.get(name, ""), "history": [], "udp": True}
+        proxy = self.proxies[name]
+        return {"name": name, "type": str(proxy.get("type", "")).capitalize(), "history": [], "udp": True, "alive": not self._is_dead(name)}
+
+    # 模拟单个节点延迟测试，返回 (状态码, 响应体)
+    async def test_delay(self, name, timeout):
+        self.stats["delay_requests"] += 1
+        self.stats["in_flight"] += 1
+        self.stats["max_in_flight"] = max(self.stats["max_in_flight"], self.stats["in_flight"])
+        try:
+            delay = self.sample_delay(self.rnd)
+            if self._is_dead(name) or self.rnd.random() < self.flaky_rate or delay > timeout:
+                await self._sleep_ms(timeout)
+                self.stats["delay_fail"] += 1
+                return HTTPStatus.GATEWAY_TIMEOUT, {"message": "Timeout"}
+            await self._sleep_ms(delay)
+            self.stats["delay_ok"] += 1
+            return HTTPStatus.OK, {"delay": int(delay)}
+        finally:
+            self.stats["in_flight"] -= 1
+
+    # 模拟策略组测速：并发测试组内全部节点，只返回成功的节点，全部失败时返回 504
+    async def test_group_delay(self, group_name, timeout):
+        self.stats["group_delay_requests"] += 1
+        names = [name for name in self.groups[group_name].get("proxies", []) if name in self.proxies]
+        results = await asyncio.gather(*(self.test_delay(name, timeout) for name in names))
+        delays = {name: body["delay"] for name, (status, body) in zip(names, results) if status == HTTPStatus.OK}
+        if not delays:
+            return HTTPStatus.GATEWAY_TIMEOUT, {"message": "get delay: all proxies timeout"}
+        return HTTPStatus.OK, delays
+
+    async def dispatch(self, method, target, headers, body):
+        """路由请求，返回 (状态码, 响应体)"""
+        self.stats["requests"] += 1
+        await self._sleep_ms(self.latency)
+        if self.secret and headers.get("authorization") != f"Bearer {self.secret}":
+            return HTTPStatus.UNAUTHORIZED, {"message": "Unauthorized"}
+
+        url = urllib.parse.urlsplit(target)
+        path = url.path
+        query = urllib.parse.parse_qs(url.query)
+        if method == "GET" and path == "/version":
+            return HTTPStatus.OK, {"meta": True, "version": "mock-mihomo"}
+        if method == "GET" and path == "/configs":
+            return HTTPStatus.OK, {"port": 7890, "mode": "rule"}
+        if method == "PUT" and path == "/configs":
+            try:
+                request = json.loads(body or b'{}')
+                if request.get("payload"):
+                    config = yaml.safe_load(request["payload"])
+                else:
+                    # mihomo 拒绝 home 目录(SAFE_PATHS)以外的配置路径，这里以工作目录代替 home 目录
+                    config_path = os.path.abspath(request.get("path", ""))
+                    if os.path.commonpath([config_path, os.getcwd()]) != os.getcwd():
+                        return HTTPStatus.BAD_REQUEST, {"message": f"path is not subpath of home directory or SAFE_PATHS: {config_path}"}
+                    with open(config_path, 'r', encoding='utf-8') as f:
+                        config = yaml.safe_load(f)
+            except (OSError, ValueError, yaml.YAMLError) as e:
+                return HTTPStatus.BAD_REQUEST, {"message": str(e)}
+            self.load(config.get("proxies", []), config.get("proxy-groups", []))
+            return HTTPStatus.NO_CONTENT, None
+        if method == "GET" and path == "/stats":
+            return HTTPStatus.OK, dict(self.stats, uptime=time.time() - self.stats["started"])
+        if method == "GET" and path == "/proxies":
+            names = list(self.proxies) + list(self.groups)
+            return HTTPStatus.OK, {"proxies": {name: self._proxy_info(name) for name in names}}
+        if self.group_delay and method == "GET" and path.startswith("/group/") and path.endswith("/delay"):
+            name = urllib.parse.unquote(path[len("/group/"):-len("/delay")])
+            if name not in self.groups:
+                return HTTPStatus.NOT_FOUND, {"message": "resource not found"}
+            try:
+                timeout = int(query.get("timeout", ["5000"])[0])
+            except ValueError:
+                return HTTPStatus.BAD_REQUEST, {"message": "Body invalid"}
+            return await self.test_group_delay(name, timeout)
+        if path.startswith("/proxies/"):
+            rest = path[len("/proxies/"):]
+            if method == "GET" and rest.endswith("/delay"):
+                name = urllib.parse.unquote(rest[:-len("/delay")])
+                if name not in self.proxies:
+                    return HTTPStatus.NOT_FOUND, {"message": "resource not found"}
+                try:
+                    timeout = int(query.get("timeout", ["5000"])[0])
+                except ValueError:
+                    return HTTPStatus.BAD_REQUEST, {"message": "Body invalid"}
+                return await self.test_delay(name, timeout)
+            name = urllib.parse.unquote(rest)
+            if method == "GET":
+                if name in self.proxies or name in self.groups:
+                    return HTTPStatus.OK, self._proxy_info(name)
+                return HTTPStatus.NOT_FOUND, {"message": "resource not found"}
+            if method == "PUT":
+                group = self.groups.get(name)
+                if not group:
+                    return HTTPStatus.NOT_FOUND, {"message": "resource not found"}
+                if group.get("type") != "select":
+                    return HTTPStatus.BAD_REQUEST, {"message": "Must be a Selector"}
+                try:
+                    selected = json.loads(body or b'{}').get("name")
+                except ValueError:
+                    return HTTPStatus.BAD_REQUEST, {"message": "Body invalid"}
+                if selected not in group.get("proxies", []):
+                    return HTTPStatus.BAD_REQUEST, {"message": "Selector update error: proxy not exist"}
+                self.selected[name] = selected
+                return HTTPStatus.NO_CONTENT, None
+        return HTTPStatus.NOT_FOUND, {"message": "resource not found"}
+
+    async def handle(self, reader, writer):
+        """处理单个连接，支持 HTTP/1.1 keep-alive"""
+        self.writers.add(writer)
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    key, _, value = line.decode('latin-1').partition(':')
+                    headers[key.strip().lower()] = value.strip()
+                length = int(headers.get("content-length", 0))
+                body = await reader.readexactly(length) if length else b''
+
+                status, payload = await self.dispatch(method, target, headers, body)
+                data = json.dumps(payload, ensure_ascii=False).encode('utf-8') if payload is not None else b''
+                close = headers.get("connection", "").lower() == "close"
+                head = [f"HTTP/1.1 {status.value} {status.phrase}", f"Content-Length: {len(data)}",
+                        "Connection: close" if close else "Connection: keep-alive"]
+                if data:
+                    head.append("Content-Type: application/json")
+                writer.write(("\r\n".join(head) + "\r\n\r\n").encode('latin-1') + data)
+                await writer.drain()
+                if close:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        except asyncio.CancelledError:
+            # 停止时取消仍保持连接的处理协程，正常结束，避免打印回调异常
+            pass
+        finally:
+            self.writers.discard(writer)
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=9090):
+        self.loop = asyncio.get_running_loop()
+        self.server = await asyncio.start_server(self.handle, host, port, backlog=1024)
+        return self.server
+
+    def start_in_thread(self, host='127.0.0.1', port=9090):
+        """在后台线程中启动，供基准测试在同一进程内使用"""
+        ready = threading.Event()
+
+        def runner():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            loop.run_until_complete(self.serve(host, port))
+            ready.set()
+            loop.run_forever()
+            loop.close()
+
+        self.thread = threading.Thread(target=runner, daemon=True)
+        self.thread.start()
+        ready.wait()
+        return self.thread
+
+    async def _shutdown(self):
+        self.server.close()
+        # 先关闭保持中的连接，空闲的处理协程读到 EOF 后自行结束
+        for writer in list(self.writers):
+            writer.close()
+        tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.loop.stop()
+
+    def stop(self):
+        """停止后台线程中的控制器"""
+        if self.loop and self.server:
+            asyncio.run_coroutine_threadsafe(self._shutdown(), self.loop)
+            self.thread.join(timeout=5)
+
+def main():
+    parser = argparse.ArgumentParser(description='本地模拟 mihomo 控制器')
+    parser.add_argument('--config', default='', help='clash配置文件，加载其中的proxies和proxy-groups')
+    parser.add_argument('--nodes', type=int, default=1000, help='未指定--config时生成的合成节点数')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9090)
+    parser.add_argument('--secret', default='')
+    parser.add_argument('--delay', default='uniform:50:800', help='节点延迟分布(ms)')
+    parser.add_argument('--fail-rate', type=float, default=0.3, help='固定失效节点比例')
+    parser.add_argument('--flaky-rate', type=float, default=0.0, help='单次测试随机失败比例')
+    parser.add_argument('--latency', type=float, default=0.0, help='控制器处理每个请求的额外延迟(ms)')
+    parser.add_argument('--time-scale', type=float, default=1.0, help='所有等待时间的缩放系数，0表示不等待')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-group-delay', action='store_true', help='不提供 /group/{name}/delay，模拟旧内核')
+    args = parser.parse_args()
+
+    kwargs = dict(delay=args.delay, fail_rate=args.fail_rate, flaky_rate=args.flaky_rate, latency=args.latency,
+                  time_scale=args.time_scale, secret=args.secret, seed=args.seed,
+                  group_delay=not args.no_group_delay)
+    mock = MockMihomo.from_config(args.config, **kwargs) if args.config else MockMihomo.synthetic(args.nodes, **kwargs)
+    print(f"模拟 mihomo 控制器已启动: http://{args.host}:{args.port}，节点数: {len(mock.proxies)}")
+
+    async def run():
+        server = await mock.serve(args.host, args.port)
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        print(f"\n已停止，统计: {json.dumps(mock.stats, ensure_ascii=False)}")
+
+
+if __name__ == '__main__':
+    main()
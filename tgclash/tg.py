@@ -1,20 +1,20 @@
 import os
 import json
 import socks
-import random
 import time
 import re
 import asyncio
 import urllib.parse
 import logging
 from datetime import datetime, timezone, timedelta
-from telethon import TelegramClient, functions, events
+from telethon import TelegramClient, functions, events, errors
 from telethon.tl.types import MessageMediaPhoto, MessageEntityTextUrl
 from telethon.sessions import StringSession
-from telethon.tl.functions.messages import GetHistoryRequest, GetMessagesRequest, DeleteMessagesRequest
+from telethon.tl.functions.messages import GetHistoryRequest, GetMessagesRequest
 from telethon.tl.functions.channels import JoinChannelRequest
-from collections import deque
+from collections import deque, defaultdict
 from logging.handlers import TimedRotatingFileHandler
+from TGForwarder import RateLimiter, PeerCache, peers_path, RATE_LIMITS, FLOOD_RETRIES, PEER_ERRORS
 
 # 设置日志（按天轮换日志文件）
 log_handler = TimedRotatingFileHandler(
@@ -57,6 +57,9 @@ only_today = config['only_today']
 if "forward_to_channel" in replacements:
     replacements[forward_to_channel] = replacements.pop("forward_to_channel")
 
+# 同时扫描的频道数
+scan_concurrency = config.get('scan_concurrency', 4)
+
 # 设置代理
 proxy = None
 if proxy_config:
@@ -99,25 +102,95 @@ class TGForwarder:
         else:
             self.client = TelegramClient(StringSession(string_session), api_id, api_hash, proxy=proxy)
         self.channel_entities = {}  # 缓存频道实体
-        self.total = 0  # 初始化 total 为 0
+        self.peers = PeerCache(peers_path(string_session))  # 频道实体磁盘缓存，按账号区分，跨运行复用
+        self.counters = defaultdict(int)  # 各频道本次转发数
+        self.links = set()  # 已转发链接，所有频道共享
+        self.sizes = set()  # 已转发视频大小，所有频道共享
+        self.limiters = {kind: RateLimiter(rate, burst) for kind, (rate, burst) in RATE_LIMITS.items()}
+
+    def claim(self, seen, key):
+        """
+        检查并占用：未出现过则加入集合并返回 True
+        检查和写入之间没有 await，并发扫描的频道不会重复转发同一资源
+        """
+        if key in seen:
+            return False
+        seen.add(key)
+        return True
+
+    def release(self, seen, key):
+        """
+        发送失败时释放占用，其他频道中的同一资源仍可转发
+        """
+        seen.discard(key)
+
+    async def dispatch_claimed(self, seen, key, message, jumpLinks=[]):
+        """
+        分发已占用的资源，发送失败时释放占用后继续抛出
+        """
+        try:
+            await self.dispatch_channel(message, jumpLinks)
+        except Exception:
+            self.release(seen, key)
+            raise
 
     async def get_channel_entity(self, channel_name):
         """
-        获取频道实体并缓存
+        获取频道实体并缓存，优先使用磁盘缓存的 id/access_hash，未缓存时才向服务器解析
         """
         if channel_name not in self.channel_entities:
             try:
-                self.channel_entities[channel_name] = await self.client.get_entity(channel_name)
+                peer = self.peers.get(channel_name)
+                if peer is None:
+                    peer = await self.call('read', self.client.get_input_entity, channel_name)
+                    self.peers.set(channel_name, peer)
+                    self.peers.save()
+                self.channel_entities[channel_name] = peer
             except Exception as e:
                 logger.warning(f"频道 {channel_name} 不存在或无法访问: {e}")
                 return None
         return self.channel_entities[channel_name]
 
-    def random_wait(self, min_ms, max_ms):
-        min_sec = min_ms / 1000
-        max_sec = max_ms / 1000
-        wait_time = random.uniform(min_sec, max_sec)
-        time.sleep(wait_time)
+    def forget_channel_entity(self, channel_name, error):
+        """
+        缓存的频道实体已失效(频道被删/改名/无权限)时清除缓存，下次重新解析
+        """
+        if isinstance(error, PEER_ERRORS):
+            self.channel_entities.pop(channel_name, None)
+            if self.peers.invalidate(channel_name):
+                self.peers.save()
+
+    async def call(self, kind, func, *args, **kwargs):
+        """
+        按请求类型限速调用 Telegram 接口，触发 FloodWaitError 时暂停该类请求，等待结束后重试
+        """
+        limiter = self.limiters[kind]
+        for attempt in range(FLOOD_RETRIES + 1):
+            await limiter.acquire()
+            try:
+                return await func(*args, **kwargs)
+            except errors.FloodWaitError as e:
+                if attempt == FLOOD_RETRIES:
+                    raise
+                logger.warning(f"触发 FloodWaitError，{kind} 类请求暂停 {e.seconds} 秒")
+                limiter.pause(e.seconds)
+
+    async def iter_messages(self, chat, limit=None, **kwargs):
+        """
+        限速遍历消息：按页(每页 100 条)通过 call 调用 get_messages，每页请求前先取 read 令牌，FloodWaitError 时暂停后重试
+        翻页时用上一页最后一条消息的 ID 作为 offset_id(正序/倒序都不含该条)
+        """
+        count = 0
+        while limit is None or count < limit:
+            size = 100 if limit is None else min(100, limit - count)
+            page = await self.call('read', self.client.get_messages, chat, limit=size, **kwargs)
+            for message in page:
+                yield message
+            count += len(page)
+            if len(page) < size:
+                break
+            kwargs['offset_id'] = page[-1].id
+            kwargs.pop('offset_date', None)
 
     def contains(self, s, include):
         return any(k in s for k in include)
@@ -167,13 +240,13 @@ class TGForwarder:
         if self.nocontains(text, self.urls_kw):
             return
         if message.media and isinstance(message.media, MessageMediaPhoto):
-            await self.client.send_message(
+            await self.call('send', self.client.send_message,
                 target_chat_name,
                 self.replace_targets(text),
                 file=message.media
             )
         else:
-            await self.client.send_message(target_chat_name, self.replace_targets(text))
+            await self.call('send', self.client.send_message, target_chat_name, self.replace_targets(text))
 
     async def get_all_replies(self, chat_name, message):
         offset_id = 0
@@ -183,7 +256,7 @@ class TGForwarder:
             return []
         while True:
             try:
-                replies = await self.client(functions.messages.GetRepliesRequest(
+                replies = await self.call('read', self.client, functions.messages.GetRepliesRequest(
                     peer=peer,
                     msg_id=message.id,
                     offset_id=offset_id,
@@ -210,7 +283,7 @@ class TGForwarder:
         start_of_day_china = datetime.combine(now.date(), datetime.min.time())
         start_of_day_china = start_of_day_china.replace(tzinfo=china_tz)
         start_of_day_utc = start_of_day_china.astimezone(timezone.utc)
-        result = await self.client(GetHistoryRequest(
+        result = await self.call('read', self.client, GetHistoryRequest(
             peer=target_channel,
             limit=1,
             offset_date=start_of_day_utc,
@@ -232,32 +305,32 @@ class TGForwarder:
 
         forward_to_channel_message_id = chat_forward_count_msg_id.get(self.forward_to_channel)
         if forward_to_channel_message_id:
-            await self.client.delete_messages(self.forward_to_channel, [forward_to_channel_message_id])
+            await self.call('delete', self.client.delete_messages, self.forward_to_channel, [forward_to_channel_message_id])
 
         if self.channel_match:
             for rule in self.channel_match:
                 target_channel_msg_id = chat_forward_count_msg_id.get(rule['target'])
-                await self.client.delete_messages(rule['target'], [target_channel_msg_id])
+                await self.call('delete', self.client.delete_messages, rule['target'], [target_channel_msg_id])
 
     async def send_daily_forwarded_count(self):
         await self.del_channel_forward_count_msg()
 
         chat_forward_count_msg_id = {}
         msg, tc = await self.daily_forwarded_count(self.forward_to_channel)
-        sent_message = await self.client.send_message(self.forward_to_channel, msg, parse_mode='md')
+        sent_message = await self.call('send', self.client.send_message, self.forward_to_channel, msg, parse_mode='md')
         self.checkbox["today_count"] = tc
-        await self.client.pin_message(self.forward_to_channel, sent_message.id)
-        await self.client.delete_messages(self.forward_to_channel, [sent_message.id + 1])
+        await self.call('send', self.client.pin_message, self.forward_to_channel, sent_message.id)
+        await self.call('delete', self.client.delete_messages, self.forward_to_channel, [sent_message.id + 1])
 
         chat_forward_count_msg_id[self.forward_to_channel] = sent_message.id
         if self.channel_match:
             for rule in self.channel_match:
                 m, t = await self.daily_forwarded_count(rule['target'])
-                sm = await self.client.send_message(rule['target'], m)
+                sm = await self.call('send', self.client.send_message, rule['target'], m)
                 self.checkbox["today_count"] = self.checkbox["today_count"] + t
                 chat_forward_count_msg_id[rule['target']] = sm.id
-                await self.client.pin_message(rule['target'], sm.id)
-                await self.client.delete_messages(rule['target'], [sm.id + 1])
+                await self.call('send', self.client.pin_message, rule['target'], sm.id)
+                await self.call('delete', self.client.delete_messages, rule['target'], [sm.id + 1])
         self.checkbox["chat_forward_count_msg_id"] = chat_forward_count_msg_id
 
     async def redirect_url(self, message):
@@ -290,9 +363,9 @@ class TGForwarder:
                 link = bot_links.get(parameter)
                 return link
             else:
-                await self.client.send_message(bot_username, f'/{command} {parameter}')
+                await self.call('send', self.client.send_message, bot_username, f'/{command} {parameter}')
                 await asyncio.sleep(2)
-                messages = await self.client.get_messages(bot_username, limit=1)
+                messages = await self.call('read', self.client.get_messages, bot_username, limit=1)
                 message = messages[0].message
                 links = re.findall(r'(https?://[^\s]+)', message)
                 if links:
@@ -316,10 +389,16 @@ class TGForwarder:
         start_time = datetime.strptime(start_time_str, "%Y-%m-%d %H:%M").replace(tzinfo=china_timezone)
         end_time = datetime.strptime(end_time_str, "%Y-%m-%d %H:%M").replace(tzinfo=china_timezone)
         chat = await self.get_channel_entity(chat_name)
-        async for message in self.client.iter_messages(chat):
-            message_china_time = message.date.astimezone(china_timezone)
-            if start_time <= message_china_time <= end_time:
-                await message.delete()
+        message_ids = []
+        # 从结束时间直接跳到范围内(offset_date 取该时间之前的消息，加 1 秒包含结束时间)，早于开始时间即停止
+        async for message in self.iter_messages(chat, offset_date=end_time + timedelta(seconds=1)):
+            if message.date < start_time:
+                break
+            message_ids.append(message.id)
+        logger.info(f"【{chat_name}】删除 {len(message_ids)} 条消息")
+        for i in range(0, len(message_ids), 100):
+            batch = message_ids[i:i + 100]
+            await self.call('delete', self.client.delete_messages, chat, batch)
 
     async def clear_main(self, start_time, end_time):
         await self.delete_messages_in_time_range(self.forward_to_channel, start_time, end_time)
@@ -381,7 +460,7 @@ class TGForwarder:
 
                 links_exist = set()
                 messages_to_delete = []
-                async for message in self.client.iter_messages(chat, limit=1000):
+                async for message in self.iter_messages(chat, limit=1000):
                     if message.message:
                         links_in_message = re.findall(self.pattern, message.message)
                         if not links_in_message:
@@ -397,8 +476,9 @@ class TGForwarder:
                     logger.info(f"【{chat_name}】删除 {len(messages_to_delete)} 条历史重复消息")
                     for i in range(0, len(messages_to_delete), 100):
                         batch = messages_to_delete[i:i + 100]
-                        await self.client(DeleteMessagesRequest(chat, batch))
+                        await self.call('delete', self.client.delete_messages, chat, batch)
             except Exception as e:
+                self.forget_channel_entity(chat_name, e)
                 logger.error(f"删除重复消息时出错: {e}")
 
     async def checkhistory(self):
@@ -418,7 +498,7 @@ class TGForwarder:
                 self.today_count = self.checkbox.get('today_count') if self.checkbox.get('today_count') else self.checknum
         self.checknum = self.checknum if self.today_count < self.checknum else self.today_count
         chat = await self.get_channel_entity(self.forward_to_channel)
-        messages = self.client.iter_messages(chat, limit=self.checknum)
+        messages = self.iter_messages(chat, limit=self.checknum)
         async for message in messages:
             if hasattr(message.document, 'mime_type'):
                 sizes.append(message.document.size)
@@ -431,34 +511,38 @@ class TGForwarder:
         return links, sizes
 
     async def copy_and_send_message(self, source_chat, target_chat, message_id, text=''):
+        """
+        复制消息并发送，返回是否发送成功
+        """
         try:
-            message = await self.client.get_messages(source_chat, ids=message_id)
+            message = await self.call('read', self.client.get_messages, source_chat, ids=message_id)
             if not message:
                 logger.warning("未找到消息")
-                return
-            await self.client.send_message(
+                return False
+            await self.call('send', self.client.send_message,
                 target_chat,
                 text,
                 file=message.media
             )
+            return True
         except Exception as e:
             logger.error(f"操作失败: {e}")
+            return False
 
-    async def forward_messages(self, chat_name, limit, hlinks, hsizes):
-        links = hlinks
-        sizes = hsizes
+    async def forward_messages(self, chat_name, limit):
+        links = self.links
+        sizes = self.sizes
         logger.info(f'当前监控频道【{chat_name}】，本次检测最近【{len(links)}】条历史资源进行去重')
         try:
             if try_join:
-                await self.client(JoinChannelRequest(chat_name))
+                await self.call('send', self.client, JoinChannelRequest(chat_name))
             chat = await self.get_channel_entity(chat_name)
-            messages = self.client.iter_messages(chat, limit=limit, reverse=False)
+            messages = self.iter_messages(chat, limit=limit, reverse=False)
             async for message in self.reverse_async_iter(messages, limit=limit):
                 if self.only_today:
                     message_china_time = message.date + self.china_timezone_offset
                     if message_china_time.date() != self.today:
                         continue
-                self.random_wait(200, 1000)
                 if message.media:
                     if hasattr(message.document, 'mime_type') and self.contains(message.document.mime_type, 'video') and self.nocontains(message.message, self.exclude):
                         size = message.document.size
@@ -475,10 +559,11 @@ class TGForwarder:
                                     for keyword in keywords:
                                         if keyword in text:
                                             text = text.replace(keyword, url)
-                        if size not in sizes:
-                            await self.copy_and_send_message(chat_name, self.forward_to_channel, message.id, text)
-                            sizes.append(size)
-                            self.total += 1
+                        if self.claim(sizes, size):
+                            if await self.copy_and_send_message(chat_name, self.forward_to_channel, message.id, text):
+                                self.counters[chat_name] += 1
+                            else:
+                                self.release(sizes, size)
                         else:
                             logger.info(f'视频已经存在，size: {size}')
                     elif self.contains(message.message, self.include) and message.message and self.nocontains(message.message, self.exclude):
@@ -486,10 +571,9 @@ class TGForwarder:
                         matches = re.findall(self.pattern, message.message) if self.contains(message.message, self.urls_kw) else []
                         if matches or jumpLinks:
                             link = jumpLinks[0] if jumpLinks else matches[0]
-                            if link not in links:
-                                await self.dispatch_channel(message, jumpLinks)
-                                self.total += 1
-                                links.append(link)
+                            if self.claim(links, link):
+                                await self.dispatch_claimed(links, link, message, jumpLinks)
+                                self.counters[chat_name] += 1
                             else:
                                 logger.info(f'链接已存在，link: {link}')
                     elif self.check_replies and message.message and self.nocontains(message.message, self.exclude):
@@ -498,20 +582,20 @@ class TGForwarder:
                         for r in replies:
                             if hasattr(r.document, 'mime_type') and self.contains(r.document.mime_type, 'video') and self.nocontains(r.message, self.exclude):
                                 size = r.document.size
-                                if size not in sizes:
-                                    await self.copy_and_send_message(chat_name, self.forward_to_channel, r.id, r.message)
-                                    self.total += 1
-                                    sizes.append(size)
+                                if self.claim(sizes, size):
+                                    if await self.copy_and_send_message(chat_name, self.forward_to_channel, r.id, r.message):
+                                        self.counters[chat_name] += 1
+                                    else:
+                                        self.release(sizes, size)
                                 else:
                                     logger.info(f'视频已经存在，size: {size}')
                             elif self.contains(r.message, self.include) and r.message and self.nocontains(r.message, self.exclude):
                                 matches = re.findall(self.pattern, r.message)
                                 if matches:
                                     link = matches[0]
-                                    if link not in links:
-                                        await self.dispatch_channel(message)
-                                        self.total += 1
-                                        links.append(link)
+                                    if self.claim(links, link):
+                                        await self.dispatch_claimed(links, link, message)
+                                        self.counters[chat_name] += 1
                                     else:
                                         logger.info(f'链接已存在，link: {link}')
                 elif message.message:
@@ -520,30 +604,31 @@ class TGForwarder:
                         matches = re.findall(self.pattern, message.message) if self.contains(message.message, self.urls_kw) else []
                         if matches or jumpLinks:
                             link = jumpLinks[0] if jumpLinks else matches[0]
-                            if link not in links:
-                                await self.dispatch_channel(message, jumpLinks)
-                                self.total += 1
-                                links.append(link)
+                            if self.claim(links, link):
+                                await self.dispatch_claimed(links, link, message, jumpLinks)
+                                self.counters[chat_name] += 1
                             else:
                                 logger.info(f'链接已存在，link: {link}')
-            logger.info(f"从 {chat_name} 转发资源 成功: {self.total}")
-            return list(set(links)), list(set(sizes))
+            logger.info(f"从 {chat_name} 转发资源 成功: {self.counters[chat_name]}")
         except Exception as e:
+            self.forget_channel_entity(chat_name, e)
             logger.error(f"从 {chat_name} 转发资源 失败: {e}")
 
     async def main(self):
         start_time = time.time()
         links, sizes = await self.checkhistory()
+        self.links.update(links)
+        self.sizes.update(sizes)
 
-        # 过滤掉不存在的频道
+        # 并发解析频道实体(已缓存的不请求服务器)，过滤掉不存在的频道
+        names = [channel_name.split('|')[0] for channel_name in self.channels_groups_monitor]
+        entities = await asyncio.gather(*(self.get_channel_entity(name) for name in names))
         valid_channels = []
-        for channel_name in self.channels_groups_monitor:
-            if '|' in channel_name:
-                channel_name = channel_name.split('|')[0]
-            if await self.get_channel_entity(channel_name):
+        for channel_name, name, entity in zip(self.channels_groups_monitor, names, entities):
+            if entity:
                 valid_channels.append(channel_name)
             else:
-                logger.info(f"跳过不存在的频道: {channel_name}")
+                logger.info(f"跳过不存在的频道: {name}")
 
         # 如果没有有效的频道，记录日志并结束
         if not valid_channels:
@@ -551,20 +636,25 @@ class TGForwarder:
             await self.client.disconnect()
             return
 
-        # 并发处理有效的频道
+        # 并发处理有效的频道，最多同时扫描 scan_concurrency 个，共享去重集合
+        semaphore = asyncio.Semaphore(scan_concurrency)
+
+        async def scan(chat_name, limit):
+            async with semaphore:
+                await self.forward_messages(chat_name, limit)
+
         tasks = []
         for chat_name in valid_channels:
             limit = self.limit
             if '|' in chat_name:
                 limit = int(chat_name.split('|')[1])
                 chat_name = chat_name.split('|')[0]
-            tasks.append(self.forward_messages(chat_name, limit, links, sizes))
+            tasks.append(scan(chat_name, limit))
 
-        # 等待所有任务完成
-        results = await asyncio.gather(*tasks)
-        for result in results:
-            if result:
-                links, sizes = result
+        # 等待所有任务完成，汇总各频道转发数
+        await asyncio.gather(*tasks)
+        logger.info(f"本次共转发资源: {sum(self.counters.values())}")
+        links, sizes = self.links, self.sizes
 
         await self.send_daily_forwarded_count()
         with open(self.history, 'w+', encoding='utf-8') as f:
@@ -345,10 +345,16 @@ class TGForwarder:
         start_time = datetime.strptime(start_time_str, "%Y-%m-%d %H:%M").replace(tzinfo=china_timezone)
         end_time = datetime.strptime(end_time_str, "%Y-%m-%d %H:%M").replace(tzinfo=china_timezone)
         chat = await self.client.get_entity(chat_name)
-        async for message in self.client.iter_messages(chat):
-            message_china_time = message.date.astimezone(china_timezone)
-            if start_time <= message_china_time <= end_time:
-                await message.delete()
+        message_ids = []
+        # 从结束时间直接跳到范围内(offset_date 取该时间之前的消息，加 1 秒包含结束时间)，早于开始时间即停止
+        async for message in self.client.iter_messages(chat, offset_date=end_time + timedelta(seconds=1)):
+            if message.date < start_time:
+                break
+            message_ids.append(message.id)
+        logger.info(f"【{chat_name}】删除 {len(message_ids)} 条消息")
+        for i in range(0, len(message_ids), 100):
+            batch = message_ids[i:i + 100]
+            await self.client.delete_messages(chat, batch)
 
     async def clear_main(self, start_time, end_time):
         await self.delete_messages_in_time_range(self.forward_to_channel, start_time, end_time)
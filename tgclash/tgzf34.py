@@ -16,6 +16,7 @@ from telethon.tl.functions.messages import GetHistoryRequest
 from telethon.tl.functions.channels import JoinChannelRequest
 from collections import deque
 from telethon import errors
+from TGForwarder import PeerCache, peers_path, PEER_ERRORS
 
 # 设置日志
 logging.basicConfig(
@@ -112,6 +113,7 @@ class TGForwarder:
             self.client = TelegramClient(StringSession(string_session), api_id, api_hash)
         else:
             self.client = TelegramClient(StringSession(string_session), api_id, api_hash, proxy=proxy)
+        self.peers = PeerCache(peers_path(string_session))  # 频道实体磁盘缓存，按账号区分，跨运行复用
 
     def random_wait(self, min_ms, max_ms):
         min_sec = min_ms / 1000
@@ -180,7 +182,12 @@ class TGForwarder:
     async def get_peer(self, client, channel_name):
         peer = None
         try:
-            peer = await client.get_input_entity(channel_name)
+            # 优先使用磁盘缓存的 id/access_hash，未缓存时才向服务器解析
+            peer = self.peers.get(channel_name)
+            if peer is None:
+                peer = await client.get_input_entity(channel_name)
+                self.peers.set(channel_name, peer)
+                self.peers.save()
         except Exception as e:
             logger.warning(f"频道 {channel_name} 不存在或无法访问: {e}")
         finally:
@@ -354,10 +361,16 @@ class TGForwarder:
         start_time = datetime.strptime(start_time_str, "%Y-%m-%d %H:%M").replace(tzinfo=china_timezone)
         end_time = datetime.strptime(end_time_str, "%Y-%m-%d %H:%M").replace(tzinfo=china_timezone)
         chat = await self.client.get_entity(chat_name)
-        async for message in self.client.iter_messages(chat):
-            message_china_time = message.date.astimezone(china_timezone)
-            if start_time <= message_china_time <= end_time:
-                await message.delete()
+        message_ids = []
+        # 从结束时间直接跳到范围内(offset_date 取该时间之前的消息，加 1 秒包含结束时间)，早于开始时间即停止
+        async for message in self.client.iter_messages(chat, offset_date=end_time + timedelta(seconds=1)):
+            if message.date < start_time:
+                break
+            message_ids.append(message.id)
+        logger.info(f"【{chat_name}】删除 {len(message_ids)} 条消息")
+        for i in range(0, len(message_ids), 100):
+            batch = message_ids[i:i + 100]
+            await self.client.delete_messages(chat, batch)
 
     async def clear_main(self, start_time, end_time):
         await self.delete_messages_in_time_range(self.forward_to_channel, start_time, end_time)
@@ -499,7 +512,7 @@ class TGForwarder:
         try:
             if try_join:
                 await self.client(JoinChannelRequest(chat_name))
-            chat = await self.client.get_entity(chat_name)
+            chat = await self.get_peer(self.client, chat_name)
             messages = self.client.iter_messages(chat, limit=limit, reverse=False)
             async for message in self.reverse_async_iter(messages, limit=limit):
                 if self.recent_days > 0:  # 如果 recent_days 大于 0，则过滤消息
@@ -597,6 +610,9 @@ class TGForwarder:
             logger.info(f"从 {chat_name} 转发资源 成功: {total}")
             return list(set(links)), list(set(sizes))
         except Exception as e:
+            # 缓存的频道实体已失效时清除，下次重新解析
+            if isinstance(e, PEER_ERRORS) and self.peers.invalidate(chat_name):
+                self.peers.save()
             logger.error(f"从 {chat_name} 转发资源 失败: {e}")
 
     async def check_channel_existence(self, channel_name):
@@ -605,23 +621,18 @@ class TGForwarder:
         :param channel_name: 频道名称或ID
         :return: 如果频道存在返回 True，否则返回 False
         """
-        try:
-            await self.client.get_entity(channel_name)
-            return True
-        except Exception as e:
-            logger.warning(f"频道 {channel_name} 不存在或无法访问: {e}")
-            return False
+        return await self.get_peer(self.client, channel_name) is not None
 
     async def main(self):
         start_time = time.time()
         links, sizes = await self.checkhistory()
 
-        # 过滤掉不存在的频道
+        # 并发检查频道(已缓存的不请求服务器)，过滤掉不存在的频道
+        names = [channel_name.split('|')[0] for channel_name in self.channels_groups_monitor]
+        exists = await asyncio.gather(*(self.check_channel_existence(name) for name in names))
         valid_channels = []
-        for channel_name in self.channels_groups_monitor:
-            if '|' in channel_name:
-                channel_name = channel_name.split('|')[0]
-            if await self.check_channel_existence(channel_name):
+        for channel_name, ok in zip(names, exists):
+            if ok:
                 valid_channels.append(channel_name)
             else:
                 logger.info(f"跳过不存在的频道: {channel_name}")